@@ -9,8 +9,14 @@ from new_agri_bot_backend.tables import (
     ProductGuide,
     AvailableStock,
     FreeStock,
+    BiSnapshots,
 )
 from new_agri_bot_backend.cache import cached_endpoint
+from new_agri_bot_backend.response_formats import (
+    BINARY_FORMAT_RESPONSES,
+    dumps_json,
+    JSONBody,
+)
 
 router = APIRouter(
     prefix="/api/v2",
@@ -19,7 +25,7 @@ router = APIRouter(
 
 
 @router.get("/remains")
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_remains():
     remains_with_series = (
         await Remains.select(
@@ -57,14 +63,54 @@ priority_divisions = [
     "Дніпровський підрозділ",
     "Запорізький підрозділ",
 ]
+# Позиция подразделения в приоритете — для сортировки без поиска по списку
+priority_rank = {division: rank for rank, division in enumerate(priority_divisions)}
 
 # Используем defaultdict для удобного добавления товаров в списки по ключам без дополнительных проверок.
 from collections import defaultdict
 
 
-@router.get("/combined")
-@cached_endpoint()
+# Снимок /combined в bi_snapshots и таблицы, при изменении которых он пересчитывается
+COMBINED_SNAPSHOT = "combined"
+COMBINED_SOURCES = (FreeStock, Remains, Submissions, ProductGuide)
+
+
+@router.get("/combined", responses=BINARY_FORMAT_RESPONSES)
+@cached_endpoint(tables=COMBINED_SOURCES, formats=True)
 async def combined_endpoint():
+    """
+    Отдает снимок, посчитанный при последней загрузке данных (save_combined_snapshot).
+    Если снимка еще нет, считает его и сохраняет.
+    """
+    row = (
+        await BiSnapshots.select(BiSnapshots.payload)
+        .where(BiSnapshots.name == COMBINED_SNAPSHOT)
+        .first()
+        .run()
+    )
+    # Снимок — уже готовый JSON: отдаем байты в кэш без разбора и повторного кодирования
+    if row is not None:
+        return JSONBody(row["payload"])
+    return JSONBody(await save_combined_snapshot())
+
+
+async def save_combined_snapshot() -> bytes:
+    """Пересчитывает /combined и сохраняет JSON в bi_snapshots; возвращает сохраненное тело."""
+    payload = dumps_json(await compute_combined())
+    await BiSnapshots.raw(
+        """
+        INSERT INTO bi_snapshots (name, payload, created_at)
+        VALUES ({}, {}, now())
+        ON CONFLICT (name) DO UPDATE
+        SET payload = EXCLUDED.payload, created_at = EXCLUDED.created_at
+        """,
+        COMBINED_SNAPSHOT,
+        payload,
+    ).run()
+    return payload
+
+
+async def compute_combined():
     # Инициализация вспомогательных словарей внутри функции, чтобы не сохранять состояние между вызовами.
     remains_map = {}
     available_map = defaultdict(list)
@@ -170,11 +216,7 @@ async def combined_endpoint():
             sorted_available_stock = sorted(
                 available_map.get(product, []),
                 key=lambda x: (
-                    (
-                        priority_divisions.index(x["division"])
-                        if x["division"] in priority_divisions
-                        else len(priority_divisions)
-                    ),
+                    priority_rank.get(x["division"], len(priority_divisions)),
                     x["division"],
                 ),
             )
@@ -16,6 +16,7 @@ from new_agri_bot_backend.tables import (
     ProductGuide,
 )
 from new_agri_bot_backend.cache import cached_endpoint
+from new_agri_bot_backend.response_formats import BINARY_FORMAT_RESPONSES
 
 router = APIRouter(
     prefix="/api",  # Используем новый префикс для пандас-версии
@@ -33,8 +34,10 @@ priority_divisions = [
 ]
 
 
-@router.get("/combined")
-@cached_endpoint()
+@router.get("/combined", responses=BINARY_FORMAT_RESPONSES)
+@cached_endpoint(
+    tables=(Submissions, Remains, ValidFreeStock, MovedData, ProductGuide), formats=True
+)
 async def combined_pandas_endpoint(
     document_status: Optional[List[str]] = Query(
         None, description="Список статусів документів для фільтрації"
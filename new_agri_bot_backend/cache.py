@@ -1,9 +1,66 @@
 # app/cache.py
+import asyncio
+import hashlib
+import inspect
+import sys
 import time
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from functools import wraps
-from typing import Any, Optional
+from typing import Any, Dict, Optional
+from fastapi import Request, Response
 from .config import logger, USE_CACHE
+from .response_formats import (
+    ENCODERS,
+    FORMAT_MEDIA_TYPES,
+    JSON_MEDIA_TYPE,
+    JSONBody,
+    encode_body,
+    loads_json,
+    negotiate_format,
+)
+
+# Представления -> таблицы, из которых они строятся. Кэш эндпоинта, читающего
+# представление, сбрасывается при изменении любой из этих таблиц.
+VIEW_DEPENDENCIES = {
+    "product_on_warehouse": ("remains", "product_guide"),
+    "av_stock_prod": ("available_stock", "product_guide"),
+    "products_for_orders": ("submissions", "remains", "product_guide"),
+    "details_for_orders": ("submissions", "remains", "moved_data", "product_guide"),
+    "valid_free_stock": ("free_stock", "valid_warehouse_admin"),
+    "product_stock_totals": ("remains", "submissions", "product_guide"),
+}
+
+
+def table_tags(tables) -> frozenset:
+    """Имена таблиц (классы Piccolo или строки) с раскрытием представлений в базовые таблицы."""
+    tags = set()
+    for table in tables:
+        name = table if isinstance(table, str) else table._meta.tablename
+        tags.update(VIEW_DEPENDENCIES.get(name, (name,)))
+    return frozenset(tags)
+
+
+def key_prefix(key: str) -> str:
+    """Имя эндпоинта из ключа вида endpoint:<имя>:<аргументы> — по нему группируется статистика."""
+    if key.startswith("endpoint:"):
+        return key.split(":", 2)[1]
+    return "other"
+
+
+def approx_size(value: Any, _seen: Optional[set] = None) -> int:
+    """Приблизительный объем объекта в памяти (байт) с учетом вложенных dict/list/tuple/set."""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, _seen) for item in value)
+    return size
+
 
 class InMemoryCache:
     def __init__(self, max_size: int = 500, default_ttl: int = 3600):
@@ -14,40 +71,166 @@ class InMemoryCache:
         """
         self.max_size = max_size
         self.default_ttl = default_ttl
-        # Хранит пары key -> (value, expire_time)
+        # Хранит key -> (value, expire_time, tags, created_at)
         self._cache: OrderedDict = OrderedDict()
+        # Счетчики по эндпоинтам: hits, misses, coalesced, evictions, expirations,
+        # invalidations, computes, compute_ms, max_compute_ms
+        self._stats: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        # Обратный индекс: таблица -> ключи, зависящие от нее. Пустой tags
+        # означает "зависит от всего" и хранится под тегом "*".
+        self._keys_by_tag: Dict[str, set] = {}
+        # Счетчики инвалидаций по таблицам, чтобы не сохранить результат,
+        # посчитанный до инвалидации (см. version())
+        self._versions: Dict[str, int] = {}
+        self._clear_version = 0
+
+    def _remove(self, key: str, reason: Optional[str] = None):
+        _, _, tags, _ = self._cache.pop(key)
+        if reason:
+            self._stats[key_prefix(key)][reason] += 1
+        for tag in tags or ("*",):
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
 
     def get(self, key: str) -> Optional[Any]:
         if key not in self._cache:
+            self._stats[key_prefix(key)]["misses"] += 1
             return None
         
-        value, expire_time = self._cache[key]
+        value, expire_time, _, _ = self._cache[key]
         if expire_time is not None and time.time() > expire_time:
             # Срок действия истек
-            self._cache.pop(key)
+            self._remove(key, "expirations")
+            self._stats[key_prefix(key)]["misses"] += 1
             return None
         
         # Переносим в конец очереди (как недавно использованный)
         self._cache.move_to_end(key)
+        self._stats[key_prefix(key)]["hits"] += 1
         return value
 
-    def set(self, key: str, value: Any, ttl: Optional[int] = None):
-        if len(self._cache) >= self.max_size:
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: frozenset = frozenset()):
+        if key in self._cache:
+            self._remove(key)
+        elif len(self._cache) >= self.max_size:
             # Удаляем самый старый элемент (первый)
-            self._cache.popitem(last=False)
+            self._remove(next(iter(self._cache)), "evictions")
             
         ttl = ttl if ttl is not None else self.default_ttl
-        expire_time = time.time() + ttl if ttl > 0 else None
-        self._cache[key] = (value, expire_time)
-        self._cache.move_to_end(key)
+        now = time.time()
+        expire_time = now + ttl if ttl > 0 else None
+        self._cache[key] = (value, expire_time, tags, now)
+        for tag in tags or ("*",):
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+
+    def delete(self, key: str) -> bool:
+        """Удаляет одну запись; False — если ее не было."""
+        if key not in self._cache:
+            return False
+        self._remove(key, "invalidations")
+        return True
+
+    def version(self, tags: frozenset) -> tuple:
+        """Снимок счетчиков инвалидаций для набора таблиц."""
+        if not tags:
+            return (self._clear_version, sum(self._versions.values()))
+        return (self._clear_version,) + tuple(self._versions.get(t, 0) for t in sorted(tags))
+
+    def invalidate(self, *tables) -> int:
+        """
+        Удаляет записи, зависящие от указанных таблиц (классы Piccolo или имена),
+        а также записи без тегов. Возвращает число удаленных записей.
+        """
+        tags = table_tags(tables)
+        keys = set(self._keys_by_tag.get("*", ()))
+        for tag in tags:
+            self._versions[tag] = self._versions.get(tag, 0) + 1
+            keys.update(self._keys_by_tag.get(tag, ()))
+        for key in keys:
+            self._remove(key, "invalidations")
+        logger.info(f"🧹 Кэш сброшен для таблиц {', '.join(sorted(tags))}: удалено записей {len(keys)}.")
+        return len(keys)
 
-    def clear(self):
+    def record(self, key: str, counter: str, value: float = 1):
+        """Увеличивает счетчик эндпоинта (для событий вне самого кэша, например coalesced)."""
+        self._stats[key_prefix(key)][counter] += value
+
+    def record_compute(self, key: str, elapsed_ms: float):
+        stats = self._stats[key_prefix(key)]
+        stats["computes"] += 1
+        stats["compute_ms"] += elapsed_ms
+        stats["max_compute_ms"] = max(stats["max_compute_ms"], elapsed_ms)
+
+    def stats(self, with_bytes: bool = True) -> Dict[str, Any]:
+        """
+        Сводка по кэшу и по каждому эндпоинту: размер, hit ratio, вытеснения,
+        возраст самой старой записи и (по желанию) примерный объем в байтах.
+        Подсчет байт обходит все закэшированные значения, поэтому не для горячего пути.
+        """
+        now = time.time()
+        entries: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        oldest_created = None
+        for key, (value, _, _, created_at) in self._cache.items():
+            entry = entries[key_prefix(key)]
+            entry["entries"] += 1
+            entry["oldest_entry_age_s"] = max(entry["oldest_entry_age_s"], now - created_at)
+            if with_bytes:
+                entry["approx_bytes"] += approx_size(value)
+            oldest_created = created_at if oldest_created is None else min(oldest_created, created_at)
+
+        endpoints = {}
+        totals: Dict[str, float] = defaultdict(float)
+        for name in sorted(set(self._stats) | set(entries)):
+            counters = dict(self._stats.get(name, {}))
+            counters.update(entries.get(name, {}))
+            lookups = counters.get("hits", 0) + counters.get("misses", 0)
+            counters["hit_ratio"] = round(counters.get("hits", 0) / lookups, 4) if lookups else None
+            if counters.get("computes"):
+                counters["avg_compute_ms"] = round(counters["compute_ms"] / counters["computes"], 2)
+            endpoints[name] = {
+                k: (int(v) if float(v).is_integer() else round(v, 2)) if v is not None else None
+                for k, v in counters.items()
+            }
+            for counter in ("hits", "misses", "coalesced", "evictions", "expirations", "invalidations", "approx_bytes"):
+                totals[counter] += counters.get(counter, 0)
+
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "default_ttl": self.default_ttl,
+            "hits": int(totals["hits"]),
+            "misses": int(totals["misses"]),
+            "coalesced": int(totals["coalesced"]),
+            "hit_ratio": round(totals["hits"] / lookups, 4) if lookups else None,
+            "evictions": int(totals["evictions"]),
+            "expirations": int(totals["expirations"]),
+            "invalidations": int(totals["invalidations"]),
+            "oldest_entry_age_s": round(now - oldest_created, 1) if oldest_created else None,
+            "approx_bytes": int(totals["approx_bytes"]) if with_bytes else None,
+            "endpoints": endpoints,
+        }
+
+    def clear(self) -> int:
+        """Удаляет все записи; возвращает их число."""
+        dropped = len(self._cache)
         self._cache.clear()
-        logger.info("🧹 In-memory кэш бэкенда полностью очищен.")
+        self._keys_by_tag.clear()
+        self._clear_version += 1
+        logger.info(f"🧹 In-memory кэш полностью очищен (записей: {dropped}).")
+        return dropped
 
 # Глобальный инстанс кэша
 db_cache = InMemoryCache()
 
+# Зарегистрированные кэшируемые эндпоинты: "<модуль>.<функция>" -> обертка (для прогрева)
+endpoint_registry: Dict[str, Any] = {}
+
+# Вычисления, которые сейчас выполняются: ключ кэша -> (задача, версия таблиц на старте).
+# Параллельные промахи по одному ключу ждут одну и ту же задачу (single-flight).
+_inflight: Dict[str, tuple] = {}
+
 def serialize_arg(val: Any) -> str:
     """Рекурсивно сериализует аргументы функции для генерации уникального ключа кэша."""
     if val is None:
@@ -79,37 +262,207 @@ def generate_key(func_name: str, args: tuple, kwargs: dict) -> str:
     kwargs_str = str(sorted(serialized_kwargs.items()))
     return f"endpoint:{func_name}:{serialized_args}:{kwargs_str}"
 
-def cached_endpoint(ttl: Optional[int] = None):
+def _forget_inflight(key: str, task: asyncio.Task):
+    if _inflight.get(key, (None,))[0] is task:
+        del _inflight[key]
+    # Помечаем исключение как полученное, даже если все ожидающие уже отменены
+    if not task.cancelled():
+        task.exception()
+
+def content_etag(body: bytes) -> str:
+    """ETag по телу ответа: одинаковые данные дают одинаковый тег и после перезагрузки Excel."""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Слабое сравнение (RFC 9110): префикс W/ не учитывается
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+def cache_entry(body: bytes, etag: Optional[str]) -> tuple:
+    """
+    Запись кэша эндпоинта: JSON-тело, его ETag и словарь формат -> тело в этом формате.
+    Бинарные форматы кодируются при первом запросе и хранятся в той же записи, поэтому
+    живут и сбрасываются вместе с JSON (те же теги и TTL).
+    """
+    return body, etag, {}
+
+
+def format_body(entry: tuple, fmt: str) -> bytes:
+    body, _, encoded = entry
+    if fmt == "json":
+        return body
+    if fmt not in encoded:
+        encoded[fmt] = ENCODERS[fmt](loads_json(body))
+    return encoded[fmt]
+
+
+def conditional_response(entry: tuple, request: Optional[Request], formats: bool = False):
+    """
+    Ответ из записи кэша: для GET/HEAD с совпадающим If-None-Match — пустой 304,
+    иначе — готовое тело как есть (без повторного кодирования) с заголовком ETag.
+    Без request (прямой вызов функции, а не HTTP-запрос) — разобранный результат.
+    formats: эндпоинт отдает и бинарные форматы (response_formats) по заголовку Accept;
+    у каждого формата свой ETag, а закодированное тело берется из записи кэша.
+    """
+    body, etag, _ = entry
+    if request is None:
+        return loads_json(body)
+    headers = {}
+    fmt = "json"
+    if formats:
+        fmt = negotiate_format(request.headers.get("accept"))
+        headers["Vary"] = "Accept"
+        if etag is not None and fmt != "json":
+            etag = f'{etag[:-1]}-{fmt}"'
+    if etag is not None and request.method in ("GET", "HEAD"):
+        headers.update({"ETag": etag, "Cache-Control": "no-cache"})
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+    media_type = FORMAT_MEDIA_TYPES.get(fmt, JSON_MEDIA_TYPE)
+    return Response(content=format_body(entry, fmt), media_type=media_type, headers=headers)
+
+
+def with_http_params(wrapper, func):
+    """
+    Добавляет в сигнатуру эндпоинта служебный параметр Request, чтобы FastAPI
+    передавал его в обертку кэша. Аннотации исходной функции вычисляются в ее модуле.
+    """
+    signature = inspect.signature(func, eval_str=True)
+    params = [p for p in signature.parameters.values() if p.kind != p.VAR_KEYWORD]
+    params += [
+        inspect.Parameter("_cache_request", inspect.Parameter.KEYWORD_ONLY, default=None, annotation=Request),
+    ]
+    params += [p for p in signature.parameters.values() if p.kind == p.VAR_KEYWORD]
+    wrapper.__signature__ = signature.replace(parameters=params)
+    return wrapper
+
+
+def cached_endpoint(ttl: Optional[int] = None, tables=(), formats: bool = False):
     """
     Декоратор для кэширования ответов эндпоинтов FastAPI.
     ttl: время жизни кэша для данного эндпоинта в секундах (None - по умолчанию).
+    tables: таблицы/представления, из которых читает эндпоинт. Запись сбрасывается
+    через db_cache.invalidate() только при изменении этих таблиц; без tables —
+    при любой инвалидации.
+    Одновременные промахи по одному ключу объединяются: запрос к БД выполняется один раз.
+    В кэше лежит уже сериализованное JSON-тело (orjson) и его хэш: попадание отдает
+    байты без jsonable_encoder и повторного кодирования (эндпоинт может сразу вернуть
+    готовое тело в JSONBody — тогда не кодируется и промах), GET-ответы получают ETag,
+    а запрос с совпадающим If-None-Match — 304 без тела.
+    formats: кроме JSON отдавать msgpack/Arrow по заголовку Accept (см. response_formats);
+    тело в каждом формате кодируется один раз на запись кэша.
     """
+    tags = table_tags(tables)
+
     def decorator(func):
+        # Имя с модулем: одноименные эндпоинты разных роутеров (bi.get_remains и
+        # data_retrieval.get_remains) не должны делить записи кэша
+        name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
+            request = kwargs.pop("_cache_request", None)
             if not USE_CACHE:
                 start_time = time.perf_counter()
                 result = await func(*args, **kwargs)
                 elapsed_ms = (time.perf_counter() - start_time) * 1000
                 logger.info(f"ℹ️ Кэш отключен. Запрос к БД для {func.__name__} выполнен за {elapsed_ms:.2f} мс.")
-                return result
+                if request is None:
+                    return loads_json(result.body) if isinstance(result, JSONBody) else result
+                return conditional_response(cache_entry(encode_body(result), None), request, formats)
             
-            key = generate_key(func.__name__, args, kwargs)
+            entry = await cached_entry(*args, **kwargs)
+            return conditional_response(entry, request, formats)
+
+        async def cached_entry(*args, **kwargs):
+            """Запись кэша для аргументов: из кэша или после (общего) запроса к БД."""
+            key = generate_key(name, args, kwargs)
             
-            start_time = time.perf_counter()
             cached_value = db_cache.get(key)
             if cached_value is not None:
-                elapsed_ms = (time.perf_counter() - start_time) * 1000
-                logger.info(f"⚡ Кэш сработал для эндпоинта {func.__name__} (взят из RAM за {elapsed_ms:.2f} мс). Ключ: {key}")
                 return cached_value
             
-            logger.info(f"🐢 Кэш промахнулся для эндпоинта {func.__name__}. Делаем запрос к БД...")
+            version = db_cache.version(tags)
+            task, task_version = _inflight.get(key, (None, None))
+            # Задачу, начатую до инвалидации таблиц, не переиспользуем
+            if task is None or task_version != version:
+                task = asyncio.ensure_future(compute(key, version, *args, **kwargs))
+                _inflight[key] = (task, version)
+                task.add_done_callback(lambda t: _forget_inflight(key, t))
+            else:
+                db_cache.record(key, "coalesced")
+            # shield: отмена одного клиента не должна отменять общий запрос для остальных
+            return await asyncio.shield(task)
+
+        async def compute(key, version, /, *args, **kwargs):
             start_time_db = time.perf_counter()
             result = await func(*args, **kwargs)
             elapsed_ms_db = (time.perf_counter() - start_time_db) * 1000
-            
-            db_cache.set(key, result, ttl=ttl)
+            db_cache.record_compute(key, elapsed_ms_db)
+            body = encode_body(result)
+            entry = cache_entry(body, content_etag(body))
+
+            if db_cache.version(tags) != version:
+                # Пока шел запрос, таблицы изменились: результат мог устареть, не кэшируем
+                return entry
+            db_cache.set(key, entry, ttl=ttl, tags=tags)
             logger.info(f"💾 Запрос к БД для {func.__name__} сохранен в кэш. Время выполнения: {elapsed_ms_db:.2f} мс.")
-            return result
-        return wrapper
+            return entry
+        # Прогрев заполняет кэш напрямую, без сборки ответа и разбора тела
+        wrapper.cached_entry = cached_entry
+        endpoint_registry[name] = wrapper
+        return with_http_params(wrapper, func)
     return decorator
+
+
+def default_call_kwargs(func) -> Optional[Dict[str, Any]]:
+    """
+    Аргументы, с которыми FastAPI вызовет эндпоинт без параметров в запросе: значения
+    по умолчанию, включая Query(...). None — если у эндпоинта есть обязательные
+    параметры или зависимости (Depends), и прогреть его без запроса нельзя.
+    """
+    kwargs = {}
+    for param in inspect.signature(inspect.unwrap(func)).parameters.values():
+        default = param.default
+        if default is inspect.Parameter.empty or hasattr(default, "dependency"):
+            return None
+        if hasattr(default, "is_required"):  # Query/Path/Body (FieldInfo)
+            if default.is_required():
+                return None
+            default = default.get_default(call_default_factory=True)
+        kwargs[param.name] = default
+    return kwargs
+
+
+async def warm_up(names) -> Dict[str, Any]:
+    """
+    Заранее заполняет кэш для эндпоинтов из списка (имена вида "bi.combined_endpoint")
+    с параметрами по умолчанию — так, как их запросит фронтенд без фильтров.
+    Эндпоинты прогреваются параллельно; возвращает время (мс) или текст ошибки по каждому.
+    Заполняется только запись кэша: тело не разбирается и ответ не собирается.
+    """
+    async def warm(name):
+        if not USE_CACHE:
+            return "кэш отключен"
+        wrapper = endpoint_registry.get(name)
+        if wrapper is None:
+            return "не найден"
+        kwargs = default_call_kwargs(wrapper)
+        if kwargs is None:
+            return "требует параметров"
+        start = time.perf_counter()
+        try:
+            await wrapper.cached_entry(**kwargs)
+        except Exception as e:
+            return f"ошибка: {e}"
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    names = list(names)
+    results = await asyncio.gather(*(warm(name) for name in names))
+    return dict(zip(names, results))
@@ -75,6 +75,48 @@ NP_API_KEY = os.getenv("NP_API_KEY")
 
 SEND_NOTIFICATIONS = os.getenv("SEND_NOTIFICATIONS", "true").lower() == "true"
 USE_CACHE = os.getenv("USE_CACHE", "true").lower() == "true"
+# Загрузка таблиц из Excel через бинарный COPY вместо пакетных INSERT
+USE_COPY_LOAD = os.getenv("USE_COPY_LOAD", "true").lower() == "true"
+# Число процессов для параллельного разбора Excel-файлов (1 — разбор в пуле потоков)
+EXCEL_PARSE_WORKERS = int(os.getenv("EXCEL_PARSE_WORKERS", "5"))
+# Движок чтения Excel: "calamine" (python-calamine) или "openpyxl"
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "calamine").lower()
+# Инкрементальная публикация Submissions/Remains: в БД пишутся только изменившиеся строки
+INCREMENTAL_LOAD = os.getenv("INCREMENTAL_LOAD", "true").lower() == "true"
+# Хранилище сессий ручного сопоставления: "memory" (один воркер) или "postgres" (таблица upload_sessions)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+# Время жизни сессии сопоставления в секундах (отсчитывается от последнего изменения)
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))
+# Максимум сессий в памяти процесса для SESSION_STORE=memory
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "50"))
+# Проверенные initData Telegram в памяти процесса: сколько строк помнить
+INIT_DATA_CACHE_SIZE = int(os.getenv("INIT_DATA_CACHE_SIZE", "1000"))
+# Сколько секунд от auth_date проверенная initData не перепроверяется
+INIT_DATA_TTL = int(os.getenv("INIT_DATA_TTL", "86400"))
+# Кэш пользователей (users) для авторизации запросов: время жизни записи в секундах и размер.
+# Отзыв доступа в БД (is_allowed/is_guest/is_admin) применяется в каждом воркере с задержкой до TTL
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "15"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1000"))
+# Хранилище токенов входа через бота: "memory" (один воркер) или "postgres" (таблица login_tokens)
+LOGIN_TOKEN_STORE = os.getenv("LOGIN_TOKEN_STORE", "memory").lower()
+# Очередь отправки в Telegram: не больше N запросов в секунду на бота (лимит Telegram ~30)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+# Минимальный интервал между запросами в один чат, секунд (лимит Telegram ~1 сообщение в секунду)
+TELEGRAM_CHAT_INTERVAL = float(os.getenv("TELEGRAM_CHAT_INTERVAL", "1.0"))
+# Сколько запросов к Bot API выполняется одновременно
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv("TELEGRAM_SEND_CONCURRENCY", "20"))
+# Сколько раз повторять запрос после 429 (retry_after) или сетевой ошибки
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "5"))
+# Эндпоинты, кэш которых прогревается после загрузки Excel до WS-уведомления клиентов (пусто — без прогрева)
+CACHE_WARMUP_ENDPOINTS = [
+    name.strip()
+    for name in os.getenv(
+        "CACHE_WARMUP_ENDPOINTS",
+        "data_retrieval.get_categories_tree,data_retrieval.get_all_product_by_guide,"
+        "bi.combined_endpoint,main.get_all_orders_and_address",
+    ).split(",")
+    if name.strip()
+]
 BACKEND_URL = os.getenv("BACKEND_URL", "")
 
 # --- Настройки CORS ---
@@ -3,16 +3,40 @@ import asyncio
 import csv
 import uuid
 import json
+import time
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 import numpy as np
 import re
 from typing import Dict, Any, Tuple, List, Optional
 
+from piccolo.columns import (
+    UUID,
+    Boolean,
+    BigInt,
+    Date,
+    DoublePrecision,
+    ForeignKey,
+    Integer,
+    Numeric,
+    Real,
+)
 from piccolo.query import Insert
 
-from .config import bot, ADMINS_ID, logger
+from .config import (
+    bot,
+    ADMINS_ID,
+    logger,
+    USE_COPY_LOAD,
+    EXCEL_PARSE_WORKERS,
+    INCREMENTAL_LOAD,
+    USE_CACHE,
+    CACHE_WARMUP_ENDPOINTS,
+)
 from .services.ordered_moved_notifications import notifications
 from .services.send_telegram_notification import send_notification
 
@@ -30,6 +54,8 @@ from .tables import (
     AddressGuide,
     ClientAddress,
     ValidWarehouseAdmin,
+    DetailsForOrders,
+    ProductStockTotals,
 )
 
 # Импорты функций обработки данных
@@ -54,6 +80,380 @@ async def run_in_threadpool(func, *args):
     return await loop.run_in_executor(executor, func, *args)
 
 
+# Пул процессов для разбора Excel: pandas/openpyxl держат GIL, потоки не дают параллелизма.
+# Создается лениво; spawn, т.к. fork процесса с запущенными потоками и event loop небезопасен.
+parse_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_executor() -> ProcessPoolExecutor:
+    global parse_executor
+    if parse_executor is None:
+        parse_executor = ProcessPoolExecutor(
+            max_workers=EXCEL_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return parse_executor
+
+
+def shutdown_parse_executor():
+    global parse_executor
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+        parse_executor = None
+
+
+async def run_in_processpool(func, *args):
+    """
+    Обертка для запуска синхронных функций в отдельном процессе.
+    При EXCEL_PARSE_WORKERS <= 1 выполняет функцию в пуле потоков, как раньше.
+    """
+    if EXCEL_PARSE_WORKERS <= 1:
+        return await run_in_threadpool(func, *args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_parse_executor(), func, *args)
+    except BrokenProcessPool:
+        # Упавший воркер ломает весь пул — пересоздаем его при следующем вызове
+        shutdown_parse_executor()
+        raise
+
+
+# --- Staging-таблицы для атомарной публикации загрузки ---
+
+# Таблицы, полностью перезаливаемые из Excel, в порядке публикации:
+# справочник товаров первым, т.к. на него ссылаются внешние ключи остальных таблиц.
+RELOADED_TABLES = (
+    ProductGuide,
+    AvailableStock,
+    Remains,
+    Submissions,
+    Payment,
+    MovedData,
+    FreeStock,
+)
+
+# Не даем двум загрузкам одновременно писать в одни и те же staging-таблицы:
+# asyncio.Lock — внутри процесса, advisory-lock Postgres с этим ключом — между воркерами
+_process_upload_lock = asyncio.Lock()
+UPLOAD_ADVISORY_LOCK_KEY = 7_420_001
+
+
+@asynccontextmanager
+async def upload_lock():
+    """
+    Эксклюзивная загрузка на всю БД. Session-level pg_advisory_lock держится на отдельном
+    соединении до конца загрузки и снимается при его закрытии — даже если воркер упал.
+    """
+    async with _process_upload_lock:
+        connection = await ProductGuide._meta.db.get_new_connection()
+        try:
+            await connection.execute("SELECT pg_advisory_lock($1)", UPLOAD_ADVISORY_LOCK_KEY)
+            yield
+        finally:
+            await connection.close()
+
+
+def staging_tablename(table) -> str:
+    return f"{table._meta.tablename}_staging"
+
+
+def make_staging_table(table):
+    """Piccolo-класс с колонками `table`, привязанный к его staging-копии."""
+    return type(
+        f"{table.__name__}Staging", (table,), {}, tablename=staging_tablename(table)
+    )
+
+
+STAGING_TABLES = {table: make_staging_table(table) for table in RELOADED_TABLES}
+
+
+async def prepare_staging_tables():
+    """
+    Пересоздает пустые staging-копии перезаливаемых таблиц.
+    Копии UNLOGGED и без внешних ключей/индексов: они живут только до публикации.
+    """
+    for table in RELOADED_TABLES:
+        staging = staging_tablename(table)
+        await table.raw(f'DROP TABLE IF EXISTS "{staging}"')
+        await table.raw(
+            f'CREATE UNLOGGED TABLE "{staging}" '
+            f'(LIKE "{table._meta.tablename}" INCLUDING DEFAULTS)'
+        )
+
+
+async def drop_staging_tables():
+    for table in RELOADED_TABLES:
+        await table.raw(f'DROP TABLE IF EXISTS "{staging_tablename(table)}"')
+
+
+# Натуральные ключи таблиц, которые при INCREMENTAL_LOAD обновляются построчно:
+# в рабочую таблицу попадают только вставки/изменения/удаления относительно прошлой выгрузки
+INCREMENTAL_KEYS = {
+    Submissions: ("product", "contract_supplement"),
+    Remains: ("product", "warehouse", "nomenclature_series"),
+}
+
+
+def _quoted_columns(table, include_pk: bool = True) -> List[str]:
+    return [
+        f'"{column._meta.db_column_name}"'
+        for column in table._meta.columns
+        if include_pk or not column._meta.primary_key
+    ]
+
+
+async def _count_rows(table, sql: str) -> int:
+    result = await table.raw(f"WITH affected AS ({sql} RETURNING 1) SELECT count(*) AS n FROM affected")
+    return result[0]["n"]
+
+
+async def apply_incremental_diff(table, key_columns) -> Dict[str, int]:
+    """
+    Переносит в рабочую таблицу только отличия от staging-копии.
+
+    Строки сопоставляются по натуральному ключу (при повторах ключа — по порядковому
+    номеру внутри ключа) и сравниваются по md5 от всех колонок, кроме id.
+    Неизменившиеся строки не трогаются: меньше мертвых кортежей и WAL.
+    Выполняется внутри транзакции публикации.
+    """
+    live = table._meta.tablename
+    staging = staging_tablename(table)
+    diff = f"{live}_diff"
+    data_columns = _quoted_columns(table, include_pk=False)
+    row_hash = f"md5(ROW({', '.join(data_columns)})::text)"
+    keys = ", ".join(f'"{k}"' for k in key_columns)
+    key_join = " AND ".join(
+        f"COALESCE(l.\"{k}\"::text, '') = COALESCE(s.\"{k}\"::text, '')" for k in key_columns
+    )
+    numbered = (
+        "SELECT id, {row_hash} AS row_hash, {keys}, "
+        "row_number() OVER (PARTITION BY {keys} ORDER BY {row_hash}) AS rn FROM \"{name}\""
+    )
+    await table.raw(f'DROP TABLE IF EXISTS "{diff}"')
+    await table.raw(
+        f'CREATE TEMP TABLE "{diff}" ON COMMIT DROP AS '
+        f"SELECT l.id AS live_id, s.id AS staging_id, "
+        f"l.row_hash IS DISTINCT FROM s.row_hash AS changed "
+        f"FROM ({numbered.format(row_hash=row_hash, keys=keys, name=live)}) l "
+        f"FULL JOIN ({numbered.format(row_hash=row_hash, keys=keys, name=staging)}) s "
+        f"ON {key_join} AND l.rn = s.rn"
+    )
+
+    deleted = await _count_rows(
+        table,
+        f'DELETE FROM "{live}" WHERE id IN '
+        f'(SELECT live_id FROM "{diff}" WHERE staging_id IS NULL)',
+    )
+    assignments = ", ".join(f"{c} = s.{c}" for c in data_columns)
+    updated = await _count_rows(
+        table,
+        f'UPDATE "{live}" AS t SET {assignments} '
+        f'FROM "{diff}" d JOIN "{staging}" s ON s.id = d.staging_id '
+        f"WHERE t.id = d.live_id AND d.changed",
+    )
+    all_columns = ", ".join(_quoted_columns(table))
+    source_columns = ", ".join(f"s.{c}" for c in _quoted_columns(table))
+    inserted = await _count_rows(
+        table,
+        f'INSERT INTO "{live}" ({all_columns}) SELECT {source_columns} '
+        f'FROM "{staging}" s JOIN "{diff}" d ON d.staging_id = s.id '
+        f"WHERE d.live_id IS NULL",
+    )
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+
+async def publish_staging_tables(tables) -> Dict[str, Dict[str, int]]:
+    """
+    Одной транзакцией переносит данные из staging в рабочие таблицы.
+    Возвращает число вставленных/измененных/удаленных строк по каждой таблице.
+
+    Таблицы не переименовываются: представления (details_for_orders,
+    product_on_warehouse и др.) и внешние ключи привязаны к конкретным таблицам,
+    а не к их именам. DELETE вместо TRUNCATE не берет ACCESS EXCLUSIVE-блокировку,
+    поэтому читатели не ждут и до коммита видят прежний набор данных целиком.
+
+    Справочник товаров не удаляется целиком (id товаров стабильны между выгрузками):
+    он дополняется/обновляется, а исчезнувшие товары удаляются в конце, когда
+    ссылающиеся на них строки уже заменены.
+    """
+    ordered = [t for t in RELOADED_TABLES if t in tables and t is not ProductGuide]
+    incremental = INCREMENTAL_KEYS if INCREMENTAL_LOAD else {}
+    changes = {}
+    deleted = {}
+    async with ProductGuide._meta.db.transaction():
+        # Сначала очищаем полностью заменяемые таблицы, ссылающиеся на справочник
+        for table in reversed(ordered):
+            if table not in incremental:
+                deleted[table] = await _count_rows(table, f'DELETE FROM "{table._meta.tablename}"')
+
+        if ProductGuide in tables:
+            columns = ", ".join(_quoted_columns(ProductGuide))
+            value_columns = _quoted_columns(ProductGuide, include_pk=False)
+            assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in value_columns)
+            # Неизменившиеся товары не перезаписываются, чтобы счетчик отражал реальные изменения
+            distinct = ", ".join(f"g.{c}" for c in value_columns)
+            excluded = ", ".join(f"EXCLUDED.{c}" for c in value_columns)
+            upserted = await _count_rows(
+                ProductGuide,
+                f'INSERT INTO "{ProductGuide._meta.tablename}" AS g ({columns}) '
+                f'SELECT {columns} FROM "{staging_tablename(ProductGuide)}" '
+                f"ON CONFLICT (id) DO UPDATE SET {assignments} "
+                f"WHERE ({distinct}) IS DISTINCT FROM ({excluded})",
+            )
+
+        for table in ordered:
+            if table in incremental:
+                changes[table.__name__] = await apply_incremental_diff(table, incremental[table])
+                continue
+            columns = ", ".join(_quoted_columns(table))
+            inserted = await _count_rows(
+                table,
+                f'INSERT INTO "{table._meta.tablename}" ({columns}) '
+                f'SELECT {columns} FROM "{staging_tablename(table)}"',
+            )
+            changes[table.__name__] = {"inserted": inserted, "updated": 0, "deleted": deleted[table]}
+
+        if ProductGuide in tables:
+            changes[ProductGuide.__name__] = {
+                "upserted": upserted,
+                "deleted": await _count_rows(
+                    ProductGuide,
+                    f'DELETE FROM "{ProductGuide._meta.tablename}" WHERE id NOT IN '
+                    f'(SELECT id FROM "{staging_tablename(ProductGuide)}")',
+                )
+            }
+    return changes
+
+
+# Материализованные представления и таблицы, из которых они строятся
+MATERIALIZED_VIEWS = {
+    DetailsForOrders: (Submissions, Remains, MovedData, ProductGuide),
+    ProductStockTotals: (Remains, Submissions, ProductGuide),
+}
+
+
+async def refresh_materialized_views(changed_tables) -> List:
+    """
+    Пересчитывает материализованные представления, исходные таблицы которых изменились.
+    CONCURRENTLY не блокирует чтение: до конца пересчета запросы видят прежние данные.
+    """
+    refreshed = []
+    for view, sources in MATERIALIZED_VIEWS.items():
+        if any(table in changed_tables for table in sources):
+            await view.raw(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{view._meta.tablename}"')
+            refreshed.append(view)
+    return refreshed
+
+
+# --- Массовая вставка DataFrame в таблицы ---
+
+BATCH_SIZE = 1000
+
+
+def _to_str(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return str(value)
+
+
+def _to_float(value):
+    return None if value is None else float(value)
+
+
+def _to_int(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return int(value)
+
+
+def _to_bool(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return bool(value)
+
+
+def _to_uuid(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value if isinstance(value, uuid.UUID) else str(value)
+
+
+def _to_date(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).date()
+    if hasattr(value, "date") and callable(value.date):
+        return value.date()
+    return value
+
+
+def _column_converter(column):
+    """Подбирает приведение значений колонки к типам, которые ждет бинарный COPY asyncpg."""
+    if isinstance(column, (UUID, ForeignKey)):
+        return _to_uuid
+    if isinstance(column, (DoublePrecision, Real, Numeric)):
+        return _to_float
+    if isinstance(column, (Integer, BigInt)):
+        return _to_int
+    if isinstance(column, Boolean):
+        return _to_bool
+    if isinstance(column, Date):
+        return _to_date
+    return _to_str
+
+
+def dataframe_to_copy_records(df: pd.DataFrame, columns) -> List[tuple]:
+    """Преобразует DataFrame в кортежи для copy_records_to_table, колонка за колонкой."""
+    prepared = []
+    for column in columns:
+        series = df[column._meta.name]
+        converter = _column_converter(column)
+        if converter is _to_float and series.dtype.kind == "f":
+            # float64 уже в нужном виде: NaN сохраняется как есть, как и при insert()
+            prepared.append(series.tolist())
+        else:
+            prepared.append([converter(value) for value in series.tolist()])
+    return list(zip(*prepared))
+
+
+async def copy_dataframe_to_table(table, df: pd.DataFrame, tablename: str = None) -> int:
+    """
+    Загружает DataFrame в таблицу бинарным COPY (asyncpg copy_records_to_table),
+    минуя создание Piccolo-объекта на каждую строку.
+    Колонки, отсутствующие в DataFrame, получают значения по умолчанию из БД.
+    """
+    columns = [c for c in table._meta.columns if c._meta.name in df.columns]
+    records = dataframe_to_copy_records(df, columns)
+    connection = await table._meta.db.get_new_connection()
+    try:
+        await connection.copy_records_to_table(
+            tablename or table._meta.tablename,
+            records=records,
+            columns=[c._meta.db_column_name for c in columns],
+        )
+    finally:
+        await connection.close()
+    return len(records)
+
+
+async def insert_dataframe_to_table(table, df: pd.DataFrame) -> int:
+    """Вставляет DataFrame через Piccolo insert() пачками по BATCH_SIZE строк."""
+    records = df.to_dict(orient="records")
+    rows = [table(**item) for item in records]
+    for i in range(0, len(rows), BATCH_SIZE):
+        batch = rows[i : i + BATCH_SIZE]
+        await table.insert().add(*list(batch)).run()
+    return len(rows)
+
+
+async def load_into_staging(table, df: pd.DataFrame) -> int:
+    """Заполняет staging-копию таблицы; способ вставки задается USE_COPY_LOAD."""
+    if USE_COPY_LOAD:
+        return await copy_dataframe_to_table(table, df, tablename=staging_tablename(table))
+    return await insert_dataframe_to_table(STAGING_TABLES[table], df)
+
+
 # --- Вспомогательная функция для конвертации типов ---
 
 
@@ -88,7 +488,35 @@ async def save_processed_data_to_db(
     """
     Асинхронная функция для обработки и сохранения данных в базу данных.
     Оркестрирует вызовы синхронных функций обработки и асинхронных операций с БД.
+    Новые данные сначала пишутся в staging-таблицы и публикуются одной транзакцией,
+    поэтому во время загрузки читатели видят прежний набор данных, а при ошибке
+    он остается нетронутым.
     """
+    async with upload_lock():
+        try:
+            await _save_processed_data_to_db(
+                av_stock_content,
+                remains_content,
+                submissions_content,
+                payment_content,
+                free_stock_content,
+                manual_matches_json,
+            )
+        finally:
+            try:
+                await drop_staging_tables()
+            except Exception as e:
+                logger.error(f"Не удалось удалить staging-таблицы: {e}")
+
+
+async def _save_processed_data_to_db(
+    av_stock_content: bytes,
+    remains_content: bytes,
+    submissions_content: bytes,
+    payment_content: bytes,
+    free_stock_content: bytes,
+    manual_matches_json: str = None,
+):
     log_messages = []
 
     def log(message):
@@ -97,12 +525,24 @@ async def save_processed_data_to_db(
 
     log("🚀 Начало обработки и сохранения данных...")
 
-    # 1. Запуск обработки Excel-файлов в отдельном потове
-    df_av_stock = await run_in_threadpool(process_av_stock, av_stock_content)
-
     valid_warehouses_db = await ValidWarehouseAdmin.select(ValidWarehouseAdmin.name).where(ValidWarehouseAdmin.is_active == True)
     valid_warehouse_list = [w['name'] for w in valid_warehouses_db]
-    df_remains, remains_all_warehouses = await run_in_threadpool(process_remains_reg, remains_content, valid_warehouse_list)
+
+    # 1. Обработка Excel-файлов: файлы независимы, разбираем их параллельно в пуле процессов
+    (
+        df_av_stock,
+        (df_remains, remains_all_warehouses),
+        df_submissions,
+        df_payment,
+        df_free_stock,
+    ) = await asyncio.gather(
+        run_in_processpool(process_av_stock, av_stock_content),
+        run_in_processpool(process_remains_reg, remains_content, valid_warehouse_list),
+        run_in_processpool(process_submissions, submissions_content),
+        run_in_processpool(process_payment, payment_content),
+        # run_in_processpool(process_moved_data, moved_content),
+        run_in_processpool(process_free_stock, free_stock_content),
+    )
 
     # --- Обработка новых складов ---
     missing_warehouses = set(remains_all_warehouses) - set(valid_warehouse_list)
@@ -123,10 +563,6 @@ async def save_processed_data_to_db(
             msg += f"- <b>{nw}</b>\n"
         msg += "Вони були додані в базу як <b>неактивні</b>. Будь ласка, активуйте їх в адмінці, якщо вони валідні."
         await send_notification(bot, ADMINS_ID, msg, parse_mode="HTML")
-    df_submissions = await run_in_threadpool(process_submissions, submissions_content)
-    df_payment = await run_in_threadpool(process_payment, payment_content)
-    # df_moved = await run_in_threadpool(process_moved_data, moved_content)
-    df_free_stock = await run_in_threadpool(process_free_stock, free_stock_content)
 
     # --- ГЛОБАЛЬНАЯ НОРМАЛИЗАЦИЯ: Очищаем 'product' во всех DataFrame ---
     # --- ИСПРАВЛЕНИЕ: Преобразуем поля количества в float для df_free_stock ---
@@ -168,25 +604,33 @@ async def save_processed_data_to_db(
     product_guide = pr.drop_duplicates(["product"]).reset_index(drop=True)
 
     product_guide["product"] = product_guide["product"].str.strip()
-    product_guide.insert(0, "id", product_guide.apply(lambda _: uuid.uuid4(), axis=1))
+    product_guide = product_guide.drop_duplicates(["product"]).reset_index(drop=True)
+
+    # id товара сохраняется между выгрузками: новые uuid получают только новые товары.
+    # Иначе после каждой загрузки менялись бы все ссылки на справочник.
+    existing_guide = await ProductGuide.select(ProductGuide.id, ProductGuide.product).run()
+    existing_ids = {row["product"]: row["id"] for row in existing_guide}
+    product_guide.insert(
+        0, "id", [existing_ids.get(p) or uuid.uuid4() for p in product_guide["product"]]
+    )
+
+    await prepare_staging_tables()
+    # Таблицы, успешно заполненные в staging; публикуются все вместе в конце
+    staged = []
+    staging_failed = False
 
-    BATCH_SIZE = 1000
     if not product_guide.empty:
         try:
-            await ProductGuide.delete(force=True).run()
-            records_product_guide = product_guide.to_dict(orient="records")
-            product_guide_raw = [ProductGuide(**item) for item in records_product_guide]
-            for i in range(0, len(product_guide_raw), BATCH_SIZE):
-                batch = product_guide_raw[i : i + BATCH_SIZE]
-                await ProductGuide.insert().add(*list(batch)).run()
-            log(f"📦 Вставлено {len(records_product_guide)} записей в ProductGuide.")
+            rows_product_guide = await load_into_staging(ProductGuide, product_guide)
+            staged.append(ProductGuide)
+            log(f"📦 Подготовлено {rows_product_guide} записей для ProductGuide.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в ProductGuide: {e}")
 
     if not df_av_stock.empty:
         try:
             df_av_stock = df_av_stock.drop("active_substance", axis=1)
-            await AvailableStock.delete(force=True).run()
             av_stock_data = df_av_stock.merge(
                 product_guide, on="product", how="left", suffixes=("_av", "_guide")
             )
@@ -199,21 +643,17 @@ async def save_processed_data_to_db(
                 columns={"line_of_business_av": "line_of_business"}
             )
 
-            records_av_stock = av_stock_data.to_dict(orient="records")
-            av_stock_raw = [AvailableStock(**item) for item in records_av_stock]
-
-            for i in range(0, len(av_stock_raw), BATCH_SIZE):
-                batch = av_stock_raw[i : i + BATCH_SIZE]
-                await AvailableStock.insert().add(*list(batch)).run()
-            log(f"📉 Вставлено {len(records_av_stock)} записей в AvailableStock.")
+            rows_av_stock = await load_into_staging(AvailableStock, av_stock_data)
+            staged.append(AvailableStock)
+            log(f"📉 Подготовлено {rows_av_stock} записей для AvailableStock.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в AvailableStock: {e}")
     else:
         log("⚠️ DataFrame для AvailableStock пуст.")
 
     if not df_remains.empty:
         try:
-            await Remains.delete(force=True).run()
             remains_data = df_remains.merge(
                 product_guide, on="product", how="left", suffixes=("_av", "_guide")
             )
@@ -234,20 +674,17 @@ async def save_processed_data_to_db(
                 remains_data = remains_data.rename(
                     columns={"parent_element_av": "parent_element"}
                 )
-            records_remains = remains_data.to_dict(orient="records")
-            remains_raw = [Remains(**item) for item in records_remains]
-            for i in range(0, len(remains_raw), BATCH_SIZE):
-                batch = remains_raw[i : i + BATCH_SIZE]
-                await Remains.insert().add(*list(batch)).run()
-            log(f"🏠 Вставлено {len(records_remains)} записей в Remains.")
+            rows_remains = await load_into_staging(Remains, remains_data)
+            staged.append(Remains)
+            log(f"🏠 Подготовлено {rows_remains} записей для Remains.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в Remains: {e}")
     else:
         log("⚠️ DataFrame для Remains пуст.")
 
     if not df_submissions.empty:
         try:
-            await Submissions.delete(force=True).run()
             submissions_data = df_submissions.merge(
                 product_guide, on="product", how="left", suffixes=("_av", "_guide")
             )
@@ -303,30 +740,25 @@ async def save_processed_data_to_db(
             submissions_data["delivery_status"] = submissions_data[
                 "delivery_status"
             ].fillna("Ні")
-            records_submissions = submissions_data.to_dict(orient="records")
-            submissions_raw = [Submissions(**item) for item in records_submissions]
-            for i in range(0, len(submissions_raw), BATCH_SIZE):
-                batch = submissions_raw[i : i + BATCH_SIZE]
-                await Submissions.insert().add(*list(batch)).run()
-            log(f"📑 Вставлено {len(records_submissions)} записей в Submissions.")
+            rows_submissions = await load_into_staging(Submissions, submissions_data)
+            staged.append(Submissions)
+            log(f"📑 Подготовлено {rows_submissions} записей для Submissions.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в Submissions: {e}")
     else:
         log("⚠️ DataFrame для Submissions пуст.")
 
     if not df_payment.empty:
         try:
-            await Payment.delete(force=True).run()
             # order_status — NOT NULL в БД, заменяем пустые значения пустой строкой
             df_payment["order_status"] = df_payment["order_status"].fillna("")
             df_payment_for_db = df_payment.replace({np.nan: None})
-            records_payment = df_payment_for_db.to_dict(orient="records")
-            payment_raw = [Payment(**item) for item in records_payment]
-            for i in range(0, len(payment_raw), BATCH_SIZE):
-                batch = payment_raw[i : i + BATCH_SIZE]
-                await Payment.insert().add(*list(batch)).run()
-            log(f"💳 Вставлено {len(records_payment)} записей в Payment.")
+            rows_payment = await load_into_staging(Payment, df_payment_for_db)
+            staged.append(Payment)
+            log(f"💳 Подготовлено {rows_payment} записей для Payment.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в Payment: {e}")
     else:
         log("⚠️ DataFrame для Payment пуст.")
@@ -346,7 +778,6 @@ async def save_processed_data_to_db(
     df_moved = df_moved.drop(columns=["idguide", "idmoved"], errors="ignore")
     if not df_moved.empty:
         try:
-            await MovedData.delete(force=True).run()
             # moved_data = df_moved.merge(
             #     product_guide, on="product", how="left", suffixes=("_av", "_guide")
             # )
@@ -359,20 +790,17 @@ async def save_processed_data_to_db(
             # )
             # moved_data = moved_data.rename(columns={"id": "product_id"})
             moved_data = df_moved.copy()
-            records_moved = moved_data.to_dict(orient="records")
-            moved_raw = [MovedData(**item) for item in records_moved]
-            for i in range(0, len(moved_raw), BATCH_SIZE):
-                batch = moved_raw[i : i + BATCH_SIZE]
-                await MovedData.insert().add(*list(batch)).run()
-            log(f"🚚 Вставлено {len(records_moved)} записей в MovedData.")
+            rows_moved = await load_into_staging(MovedData, moved_data)
+            staged.append(MovedData)
+            log(f"🚚 Подготовлено {rows_moved} записей для MovedData.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в MovedData: {e}")
     else:
         log("⚠️ DataFrame для MovedData пуст.")
 
     if not df_free_stock.empty:
         try:
-            await FreeStock.delete(force=True).run()
             free_stock_data = df_free_stock.merge(
                 product_guide, on="product", how="left", suffixes=("_av", "_guide")
             )
@@ -387,19 +815,34 @@ async def save_processed_data_to_db(
             )
             free_stock_data.dropna(subset=["product"], inplace=True)
 
-            records_free_stock = free_stock_data.to_dict(orient="records")
-            free_stock_raw = [FreeStock(**item) for item in records_free_stock]
-
-            for i in range(0, len(free_stock_raw), BATCH_SIZE):
-                batch = free_stock_raw[i : i + BATCH_SIZE]
-                await FreeStock.insert().add(*list(batch)).run()
-
-            log(f"📦 Вставлено {len(records_free_stock)} записей в FreeStock.")
+            rows_free_stock = await load_into_staging(FreeStock, free_stock_data)
+            staged.append(FreeStock)
+            log(f"📦 Подготовлено {rows_free_stock} записей для FreeStock.")
         except Exception as e:
+            staging_failed = True
             log(f"❌ Ошибка при сохранении данных в FreeStock: {e}")
     else:
         log("⚠️ DataFrame для FreeStock пуст.")
 
+    # --- ПУБЛИКАЦИЯ: все подготовленные таблицы заменяются одной транзакцией ---
+    if staging_failed:
+        log("⛔ Загрузка прервана: данные в БД не изменены, действует предыдущая выгрузка.")
+        await send_upload_report(log_messages)
+        return
+    try:
+        changes = await publish_staging_tables(staged)
+        log(f"✅ Опубликованы таблицы: {', '.join(t.__name__ for t in staged)}.")
+        for table_name, counts in changes.items():
+            log(f"   {table_name}: " + ", ".join(
+                f"{kind} {n}" for kind, n in counts.items() if n is not None
+            ))
+        # Таблицы, в которых что-то поменялось: только их кэш будет сброшен
+        changed_tables = [t for t in staged if any(changes.get(t.__name__, {}).values())]
+    except Exception as e:
+        log(f"❌ Ошибка при публикации данных, действует предыдущая выгрузка: {e}")
+        await send_upload_report(log_messages)
+        return
+
     df_manual_matches = pd.DataFrame()
     if manual_matches_json:
         try:
@@ -554,6 +997,7 @@ async def save_processed_data_to_db(
                 await MovedData.insert(
                     *[MovedData(**rec) for rec in cleaned_records]
                 ).run()
+                changed_tables.append(MovedData)
                 log("✅ Новые записи успешно добавлены в MovedData.")
                 await notifications(bot=bot, frame=df_new_matches_to_add)
             else:
@@ -601,6 +1045,7 @@ async def save_processed_data_to_db(
                 
                 if new_addresses:
                     await ClientAddress.insert(*new_addresses).run()
+                    changed_tables.append(ClientAddress)
                     log(f"✅ Успешно скопированы адреса для {len(new_addresses)} клиентов ЕДО.")
                 else:
                     log("ℹ️ Нет новых клиентов ЕДО для копирования адресов.")
@@ -609,34 +1054,65 @@ async def save_processed_data_to_db(
 
     log("🏁 Все данные успешно сохранены в базу данных.")
 
+    try:
+        start = time.perf_counter()
+        refreshed = await refresh_materialized_views(changed_tables)
+        if refreshed:
+            log(f"🧮 Пересчитаны представления: {', '.join(v._meta.tablename for v in refreshed)} "
+                f"({time.perf_counter() - start:.1f} с).")
+    except Exception as e:
+        log(f"❌ Ошибка при обновлении материализованных представлений: {e}")
+
+    try:
+        from .bi import COMBINED_SOURCES, save_combined_snapshot
+
+        if any(table in changed_tables for table in COMBINED_SOURCES):
+            start = time.perf_counter()
+            payload = await save_combined_snapshot()
+            log(f"📸 Снимок BI /combined пересчитан ({len(payload) / 1024:.0f} КБ, "
+                f"{time.perf_counter() - start:.1f} с).")
+    except Exception as e:
+        log(f"❌ Ошибка при пересчете снимка BI: {e}")
+
     # --- ОЧИСТКА КЭША И УВЕДОМЛЕНИЕ ФРОНТЕНДА ---
     try:
-        from .cache import db_cache
+        from .cache import db_cache, warm_up
         from .websocket_manager import manager
         
-        db_cache.clear()
+        if changed_tables:
+            dropped = db_cache.invalidate(*changed_tables)
+            log(f"🔄 Кэш бэкенда сброшен для {', '.join(t.__name__ for t in changed_tables)} (записей: {dropped}).")
+        else:
+            log("🔄 Данные не изменились, кэш бэкенда сохранен.")
+        # Прогрев до уведомления: клиенты, которые сразу перезапросят данные, попадут в кэш
+        if CACHE_WARMUP_ENDPOINTS and USE_CACHE:
+            warmed = await warm_up(CACHE_WARMUP_ENDPOINTS)
+            log("🔥 Прогрев кэша: " + ", ".join(
+                f"{name} {result} мс" if isinstance(result, float) else f"{name} — {result}"
+                for name, result in warmed.items()
+            ))
         await manager.broadcast({"type": "EXCEL_DATA_UPLOADED"})
-        log("🔄 Кэш бэкенда очищен, WebSocket-уведомление отправлено клиентам.")
+        log("📡 WebSocket-уведомление отправлено клиентам.")
     except Exception as e:
         log(f"⚠️ Ошибка при очистке кэша или отправке WS-уведомления: {e}")
 
-    # --- ОТПРАВКА ЛОГОВ В TELEGRAM ---
+    await send_upload_report(log_messages)
+
+
+async def send_upload_report(log_messages: List[str]):
+    """Отправляет администраторам отчет о загрузке данных."""
     if ADMINS_ID:
         try:
             # Отправляемотчет администраторам. ADMINS_ID уже является списком интов из config.py
             # Отправляем без Markdown, т.к. текст лога может содержать
             # спецсимволы из ошибок БД (кавычки, скобки, _), которые ломают парсер
             full_log_text = "📊 Отчет о загрузке данных\n\n" + "\n".join(log_messages)
-            sent_msgs = await send_notification(
+            await send_notification(
                 bot=bot,
                 chat_ids=ADMINS_ID,
                 text=full_log_text,
-                parse_mode=None
+                parse_mode=None,
+                delete_after=30,  # Запланувати видалення через 30 хвилин
             )
-                
-            # Запланувати видалення через 30 хвилин
-            from .utils import schedule_message_deletion
-            for msg in sent_msgs:
-                await schedule_message_deletion(chat_id=msg.chat.id, message_id=msg.message_id, delay_minutes=30)
         except Exception as e:
             logger.error(f"!!! Ошибка при отправке логов админам: {e}")
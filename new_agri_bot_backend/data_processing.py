@@ -4,12 +4,27 @@ import uuid
 import pandas as pd
 import numpy as np
 import io
-from .config import valid_line_of_business, logger  # Импорт из config.py
+from .config import valid_line_of_business, logger, EXCEL_ENGINE  # Импорт из config.py
 
 # Опция для будущего поведения Pandas
 pd.set_option("future.no_silent_downcasting", True)
 
 
+def _resolve_excel_engine(engine: str) -> str:
+    """Возвращает движок чтения Excel; без python-calamine откатывается на openpyxl."""
+    if engine == "calamine":
+        try:
+            import python_calamine  # noqa: F401
+        except ImportError:
+            logger.warning("python-calamine не установлен, Excel читается через openpyxl.")
+            return "openpyxl"
+    return engine
+
+
+# Движок pd.read_excel для всех парсеров: calamine (Rust, быстрый) или openpyxl
+excel_engine = _resolve_excel_engine(EXCEL_ENGINE)
+
+
 def _normalize_season(series: "pd.Series") -> "pd.Series":
     """
     Приводит buying_season к целому числу если это число.
@@ -32,7 +47,7 @@ def _normalize_season(series: "pd.Series") -> "pd.Series":
 
 def read_excel_content(content: bytes, sheet_name=0) -> pd.DataFrame:
     """Вспомогательная функция для чтения содержимого Excel в DataFrame."""
-    return pd.read_excel(io.BytesIO(content), sheet_name=sheet_name, engine="openpyxl")
+    return pd.read_excel(io.BytesIO(content), sheet_name=sheet_name, engine=excel_engine)
 
 
 def process_submissions(content: bytes) -> pd.DataFrame:
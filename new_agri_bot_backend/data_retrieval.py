@@ -2,13 +2,23 @@
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List
 from collections import defaultdict
-import io
 from .cache import cached_endpoint
+from .pagination import CURSOR_QUERY, LIMIT_QUERY, decode_cursor, make_page
+from .export_stream import (
+    CSV_MEDIA_TYPE,
+    XLSX_MEDIA_TYPE,
+    empty_batches,
+    iter_query_batches,
+    select_columns,
+    stream_csv,
+    stream_xlsx,
+)
 
 import pandas as pd
 import requests
 from fastapi import APIRouter, Query, HTTPException, status, Depends
 from fastapi.responses import StreamingResponse
+from piccolo.columns.combination import WhereRaw
 from piccolo.columns.defaults.timestamptz import TimestamptzNow
 from piccolo.query import Sum
 from pydantic import BaseModel, Field
@@ -31,6 +41,7 @@ from .tables import (
     ClientManagerGuide,
     ClientAddress,
     ProductOnWarehouse,
+    ProductStockTotals,
     Submissions,
     AvailableStock,
     AvStockProd,
@@ -69,13 +80,22 @@ router = APIRouter(
 
 
 @router.get("/remains", summary="Отримати всі залишки на складі")
-@cached_endpoint()
-async def get_remains():
+@cached_endpoint(tables=(Remains,))
+async def get_remains(limit: Optional[int] = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY):
     """
     Повертає всі записи про залишки на складі з бази даних.
+    З `limit` — сторінку за id з `next_cursor` (див. pagination.py).
     """
-    remains = await Remains.select().run()
-    return remains
+    if limit is None:
+        remains = await Remains.select().run()
+        return remains
+
+    query = Remains.select().order_by(Remains.id).limit(limit + 1)
+    after = decode_cursor(cursor, 1)
+    if after:
+        query = query.where(Remains.id > after[0])
+    rows = await query.run()
+    return make_page(rows, limit, key=lambda row: [row["id"]])
 
 
 @router.get("/geocode")
@@ -92,7 +112,7 @@ def geocode(address: str = Query(..., description="Адрес для поиск
     summary="Отримати список унікальних складів із залишків",
     dependencies=[Depends(get_current_telegram_user)],
 )
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_remains_warehouses():
     """
     Повертає список унікальних непустих назв складів з таблиці залишків, 
@@ -109,7 +129,7 @@ async def get_remains_warehouses():
 
 
 @router.get("/remains/{product_id}", summary="Отримати залишки за конкретним продуктом")
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_remains_by_product(
     product_id: str,
 ):  # Використовуємо product_id для ясності
@@ -129,7 +149,7 @@ async def get_remains_by_product(
 @router.get(
     "/remains_by_product", summary="Отримати залишки за конкретним продуктом"
 )
-@cached_endpoint()
+@cached_endpoint(tables=(ProductGuide, Remains))
 async def get_remains_by_product(
     product: str = Query(..., description="Назва продукту"),
 ):
@@ -152,7 +172,7 @@ async def get_remains_by_product(
     "/remains_group/{product_id}",
     summary="Отримати залишки за конкретним продуктом, згруповані по партії ",
 )
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_group_remains_by_product(product_id: str):
     remains = (
         await Remains.select(
@@ -174,7 +194,7 @@ async def get_group_remains_by_product(product_id: str):
     "/av_stock/{product_id}",
     summary="Отримати вільні залишки на РУ за конкретним продуктом",
 )
-@cached_endpoint()
+@cached_endpoint(tables=(AvailableStock, FreeStock))
 async def get_av_remains_by_product(
     product_id: str,
 ):  # Використовуємо product_id для ясності
@@ -218,7 +238,7 @@ async def get_av_remains_by_product(
 
 
 @router.get("/products", summary="Отримати список продуктів з можливістю пошуку")
-@cached_endpoint()
+@cached_endpoint(tables=(AvStockProd,))
 async def get_products(category: Optional[str] = None, name_part: Optional[str] = None):
     """
     Повертає список всіх продуктів.
@@ -239,11 +259,13 @@ async def get_products(category: Optional[str] = None, name_part: Optional[str]
 
 
 @router.get("/all_products")
-@cached_endpoint()
+@cached_endpoint(tables=(ProductGuide,))
 async def get_all_product_by_guide(
     category: Optional[str] = None, 
     parent_category: Optional[str] = Query(None),
-    name_part: Optional[str] = None
+    name_part: Optional[str] = None,
+    limit: Optional[int] = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
 ):
     query = ProductGuide.select()
 
@@ -258,12 +280,20 @@ async def get_all_product_by_guide(
         # Якщо ваша ORM/БД не підтримує .ilike(), можливо, знадобиться інший підхід
         query = query.where(ProductGuide.product.ilike(f"%{name_part}%"))
 
-    product = await query.order_by(ProductGuide.product).run()
-    return product
+    if limit is None:
+        product = await query.order_by(ProductGuide.product).run()
+        return product
+
+    # Назва товару не унікальна, тому ключ сторінки — (product, id)
+    after = decode_cursor(cursor, 2)
+    if after:
+        query = query.where(WhereRaw("(product, id) > ({}, {})", after[0], after[1]))
+    rows = await query.order_by(ProductGuide.product, ProductGuide.id).limit(limit + 1).run()
+    return make_page(rows, limit, key=lambda row: [row["product"], row["id"]])
 
 
 @router.get("/categories_tree")
-@cached_endpoint()
+@cached_endpoint(tables=(ProductGuide,))
 async def get_categories_tree():
     """
     Повертає унікальні комбінації бізнес-напрямку та батьківського елемента (підгрупи)
@@ -277,7 +307,7 @@ async def get_categories_tree():
 
 
 @router.get("/product/{product_id}", summary="Отримати інформацію про продукт за ID")
-@cached_endpoint()
+@cached_endpoint(tables=(ProductGuide,))
 async def get_product_by_id(
     product_id: str,
 ):  # Припускаємо, що product_id є цілочисельним первинним ключем
@@ -296,7 +326,7 @@ async def get_product_by_id(
 
 
 @router.get("/managers")
-@cached_endpoint()
+@cached_endpoint(tables=(Submissions,))
 async def get_managers():
     managers = (
         await Submissions.select(Submissions.manager)
@@ -314,7 +344,7 @@ async def get_managers():
     summary="отримати клієнтів по менеджеру, якщо адмін то усіх ",
     dependencies=[Depends(get_current_telegram_user)],
 )
-@cached_endpoint()
+@cached_endpoint(tables=(ClientManagerGuide,))
 async def get_clients(
     manager: dict = Depends(get_current_telegram_user), name_part: Optional[str] = None
 ):
@@ -330,12 +360,61 @@ async def get_clients(
     return clients
 
 
+def split_warehouses(warehouses: Optional[str]) -> List[str]:
+    """Разбирает кома-сепарированный список складов из query-параметра."""
+    if not warehouses:
+        return []
+    return [w.strip() for w in warehouses.split(",") if w.strip()]
+
+
+def product_on_warehouse_query(
+    category: Optional[str],
+    parent_category: Optional[str],
+    name_part: Optional[str],
+    free_only: bool,
+    wh_list: List[str],
+):
+    """
+    Запрос к product_on_warehouse с фильтрами /product_on_warehouse и его экспорта.
+    Фильтры по складам и вільному залишку — подзапросы, а список складов уходит одним
+    параметром-массивом (= ANY($n)), поэтому текст SQL зависит только от набора фильтров
+    и asyncpg переиспользует подготовленный запрос вместо нового планирования.
+    """
+    query = ProductOnWarehouse.select()
+
+    if wh_list:
+        query = query.where(
+            WhereRaw(
+                "id IN (SELECT r.product FROM remains r WHERE r.warehouse = ANY({}) AND r.buh > 0)",
+                wh_list,
+            )
+        )
+
+    if category:
+        query = query.where(ProductOnWarehouse.line_of_business == category)
+
+    if parent_category:
+        query = query.where(ProductOnWarehouse.parent_element == parent_category)
+
+    if name_part:
+        # Використовуємо .ilike() для регістронезалежного пошуку по частині рядка
+        query = query.where(ProductOnWarehouse.product.ilike(f"%{name_part}%"))
+
+    if free_only:
+        # Вільний залишок по товарах рахується при завантаженні (product_stock_totals)
+        query = query.where(
+            WhereRaw("id IN (SELECT product FROM product_stock_totals WHERE is_free)")
+        )
+
+    return query
+
+
 @router.get(
     "/product_on_warehouse",
     summary="Отримати товари, по яким є залишки на складі, з опціональними фільтрами",
     dependencies=[Depends(get_current_telegram_user)],
 )
-@cached_endpoint()
+@cached_endpoint(tables=(ProductOnWarehouse, ProductStockTotals, Remains, Submissions))
 async def get_product_on_warehouse(
     category: Optional[str] = None, 
     parent_category: Optional[str] = Query(None),
@@ -351,57 +430,34 @@ async def get_product_on_warehouse(
     - `free_only`: Фільтрувати тільки товари з вільним залишком.
     - `warehouses`: Кома-сепарований список складів для фільтрації.
     """
-    query = ProductOnWarehouse.select()
-
-    if warehouses:
-        wh_list = [w.strip() for w in warehouses.split(',') if w.strip()]
-        if wh_list:
-            wh_placeholders = ', '.join([f"'{w}'" for w in wh_list])
-            warehouse_ids_query = f"""
-                SELECT DISTINCT pg.id
-                FROM remains r
-                JOIN product_guide pg ON r.product = pg.id
-                WHERE r.warehouse IN ({wh_placeholders}) AND r.buh > 0
-            """
-            raw_result = await ProductOnWarehouse.raw(warehouse_ids_query)
-            w_ids = [row["id"] for row in raw_result]
-            query = query.where(ProductOnWarehouse.id.is_in(w_ids))
-
-    if category:
-        query = query.where(ProductOnWarehouse.line_of_business == category)
-
-    if parent_category:
-        query = query.where(ProductOnWarehouse.parent_element == parent_category)
-
-    if name_part:
-        # Використовуємо .ilike() для регістронезалежного пошуку по частині рядка
-        # Якщо ваша ORM/БД не підтримує .ilike(), можливо, знадобиться інший підхід
-        query = query.where(ProductOnWarehouse.product.ilike(f"%{name_part}%"))
-
-    if free_only:
-        free_ids_query = """
-            SELECT pg.id
-            FROM remains r
-            JOIN product_guide pg ON r.product = pg.id
-            LEFT JOIN (
-                SELECT product, 
-                       COALESCE(SUM(CASE WHEN document_status = 'затверджено' THEN different ELSE 0 END), 0) as orders_q,
-                       COALESCE(SUM(CASE WHEN document_status IN ('затверджено', 'продукція затверджена') THEN different ELSE 0 END), 0) as total_orders
-                FROM submissions
-                WHERE different > 0
-                GROUP BY product
-            ) o ON o.product = pg.id
-            GROUP BY pg.id, o.orders_q, o.total_orders
-            HAVING SUM(r.buh) > 0 AND ((SUM(r.buh) - COALESCE(o.orders_q, 0) > 0) OR (COALESCE(o.total_orders, 0) = 0))
-        """
-        raw_result = await ProductOnWarehouse.raw(free_ids_query)
-        free_ids = [row["id"] for row in raw_result]
-        query = query.where(ProductOnWarehouse.id.is_in(free_ids))
-
+    query = product_on_warehouse_query(
+        category, parent_category, name_part, free_only, split_warehouses(warehouses)
+    )
     product = await query.order_by(ProductOnWarehouse.product).run()
     return product
 
 
+# Стовпці експорту в порядку SELECT у export_product_on_warehouse
+EXPORT_COLUMNS = [
+    "Товар",
+    "Напрямок діяльності",
+    "Підгрупа",
+    "Партія",
+    "Склад",
+    "Бухгалтерський залишок",
+    "Складський залишок",
+    "На збереганні",
+    "Заявки (всього по товару)",
+    "Вільний залишок (всього по товару)",
+    "Рік врожаю",
+    "Схожість",
+    "МТН",
+    "Країна походження",
+    "Активна речовина",
+    "Сертифікат",
+]
+
+
 @router.get(
     "/product_on_warehouse/export",
     summary="Експортувати залишки на складі в Excel",
@@ -413,160 +469,95 @@ async def export_product_on_warehouse(
     name_part: Optional[str] = None,
     free_only: bool = Query(False),
     columns: Optional[str] = Query(None),
-    warehouses: Optional[str] = Query(None)
+    warehouses: Optional[str] = Query(None),
+    format: str = Query("xlsx", pattern="^(xlsx|csv)$"),
 ):
     """
     Формує та повертає Excel-файл з поточними зашликами та вільними залишками товарів,
     враховуючи всі застосовані фільтри та обрані стовпці.
+    Рядки читаються курсором і віддаються клієнту потоково в обох форматах
+    (`format=xlsx` або `format=csv`) — без очікування кінця запиту.
     """
-    query = ProductOnWarehouse.select()
-
-    wh_list = []
-    if warehouses:
-        wh_list = [w.strip() for w in warehouses.split(',') if w.strip()]
-        if wh_list:
-            wh_placeholders = ', '.join([f"'{w}'" for w in wh_list])
-            warehouse_ids_query = f"""
-                SELECT DISTINCT pg.id
-                FROM remains r
-                JOIN product_guide pg ON r.product = pg.id
-                WHERE r.warehouse IN ({wh_placeholders}) AND r.buh > 0
-            """
-            raw_result = await ProductOnWarehouse.raw(warehouse_ids_query)
-            w_ids = [row["id"] for row in raw_result]
-            query = query.where(ProductOnWarehouse.id.is_in(w_ids))
-
-    if category:
-        query = query.where(ProductOnWarehouse.line_of_business == category)
-
-    if parent_category:
-        query = query.where(ProductOnWarehouse.parent_element == parent_category)
-
-    if name_part:
-        query = query.where(ProductOnWarehouse.product.ilike(f"%{name_part}%"))
-
-    if free_only:
-        free_ids_query = """
-            SELECT pg.id
-            FROM remains r
-            JOIN product_guide pg ON r.product = pg.id
-            LEFT JOIN (
-                SELECT product, 
-                       COALESCE(SUM(CASE WHEN document_status = 'затверджено' THEN different ELSE 0 END), 0) as orders_q,
-                       COALESCE(SUM(CASE WHEN document_status IN ('затверджено', 'продукція затверджена') THEN different ELSE 0 END), 0) as total_orders
-                FROM submissions
-                WHERE different > 0
-                GROUP BY product
-            ) o ON o.product = pg.id
-            GROUP BY pg.id, o.orders_q, o.total_orders
-            HAVING SUM(r.buh) > 0 AND ((SUM(r.buh) - COALESCE(o.orders_q, 0) > 0) OR (COALESCE(o.total_orders, 0) = 0))
-        """
-        raw_result = await ProductOnWarehouse.raw(free_ids_query)
-        free_ids = [row["id"] for row in raw_result]
-        query = query.where(ProductOnWarehouse.id.is_in(free_ids))
-
+    wh_list = split_warehouses(warehouses)
+    query = product_on_warehouse_query(category, parent_category, name_part, free_only, wh_list)
     products = await query.order_by(ProductOnWarehouse.product).run()
 
-    warehouse_filter_sql = ""
-    if warehouses and wh_list:
-        warehouse_filter_sql = f" AND r.warehouse IN ({wh_placeholders})"
-
-    if not products:
-        df = pd.DataFrame(columns=[
-            "Товар", 
-            "Напрямок діяльності", 
-            "Підгрупа", 
-            "Партія",
-            "Склад",
-            "Бухгалтерський залишок", 
-            "Складський залишок", 
-            "На збереганні", 
-            "Заявки (всього по товару)", 
-            "Вільний залишок (всього по товару)",
-            "Рік врожаю",
-            "Схожість",
-            "МТН",
-            "Країна походження",
-            "Активна речовина",
-            "Сертифікат"
-        ])
-    else:
-        product_ids_str = ", ".join([f"'{p['id']}'" for p in products])
+    batches = empty_batches()
+    if products:
+        # Склады передаются массивом-параметром, поэтому текст запроса не зависит от значений
+        params = [[p["id"] for p in products]]
+        warehouse_filter_sql = ""
+        if wh_list:
+            warehouse_filter_sql = " AND r.warehouse = ANY($2)"
+            params.append(wh_list)
         sql = f"""
             SELECT 
-                pg.product AS "Товар",
-                r.line_of_business AS "Напрямок діяльності",
-                r.parent_element AS "Підгрупа",
-                r.nomenclature_series AS "Партія",
-                r.warehouse AS "Склад",
-                SUM(r.buh) AS "Бухгалтерський залишок",
-                SUM(r.skl) AS "Складський залишок",
-                SUM(r.storage) AS "На збереганні",
-                COALESCE(o.orders_q, 0) AS "Заявки (всього по товару)",
-                (p_tot.total_buh - COALESCE(o.orders_q, 0)) AS "Вільний залишок (всього по товару)",
-                MAX(r.crop_year) AS "Рік врожаю",
-                MAX(r.germination) AS "Схожість",
-                MAX(r.mtn) AS "МТН",
-                MAX(r.origin_country) AS "Країна походження",
-                MAX(r.active_substance) AS "Активна речовина",
-                MAX(r.certificate) AS "Сертифікат"
+                pg.product,
+                r.line_of_business,
+                r.parent_element,
+                r.nomenclature_series,
+                r.warehouse,
+                SUM(r.buh),
+                SUM(r.skl),
+                SUM(r.storage),
+                t.orders_q,
+                (t.total_buh - t.orders_q),
+                MAX(r.crop_year),
+                MAX(r.germination),
+                MAX(r.mtn),
+                MAX(r.origin_country),
+                MAX(r.active_substance),
+                MAX(r.certificate)
             FROM remains r
             JOIN product_guide pg ON r.product = pg.id
-            JOIN (
-                SELECT product, SUM(buh) as total_buh
-                FROM remains
-                GROUP BY product
-            ) p_tot ON p_tot.product = pg.id
-            LEFT JOIN (
-                SELECT product, 
-                       COALESCE(SUM(CASE WHEN document_status = 'затверджено' THEN different ELSE 0 END), 0) as orders_q
-                FROM submissions
-                WHERE different > 0
-                GROUP BY product
-            ) o ON o.product = pg.id
-            WHERE pg.id IN ({product_ids_str}){warehouse_filter_sql}
-            GROUP BY pg.product, r.line_of_business, r.parent_element, r.nomenclature_series, r.warehouse, o.orders_q, p_tot.total_buh
+            JOIN product_stock_totals t ON t.product = pg.id
+            WHERE pg.id = ANY($1){warehouse_filter_sql}
+            GROUP BY pg.product, r.line_of_business, r.parent_element, r.nomenclature_series, r.warehouse, t.orders_q, t.total_buh
             ORDER BY pg.product, r.nomenclature_series, r.warehouse
         """
-        raw_results = await Remains.raw(sql)
-        df = pd.DataFrame(raw_results)
-
-    if columns:
-        cols_to_keep = [c.strip() for c in columns.split(",") if c.strip()]
-        valid_cols = [c for c in cols_to_keep if c in df.columns]
-        if valid_cols:
-            df = df[valid_cols]
-
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name="Залишки")
-    
-    output.seek(0)
-    
+        batches = iter_query_batches(sql, *params)
+
+    indexes = select_columns(
+        EXPORT_COLUMNS, [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    )
+
+    if format == "csv":
+        body = stream_csv(EXPORT_COLUMNS, batches, indexes)
+        media_type, filename = CSV_MEDIA_TYPE, "remains.csv"
+    else:
+        body = stream_xlsx(EXPORT_COLUMNS, batches, indexes, sheet_name="Залишки")
+        media_type, filename = XLSX_MEDIA_TYPE, "remains.xlsx"
+
     headers = {
-        'Content-Disposition': 'attachment; filename="remains.xlsx"'
+        'Content-Disposition': f'attachment; filename="{filename}"'
     }
     
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers
-    )
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 
 @router.get("/orders")
-@cached_endpoint()
-async def get_orders(client: str = Query(...)):
-    orders = (
-        await Submissions.select()
-        .where((Submissions.client == client) & (Submissions.different > 0))
-        .run()
+@cached_endpoint(tables=(Submissions,))
+async def get_orders(
+    client: str = Query(...),
+    limit: Optional[int] = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
+):
+    query = Submissions.select().where(
+        (Submissions.client == client) & (Submissions.different > 0)
     )
-    return orders
+    if limit is None:
+        orders = await query.run()
+        return orders
+
+    after = decode_cursor(cursor, 1)
+    if after:
+        query = query.where(Submissions.id > after[0])
+    rows = await query.order_by(Submissions.id).limit(limit + 1).run()
+    return make_page(rows, limit, key=lambda row: [row["id"]])
 
 
 @router.get("/contracts")
-@cached_endpoint()
+@cached_endpoint(tables=(ClientManagerGuide, Payment, Submissions))
 async def get_contracts(client: str = Query(...)):
     client_from_guide = await ClientManagerGuide.select(
         ClientManagerGuide.client
@@ -635,8 +626,14 @@ async def get_contracts(client: str = Query(...)):
 
 
 @router.get("/all_contracts")
-@cached_endpoint()
-async def get_all_contracts():
+@cached_endpoint(tables=(Payment, Submissions))
+async def get_all_contracts(
+    limit: Optional[int] = LIMIT_QUERY, cursor: Optional[str] = CURSOR_QUERY
+):
+    """
+    Доповнення з незакритими заявками. З `limit` сторінка містить `limit` номерів
+    доповнень (рядків може бути більше — по рядку на кожну групу доповнення).
+    """
     query = Submissions.select(
         Submissions.contract_supplement,
         Submissions.line_of_business,
@@ -647,6 +644,22 @@ async def get_all_contracts():
         Submissions.client,
     ).where(Submissions.different > 0)
 
+    page_contracts = None
+    if limit is not None:
+        # Ключ сторінки — номер доповнення, щоб групи одного доповнення не розривались
+        ids_query = (
+            Submissions.select(Submissions.contract_supplement)
+            .where((Submissions.different > 0) & Submissions.contract_supplement.is_not_null())
+            .distinct()
+            .order_by(Submissions.contract_supplement)
+            .limit(limit + 1)
+        )
+        after = decode_cursor(cursor, 1)
+        if after:
+            ids_query = ids_query.where(Submissions.contract_supplement > after[0])
+        page_contracts = [row["contract_supplement"] for row in await ids_query.run()]
+        query = query.where(WhereRaw("contract_supplement = ANY({})", page_contracts[:limit]))
+
     contracts = await query.group_by(
         Submissions.contract_supplement,
         Submissions.line_of_business,
@@ -678,11 +691,13 @@ async def get_all_contracts():
                     item["planned_amount"] = p_info["planned_amount"]
                     item["actual_payment_amount"] = p_info["actual_payment_amount"]
 
+    if page_contracts is not None:
+        return make_page(page_contracts, limit, key=lambda cs: [cs], items=contracts)
     return contracts
 
 
 @router.get("/contract_detail/{contract}")
-@cached_endpoint()
+@cached_endpoint(tables=(Submissions,))
 async def get_contract_detail(contract):
     detail = (
         await Submissions.select(
@@ -704,7 +719,7 @@ async def get_contract_detail(contract):
 
 
 @router.get("/sum_order_by_product")
-@cached_endpoint()
+@cached_endpoint(tables=(Submissions,))
 async def get_sum_order_products(product: str = Query(...)):
     total_sum = (
         await Submissions.select(
@@ -725,7 +740,7 @@ async def get_sum_order_products(product: str = Query(...)):
 
 
 @router.get("/sum_orders_tiers_by_product", summary="Потреба по двох рівнях пріоритету")
-@cached_endpoint()
+@cached_endpoint(tables=(Submissions,))
 async def get_sum_orders_tiers_by_product(product: str = Query(...)):
     """
     Повертає сумарну потребу по товару у двох рівнях:
@@ -764,7 +779,7 @@ async def get_sum_orders_tiers_by_product(product: str = Query(...)):
 
 
 @router.get("/order_by_product")
-@cached_endpoint()
+@cached_endpoint(tables=(Payment, Submissions))
 async def get_orders_by_product(product: str = Query(...)):
     data = (
         await Submissions.select()
@@ -813,7 +828,7 @@ async def get_orders_by_product(product: str = Query(...)):
 
 
 @router.get("/moved_products_for_order/{order}")
-@cached_endpoint()
+@cached_endpoint(tables=(MovedData,))
 async def get_moved_products_for_order(order: str):
     data = await MovedData.select().where(
         (MovedData.contract == order) & (MovedData.is_active == True)
@@ -822,14 +837,14 @@ async def get_moved_products_for_order(order: str):
 
 
 @router.get("/products_for_all_orders")
-@cached_endpoint()
+@cached_endpoint(tables=(ProductsForOrders,))
 async def get_products_for_all_orders():
     data = await ProductsForOrders.select().run()
     return data
 
 
 @router.get("/party_data")
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_party_data(
     id: Optional[str] = Query(None, description="Унікальний ID партії в базі даних"),
     party: Optional[str] = Query(None, description="Номер серії номенклатури (партія)"),
@@ -866,7 +881,7 @@ async def get_party_data(
 
 
 @router.get("/id_in_remains")
-@cached_endpoint()
+@cached_endpoint(tables=(Remains,))
 async def get_id_in_remains(party: str):
     data = (
         await Remains.select(Remains.id)
@@ -931,7 +946,7 @@ def group_products_with_parties(items):
 
 
 @router.post("/details_for_orders/batch")
-@cached_endpoint()
+@cached_endpoint(tables=(DetailsForOrders, Remains, Submissions, Payment))
 async def get_details_for_orders_batch(order_list: List[str]):
     """
     Пакетне отримання деталей замовлень через POST (для обходу лімітів URL).
@@ -1096,7 +1111,7 @@ async def _process_details_result(result):
 
 
 @router.get("/details_for_orders/{order}")
-@cached_endpoint()
+@cached_endpoint(tables=(DetailsForOrders, Remains, Submissions, Payment))
 async def get_details_for_order(order: str):
     # Підтримка списку замовлень через кому: "ID1,ID2,ID3"
     order_list = [o.strip() for o in order.split(",") if o.strip()]
@@ -1133,13 +1148,32 @@ def clean_df_encoding(df: pd.DataFrame) -> pd.DataFrame:
 
 
 @router.get("/moved_products")
-@cached_endpoint()
-async def get_moved_products(product_id: str = Query(...)):
-    orders = (
-        await Submissions.select()
-        .where((Submissions.product == product_id) & (Submissions.different > 0))
-        .run()
+@cached_endpoint(tables=(MovedData, Submissions))
+async def get_moved_products(
+    product_id: str = Query(...),
+    limit: Optional[int] = LIMIT_QUERY,
+    cursor: Optional[str] = CURSOR_QUERY,
+):
+    """
+    Переміщений товар по заявках на продукт. З `limit` сторінкою є `limit` заявок
+    (за id), а результат — {"items", "limit", "next_cursor"}.
+    """
+    query = Submissions.select().where(
+        (Submissions.product == product_id) & (Submissions.different > 0)
     )
+    if limit is None:
+        orders = await query.run()
+        return await moved_products_for_orders(product_id, orders)
+
+    after = decode_cursor(cursor, 1)
+    if after:
+        query = query.where(Submissions.id > after[0])
+    rows = await query.order_by(Submissions.id).limit(limit + 1).run()
+    items = await moved_products_for_orders(product_id, rows[:limit])
+    return make_page(rows, limit, key=lambda row: [row["id"]], items=items)
+
+
+async def moved_products_for_orders(product_id: str, orders: list) -> list:
     valid_sub = []
     for order in orders:
         valid_sub.append(order["contract_supplement"])
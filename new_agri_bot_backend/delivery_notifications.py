@@ -1,8 +1,11 @@
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 from .config import bot, LOGISTICS_TELEGRAM_IDS, ADMINS_ID, SEND_NOTIFICATIONS
 from .tables import DeliveryNotifications, Deliveries
+from .telegram_queue import send_queue
+import asyncio
 import html
 import logging
+from functools import partial
 
 logger = logging.getLogger("agri_bot")
 
@@ -10,25 +13,46 @@ logger = logging.getLogger("agri_bot")
 # Використовуємо set для унікальності, щоб уникнути подвійних повідомлень
 ALL_RECIPIENTS = list(set(LOGISTICS_TELEGRAM_IDS + ADMINS_ID))
 
+# Доставки, попередження про самовивіз яких ще в черзі відправки (ще не збережені в БД)
+_pickup_warnings_queued = set()
+
 async def delete_delivery_notifications(delivery_id: int):
+    """
+    Ставить у чергу відправки видалення повідомлень доставки — по одному завданню на чат.
+    Черга чату виконує запити по порядку, тож відправка, поставлена раніше, вже збереже
+    свій message_id у БД до того, як завдання прочитає повідомлення цього чату.
+    """
     logger.info(f"🔍 Спроба видалення повідомлень для доставки ID: {delivery_id}")
-    notifications = await DeliveryNotifications.objects().where(
+    # Крім отримувачів, повідомлення могли бути надіслані менеджеру (нагадування про самовивіз)
+    saved_chats = await DeliveryNotifications.select(DeliveryNotifications.telegram_id).where(
         DeliveryNotifications.delivery_id == delivery_id
+    ).distinct().output(as_list=True).run()
+
+    for chat_id in set(ALL_RECIPIENTS) | set(saved_chats):
+        send_queue.submit(chat_id, partial(_delete_chat_notifications, delivery_id, chat_id))
+
+
+async def _delete_chat_notifications(delivery_id: int, chat_id: int):
+    """Видаляє повідомлення доставки в одному чаті (виконується чергою відправки)"""
+    notifications = await DeliveryNotifications.objects().where(
+        (DeliveryNotifications.delivery_id == delivery_id)
+        & (DeliveryNotifications.telegram_id == chat_id)
     ).run()
-    
-    logger.info(f"🔍 Знайдено повідомлень для видалення: {len(notifications)}")
-    
+    if not notifications:
+        return
+
+    logger.info(f"🔍 Знайдено повідомлень для видалення у чаті {chat_id}: {len(notifications)}")
+
     for note in notifications:
         try:
             logger.info(f"🗑 Видалення повідомлення {note.message_id} у чаті {note.telegram_id}")
             await bot.delete_message(chat_id=note.telegram_id, message_id=note.message_id)
         except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # 429 та мережеві помилки не перехоплюємо — завдання повторить черга
             logger.warning(f"⚠️ Не вдалося видалити повідомлення {note.message_id} для {note.telegram_id}: {e}")
-        except Exception as e:
-            logger.error(f"❌ Помилка при видаленні повідомлення: {e}")
-            
+
     await DeliveryNotifications.delete().where(
-        DeliveryNotifications.delivery_id == delivery_id
+        DeliveryNotifications.id.is_in([note.id for note in notifications])
     ).run()
 
 async def notify_new_delivery(delivery: Deliveries, actor_name: str = None, custom_text: str = None):
@@ -77,48 +101,42 @@ async def notify_new_delivery(delivery: Deliveries, actor_name: str = None, cust
     logger.info(f"🆕 Спроба сповіщення про нову доставку ID: {delivery.id}")
     logger.info(f"👥 Список отримувачів: {ALL_RECIPIENTS}")
     for admin_id in ALL_RECIPIENTS:
+        logger.info(f"📤 Надсилання повідомлення для {admin_id}")
+        send_queue.send_message(
+            bot, admin_id, text, parse_mode="HTML",
+            on_sent=partial(_save_notification, delivery.id, admin_id, "created"),
+        )
+
+
+async def _save_notification(delivery_id: int, admin_id: int, event_type: str, msg, delete_after: int = None):
+    """Зберігає ID надісланого повідомлення для видалення в майбутньому"""
+    new_note = DeliveryNotifications(
+        delivery_id=delivery_id,
+        telegram_id=admin_id,
+        message_id=msg.message_id,
+        event_type=event_type
+    )
+    await new_note.save().run()
+    logger.info(f"✅ Повідомлення надіслано та збережено в БД. ID запису: {new_note.id}, Message ID: {msg.message_id}")
+
+    if delete_after:
+        # Запланувати видалення через delete_after хвилин
         try:
-            logger.info(f"📤 Надсилання повідомлення для {admin_id}")
-            msg = await bot.send_message(chat_id=admin_id, text=text, parse_mode="HTML")
-            
-            # Зберігаємо ID повідомлення для видалення в майбутньому
-            new_note = DeliveryNotifications(
-                delivery_id=delivery.id,
-                telegram_id=admin_id,
-                message_id=msg.message_id,
-                event_type="created"
-            )
-            await new_note.save().run()
-            logger.info(f"✅ Повідомлення надіслано та збережено в БД. ID запису: {new_note.id}, Message ID: {msg.message_id}")
+            from .utils import schedule_message_deletion
+            await schedule_message_deletion(chat_id=admin_id, message_id=msg.message_id, delay_minutes=delete_after)
         except Exception as e:
-            logger.error(f"❌ Помилка відправки або збереження повідомлення отримувачу {admin_id}: {e}")
+            logger.warning(f"⚠️ Не вдалося запланувати видалення повідомлення {msg.message_id}: {e}")
 
 async def _send_and_save_notification(delivery_id: int, text: str, actor_id: int = None, event_type: str = "notification"):
-    """Внутрішня функція для розсилки повідомлень всім отримувачам (крім актора)"""
+    """Внутрішня функція для розсилки повідомлень всім отримувачам (крім актора) через чергу відправки"""
     for admin_id in ALL_RECIPIENTS:
         if actor_id and admin_id == actor_id:
             continue
-            
-        try:
-            msg = await bot.send_message(chat_id=admin_id, text=text, parse_mode="HTML")
-            
-            new_note = DeliveryNotifications(
-                delivery_id=delivery_id,
-                telegram_id=admin_id,
-                message_id=msg.message_id,
-                event_type=event_type
-            )
-            await new_note.save().run()
-            
-            # Запланувати видалення через 30 хвилин
-            try:
-                from .utils import schedule_message_deletion
-                await schedule_message_deletion(chat_id=admin_id, message_id=msg.message_id, delay_minutes=30)
-            except Exception as e:
-                logger.warning(f"⚠️ Не вдалося запланувати видалення повідомлення {msg.message_id}: {e}")
-                
-        except Exception as e:
-            logger.error(f"❌ Помилка відправки повідомлення отримувачу {admin_id}: {e}")
+
+        send_queue.send_message(
+            bot, admin_id, text, parse_mode="HTML",
+            on_sent=partial(_save_notification, delivery_id, admin_id, event_type, delete_after=30),
+        )
 
 
 async def notify_delivery_status_change(delivery: Deliveries, status: str, actor_name: str = None, actor_id: int = None):
@@ -250,22 +268,32 @@ async def check_unresolved_deliveries_and_notify(target_day: str):
             f"Будь ласка, перевірте заявку та візьміть її в роботу або зв'яжіться з менеджером."
         )
 
-        # Відправляємо менеджеру
+        # Відправляємо менеджеру (через чергу відправки)
         if delivery.created_by:
-            try:
-                await bot.send_message(chat_id=delivery.created_by, text=manager_text, parse_mode="HTML")
-                logger.info(f"✅ Надіслано сповіщення менеджеру {delivery.created_by} для доставки {delivery.id}")
-            except Exception as e:
-                logger.error(f"❌ Помилка надсилання сповіщення менеджеру {delivery.created_by} для доставки {delivery.id}: {e}")
+            description = f"сповіщення менеджеру {delivery.created_by} для доставки {delivery.id}"
+            send_queue.send_message(
+                bot, delivery.created_by, manager_text, parse_mode="HTML",
+                on_sent=partial(_log_sent, description),
+                on_error=partial(_log_send_error, description),
+            )
 
         # Відправляємо логістам та адмінам (виключаємо менеджера, якщо він є серед них, щоб не дублювати)
         admins_to_notify = [adm_id for adm_id in ALL_RECIPIENTS if adm_id != delivery.created_by]
         for admin_id in admins_to_notify:
-            try:
-                await bot.send_message(chat_id=admin_id, text=admin_text, parse_mode="HTML")
-                logger.info(f"✅ Надіслано сповіщення адміну/логісту {admin_id} для доставки {delivery.id}")
-            except Exception as e:
-                logger.error(f"❌ Помилка надсилання сповіщення адміну/логісту {admin_id} для доставки {delivery.id}: {e}")
+            description = f"сповіщення адміну/логісту {admin_id} для доставки {delivery.id}"
+            send_queue.send_message(
+                bot, admin_id, admin_text, parse_mode="HTML",
+                on_sent=partial(_log_sent, description),
+                on_error=partial(_log_send_error, description),
+            )
+
+
+async def _log_sent(description: str, msg):
+    logger.info(f"✅ Надіслано {description}")
+
+
+async def _log_send_error(description: str, error: Exception):
+    logger.error(f"❌ Помилка надсилання {description}: {error}")
 
 def get_working_minutes_elapsed(start_dt, end_dt, tz) -> float:
     """
@@ -346,7 +374,8 @@ async def check_urgent_pickups_and_notify():
             (DeliveryNotifications.event_type == "pickup_warning")
         ).first().run()
 
-        if already_notified:
+        # Попередження могли вже поставити в чергу, але ще не зберегти в БД
+        if already_notified or delivery.id in _pickup_warnings_queued:
             continue
 
         logger.info(f"⚠️ Знайдено завислу термінову заявку 'Самовивіз' ID: {delivery.id} (створена: {delivery.created_at}, робочих хвилин: {working_minutes:.1f})")
@@ -376,36 +405,27 @@ async def check_urgent_pickups_and_notify():
             f"Заявка була створена більше 30 робочих хвилин тому. Будь ласка, обробіть її або зв'яжіться з менеджером."
         )
 
-        # Відправляємо менеджеру та зберігаємо в БД
-        if delivery.created_by:
-            try:
-                msg = await bot.send_message(chat_id=delivery.created_by, text=manager_text, parse_mode="HTML")
-                new_note = DeliveryNotifications(
-                    delivery_id=delivery.id,
-                    telegram_id=delivery.created_by,
-                    message_id=msg.message_id,
-                    event_type="pickup_warning"
-                )
-                await new_note.save().run()
-                logger.info(f"✅ Надіслано та збережено сповіщення про самовивіз менеджеру {delivery.created_by}")
-            except Exception as e:
-                logger.error(f"❌ Помилка надсилання сповіщення про самовивіз менеджеру {delivery.created_by}: {e}")
-
-        # Відправляємо адмінам та логістам та зберігаємо в БД (виключаючи менеджера)
-        admins_to_notify = [adm_id for adm_id in ALL_RECIPIENTS if adm_id != delivery.created_by]
-        for admin_id in admins_to_notify:
-            try:
-                msg = await bot.send_message(chat_id=admin_id, text=admin_text, parse_mode="HTML")
-                new_note = DeliveryNotifications(
-                    delivery_id=delivery.id,
-                    telegram_id=admin_id,
-                    message_id=msg.message_id,
-                    event_type="pickup_warning"
-                )
-                await new_note.save().run()
-                logger.info(f"✅ Надіслано та збережено сповіщення про самовивіз адміну/логісту {admin_id}")
-            except Exception as e:
-                logger.error(f"❌ Помилка надсилання сповіщення про самовивіз адміну/логісту {admin_id}: {e}")
+        # Відправляємо менеджеру, адмінам та логістам через чергу; ID повідомлень зберігаються в БД після відправки
+        recipients = [(delivery.created_by, manager_text)] if delivery.created_by else []
+        recipients += [(adm_id, admin_text) for adm_id in ALL_RECIPIENTS if adm_id != delivery.created_by]
+        futures = [
+            send_queue.send_message(
+                bot, chat_id, text, parse_mode="HTML",
+                on_sent=partial(_save_notification, delivery.id, chat_id, "pickup_warning"),
+                on_error=partial(_log_send_error, f"сповіщення про самовивіз {chat_id} для доставки {delivery.id}"),
+            )
+            for chat_id, text in recipients
+        ]
+        if futures:
+            # Future черги завершується вже після on_sent, тобто після запису в БД
+            _pickup_warnings_queued.add(delivery.id)
+            asyncio.gather(*futures, return_exceptions=True).add_done_callback(
+                partial(_forget_pickup_warning, delivery.id)
+            )
+
+
+def _forget_pickup_warning(delivery_id: int, _):
+    _pickup_warnings_queued.discard(delivery_id)
 
 
 
@@ -0,0 +1,236 @@
+# app/export_stream.py
+"""
+Потоковая выгрузка результатов SQL-запроса в XLSX и CSV.
+
+Строки читаются серверным курсором asyncpg пачками по EXPORT_FETCH_SIZE и сразу
+уходят в writer, поэтому весь результат никогда не лежит в памяти целиком:
+- CSV отдается клиенту по мере чтения курсора — первый байт уходит сразу;
+- XLSX тоже отдается по мере чтения: книга собирается в zip-архив, который пишется
+  в поток без перемотки (размеры записей идут в data descriptor после данных), а лист
+  сжимается по пачке строк и уходит клиенту чанками по EXPORT_CHUNK_SIZE — ни
+  временного файла, ни книги целиком в памяти.
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
+
+from openpyxl.utils import get_column_letter
+from starlette.concurrency import run_in_threadpool
+
+from .tables import Remains
+
+EXPORT_FETCH_SIZE = 2000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MEDIA_TYPE = "text/csv; charset=utf-8"
+
+
+async def iter_query_batches(sql: str, *args) -> AsyncGenerator[List[tuple], None]:
+    """
+    Выполняет запрос серверным курсором и отдает строки пачками.
+    В SQL используются нативные плейсхолдеры asyncpg ($1, $2, ...).
+    """
+    connection = await Remains._meta.db.get_new_connection()
+    try:
+        async with connection.transaction():
+            cursor = await connection.cursor(sql, *args)
+            while True:
+                records = await cursor.fetch(EXPORT_FETCH_SIZE)
+                if not records:
+                    break
+                yield [tuple(record.values()) for record in records]
+    finally:
+        await connection.close()
+
+
+async def empty_batches() -> AsyncGenerator[List[tuple], None]:
+    """Пустой источник строк — в файле будет только заголовок."""
+    return
+    yield
+
+
+def select_columns(header: Sequence[str], columns: Optional[List[str]]) -> List[int]:
+    """Индексы выбранных колонок в порядке запроса; пустой или неверный выбор — все колонки."""
+    if columns:
+        indexes = [header.index(name) for name in columns if name in header]
+        if indexes:
+            return indexes
+    return list(range(len(header)))
+
+
+async def stream_csv(
+    header: Sequence[str], batches: AsyncGenerator[List[tuple], None], indexes: List[int]
+) -> AsyncIterator[bytes]:
+    """CSV с BOM (чтобы Excel распознал UTF-8) и разделителем ';', по пачке строк на чанк."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";")
+    writer.writerow([header[i] for i in indexes])
+    # aclose закрывает курсор и его соединение сразу, даже если клиент оборвал загрузку
+    try:
+        yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+        async for rows in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([row[i] for i in indexes] for row in rows)
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        await batches.aclose()
+
+
+# Служебные части книги XLSX: один лист, стили 1 и 2 — дата и дата со временем
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '<Relationship Id="rId2" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+# Управляющие символы, недопустимые в XML (openpyxl на них падает, здесь — вырезаем)
+ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Поток без перемотки для zipfile: копит записанные байты до drain()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def pending(self) -> int:
+        return self._size
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return data
+
+
+def _xlsx_cell(ref: str, value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, Decimal)) or (isinstance(value, float) and value == value and abs(value) != float("inf")):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="2"><v>{serial}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="1"><v>{(value - EXCEL_EPOCH.date()).days}</v></c>'
+    text = escape(ILLEGAL_XML_CHARS.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _write_xlsx_rows(sheet, rows: Sequence[Sequence], indexes: List[int], first_row: int, letters: List[str]) -> None:
+    parts = []
+    for number, row in enumerate(rows, start=first_row):
+        cells = "".join(_xlsx_cell(f"{letter}{number}", row[i]) for letter, i in zip(letters, indexes))
+        parts.append(f'<row r="{number}">{cells}</row>')
+    sheet.write("".join(parts).encode("utf-8"))
+
+
+async def stream_xlsx(
+    header: Sequence[str],
+    batches: AsyncGenerator[List[tuple], None],
+    indexes: List[int],
+    sheet_name: str,
+) -> AsyncIterator[bytes]:
+    """
+    XLSX, который уходит клиенту по мере чтения курсора: лист сжимается по пачке строк,
+    чанки отдаются, как только набирается EXPORT_CHUNK_SIZE сжатых байт.
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    letters = [get_column_letter(i + 1) for i in range(len(indexes))]
+    try:
+        archive.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", XLSX_ROOT_RELS)
+        archive.writestr("xl/workbook.xml", XLSX_WORKBOOK.format(name=escape(sheet_name, {'"': "&quot;"})))
+        archive.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        archive.writestr("xl/styles.xml", XLSX_STYLES)
+
+        with archive.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(XLSX_SHEET_START.encode("utf-8"))
+            _write_xlsx_rows(sheet, [header], indexes, 1, letters)
+            next_row = 2
+            async for rows in batches:
+                # Разметка и сжатие пачки — в пуле потоков, чтобы не держать event loop
+                await run_in_threadpool(_write_xlsx_rows, sheet, rows, indexes, next_row, letters)
+                next_row += len(rows)
+                if sink.pending() >= EXPORT_CHUNK_SIZE:
+                    yield sink.drain()
+            sheet.write(XLSX_SHEET_END.encode("utf-8"))
+        archive.close()
+        yield sink.drain()
+    finally:
+        await batches.aclose()
@@ -0,0 +1,198 @@
+# app/login_token_store.py
+"""
+Хранилище токенов входа через бота (deep link): /auth/generate-login-token ->
+бот вызывает confirm_login_token -> браузер опрашивает /auth/check-login-token.
+
+Токен — словарь {"status", "expires", "init_data", "user_id"}. Бэкенд выбирается
+переменной LOGIN_TOKEN_STORE:
+- "memory"   — в памяти процесса (только для одного воркера);
+- "postgres" — таблица login_tokens, общая для всех воркеров: подтверждение и
+  опрос могут попасть в разные процессы.
+
+Опрос статуса может ждать изменения токена (long-poll, wait): ожидание в том же
+процессе будится сразу при update/delete, а в Postgres токен дополнительно
+перечитывается раз в LOGIN_TOKEN_POLL_INTERVAL секунд — подтверждение могло прийти
+в другой воркер.
+
+Просроченный токен еще LOGIN_TOKEN_GRACE секунд отвечает статусом "expired",
+после чего удаляется (в памяти — по TTL записи, в Postgres — при создании нового токена).
+"""
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import InMemoryCache
+from .config import logger, LOGIN_TOKEN_STORE
+from .tables import LoginTokens
+
+LOGIN_TOKEN_TTL = 300
+LOGIN_TOKEN_GRACE = 60
+# Сколько токенов помнит память процесса (с запасом на всплеск входов)
+LOGIN_TOKEN_MAX_COUNT = 10000
+# Максимальное ожидание long-poll в секундах (меньше таймаутов прокси перед API)
+LOGIN_TOKEN_WAIT_MAX = 25
+# Как часто ожидание перечитывает токен из Postgres
+LOGIN_TOKEN_POLL_INTERVAL = 1.0
+
+
+class LoginTokenStore(ABC):
+    """Общий интерфейс хранилища токенов входа."""
+
+    def __init__(self):
+        # token -> (событие изменения, число ожидающих)
+        self._waiters: Dict[str, Tuple[asyncio.Event, int]] = {}
+
+    def _notify(self, token: str) -> None:
+        """Будит всех, кто ждет изменения токена в этом процессе."""
+        waiter = self._waiters.pop(token, None)
+        if waiter is not None:
+            waiter[0].set()
+
+    async def _wait_event(self, token: str, timeout: float) -> bool:
+        """Ждет _notify(token) не дольше timeout секунд; True — если дождались."""
+        event, count = self._waiters.get(token) or (asyncio.Event(), 0)
+        self._waiters[token] = (event, count + 1)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiter = self._waiters.get(token)
+            if waiter is not None and waiter[0] is event:
+                if waiter[1] <= 1:
+                    del self._waiters[token]
+                else:
+                    self._waiters[token] = (event, waiter[1] - 1)
+
+    async def wait(self, token: str, timeout: float) -> None:
+        """Ждет изменения токена (подтверждение, запрет, удаление) не дольше timeout секунд."""
+        await self._wait_event(token, timeout)
+
+    @abstractmethod
+    async def create(self, token: str, ttl: int = LOGIN_TOKEN_TTL) -> bool:
+        """Создает токен в статусе pending; False — если такой токен уже есть."""
+
+    @abstractmethod
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def update(self, token: str, **fields) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, token: str) -> None:
+        ...
+
+
+def new_token_entry(ttl: int) -> Dict[str, Any]:
+    return {
+        "status": "pending",
+        "expires": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+        "init_data": None,
+        "user_id": None,
+    }
+
+
+class InMemoryLoginTokenStore(LoginTokenStore):
+    """Токены в памяти процесса; просроченные удаляются по TTL записи, без обхода всех токенов."""
+
+    def __init__(self, max_size: int = LOGIN_TOKEN_MAX_COUNT):
+        super().__init__()
+        self._cache = InMemoryCache(max_size=max_size, default_ttl=LOGIN_TOKEN_TTL + LOGIN_TOKEN_GRACE)
+
+    async def create(self, token: str, ttl: int = LOGIN_TOKEN_TTL) -> bool:
+        if self._cache.get(token) is not None:
+            return False
+        self._cache.set(token, new_token_entry(ttl), ttl=ttl + LOGIN_TOKEN_GRACE)
+        return True
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        entry = self._cache.get(token)
+        return dict(entry) if entry is not None else None
+
+    async def update(self, token: str, **fields) -> None:
+        entry = self._cache.get(token)
+        if entry is not None:
+            # Изменяем запись на месте, чтобы не продлевать ее TTL
+            entry.update(fields)
+        self._notify(token)
+
+    async def delete(self, token: str) -> None:
+        self._cache.delete(token)
+        self._notify(token)
+
+
+class PostgresLoginTokenStore(LoginTokenStore):
+    """Токены в таблице login_tokens; просроченные строки удаляются при создании нового токена."""
+
+    async def create(self, token: str, ttl: int = LOGIN_TOKEN_TTL) -> bool:
+        now = datetime.now(timezone.utc)
+        await LoginTokens.delete().where(
+            LoginTokens.expires_at <= now - timedelta(seconds=LOGIN_TOKEN_GRACE)
+        ).run()
+        entry = new_token_entry(ttl)
+        inserted = await LoginTokens.raw(
+            """
+            INSERT INTO login_tokens (token, status, expires_at)
+            VALUES ({}, {}, {})
+            ON CONFLICT (token) DO NOTHING
+            RETURNING token
+            """,
+            token,
+            entry["status"],
+            entry["expires"],
+        ).run()
+        return bool(inserted)
+
+    async def get(self, token: str) -> Optional[Dict[str, Any]]:
+        row = (
+            await LoginTokens.select(
+                LoginTokens.status,
+                LoginTokens.expires_at.as_alias("expires"),
+                LoginTokens.init_data,
+                LoginTokens.user_id,
+            )
+            .where(LoginTokens.token == token)
+            .first()
+            .run()
+        )
+        return row
+
+    async def update(self, token: str, **fields) -> None:
+        await LoginTokens.update(
+            {getattr(LoginTokens, name): value for name, value in fields.items()}
+        ).where(LoginTokens.token == token).run()
+        self._notify(token)
+
+    async def delete(self, token: str) -> None:
+        await LoginTokens.delete().where(LoginTokens.token == token).run()
+        self._notify(token)
+
+    async def wait(self, token: str, timeout: float) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            if await self._wait_event(token, min(remaining, LOGIN_TOKEN_POLL_INTERVAL)):
+                return
+            entry = await self.get(token)
+            if entry is None or entry["status"] != "pending":
+                return
+
+
+def create_login_token_store() -> LoginTokenStore:
+    if LOGIN_TOKEN_STORE == "postgres":
+        logger.info("🗄️ Токены входа через бота хранятся в Postgres (login_tokens).")
+        return PostgresLoginTokenStore()
+    if LOGIN_TOKEN_STORE != "memory":
+        logger.warning(f"Неизвестный LOGIN_TOKEN_STORE={LOGIN_TOKEN_STORE!r}, используется 'memory'.")
+    return InMemoryLoginTokenStore()
+
+
+# Глобальный инстанс хранилища
+login_token_store = create_login_token_store()
@@ -90,10 +90,14 @@ from .telegram_auth import (
     check_telegram_auth,
     get_current_telegram_user,
     check_not_guest,
+    check_admin,
+    invalidate_user,
 )
 from .data_retrieval import router as data_retrieval_router
-from .data_loader import save_processed_data_to_db
+from .data_loader import save_processed_data_to_db, shutdown_parse_executor
 from .cache import cached_endpoint, db_cache
+from .response_formats import FastJSONResponse
+from .session_store import session_store
 from .bi import router as bi_router
 from .bi_pandas import router as bi_pandas_router
 from .order_chat import router as chat_router
@@ -102,6 +106,7 @@ from .nova_poshta import router as nova_poshta_router, call_np_api
 from .bot_handlers import setup_bot_handlers
 from .scheduler import setup_scheduler
 from .utils import send_message_to_managers, create_composite_key_from_dict
+from .telegram_queue import send_queue
 from .delivery_notifications import notify_new_delivery, notify_delivery_status_change, delete_delivery_notifications, notify_delivery_date_change, ALL_RECIPIENTS
 from .error_notifier import notify_admins_error
 
@@ -144,8 +149,6 @@ if "127.0.0.1" not in admin_allowed_hosts: admin_allowed_hosts.append("127.0.0.1
 
 admin_router = create_admin([Remains, ValidWarehouseAdmin], allowed_hosts=admin_allowed_hosts)
 
-sessions = {}
-
 
 def get_fallback_weight(line_of_business: str, nomenclature: str) -> float:
     """
@@ -211,6 +214,9 @@ async def lifespan(app: FastAPI):
             logger.info("Telegram webhook removed.")
         except Exception:
             pass
+    # Даємо черзі Telegram дослати поставлені повідомлення
+    await send_queue.close(timeout=10)
+    shutdown_parse_executor()
     logger.info("Piccolo database engine shutdown. Connections are closed automatically.")
 
 
@@ -243,6 +249,8 @@ app = FastAPI(
     description="API for loading and processing various Excel data into PostgreSQL.",
     version="1.0.0",
     lifespan=lifespan,
+    # orjson вместо json: быстрее и понимает numpy-типы
+    default_response_class=FastJSONResponse,
 )
 
 app.add_middleware(
@@ -251,6 +259,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
     max_age=600,
 )
 
@@ -588,7 +597,9 @@ async def upload_and_process_files(
         data["current_moved"] = pd.DataFrame(data["current_moved"]).set_index("index")
         data["current_notes"] = pd.DataFrame(data["current_notes"]).set_index("index")
 
-    sessions[session_id] = {"leftovers": leftovers, "matched_list": matched_list}
+    await session_store.set(
+        session_id, {"leftovers": leftovers, "matched_list": matched_list}
+    )
 
     response_leftovers = processing.convert_numpy_types(leftovers)
     for req_id, data in response_leftovers.items():
@@ -608,102 +619,107 @@ async def manual_match(session_id: str, match_input: models.ManualMatchInput):
     Эндпоинт для ручного сопоставления с УЛУЧШЕННЫМ АЛГОРИТМОМ.
     Теперь поддерживает частичное сопоставление (когда суммы не равны).
     """
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Сессия не найдена.")
+    # Сессию читаем, меняем и записываем под блокировкой: одновременные сопоставления
+    # в одной сессии иначе перезапишут изменения друг друга
+    async with session_store.lock(session_id):
+        session_data = await session_store.get(session_id)
+        if session_data is None:
+            raise HTTPException(status_code=404, detail="Сессия не найдена.")
 
-    session_data = sessions[session_id]
-    request_id = match_input.request_id
-
-    if request_id not in session_data["leftovers"]:
-        raise HTTPException(
-            status_code=404, detail=f"Заявка с ID {request_id} не найдена."
-        )
-
-    leftover_data = session_data["leftovers"][request_id]
-    current_moved_df = leftover_data["current_moved"]
-    current_notes_df = leftover_data["current_notes"]
-
-    # Извлекаем индексы из нового формата запроса
-    selected_moved_indices = [item.index for item in match_input.selected_moved_items]
-
-    try:
-        # Проверяем наличие всех нужных строк перед началом обработки
-        # current_moved_df.loc[selected_moved_indices]
-        selected_moved = current_moved_df.loc[selected_moved_indices]
-        selected_notes = current_notes_df.loc[match_input.selected_notes_indices]
-    except KeyError:
-        raise HTTPException(
-            status_code=400,
-            detail="Ошибка: одна или несколько выбранных позиций уже были сопоставлены ранее.",
-        )
+        request_id = match_input.request_id
 
-    newly_matched = []
-    product = leftover_data["product"]
-    # --- НОВЫЙ УПРОЩЕННЫЙ АЛГОРИТМ ---
-    # Мы доверяем ручному выбору пользователя и не проводим строгих проверок по сумме.
-    # Просто создаем сопоставленные записи на основе выбора.
+        if request_id not in session_data["leftovers"]:
+            raise HTTPException(
+                status_code=404, detail=f"Заявка с ID {request_id} не найдена."
+            )
 
-    if selected_moved.empty or selected_notes.empty:
-        raise HTTPException(
-            status_code=400,
-            detail="Необходимо выбрать хотя бы одну позицию из 'перемещено' и одну из 'примечаний'.",
-        )
+        leftover_data = session_data["leftovers"][request_id]
+        current_moved_df = leftover_data["current_moved"]
+        current_notes_df = leftover_data["current_notes"]
 
-    # Используем информацию из первого выбранного примечания (договор)
-    # для всех сопоставляемых перемещений.
-    main_note_row = selected_notes.iloc[0]
-    main_contract = main_note_row["Договор"]
+        # Извлекаем индексы из нового формата запроса
+        selected_moved_indices = [item.index for item in match_input.selected_moved_items]
 
-    # Проходим по каждому элементу, который выбрал пользователь
-    for selected_item in match_input.selected_moved_items:
-        moved_index = selected_item.index
-        requested_qty = selected_item.quantity
+        try:
+            # Проверяем наличие всех нужных строк перед началом обработки
+            # current_moved_df.loc[selected_moved_indices]
+            selected_moved = current_moved_df.loc[selected_moved_indices]
+            selected_notes = current_notes_df.loc[match_input.selected_notes_indices]
+        except KeyError:
+            raise HTTPException(
+                status_code=400,
+                detail="Ошибка: одна или несколько выбранных позиций уже были сопоставлены ранее.",
+            )
 
-        # Получаем строку из DataFrame по индексу
-        moved_row = current_moved_df.loc[moved_index]
-        available_qty = moved_row["Перемещено"]
+        newly_matched = []
+        product = leftover_data["product"]
+        # --- НОВЫЙ УПРОЩЕННЫЙ АЛГОРИТМ ---
+        # Мы доверяем ручному выбору пользователя и не проводим строгих проверок по сумме.
+        # Просто создаем сопоставленные записи на основе выбора.
 
-        # Проверка, что запрошенное количество не превышает доступное
-        if requested_qty > available_qty:
+        if selected_moved.empty or selected_notes.empty:
             raise HTTPException(
                 status_code=400,
-                detail=f"Ошибка: Попытка списать {requested_qty} по позиции с индексом {moved_index}, но доступно только {available_qty}.",
+                detail="Необходимо выбрать хотя бы одну позицию из 'перемещено' и одну из 'примечаний'.",
             )
 
-        # Создаем новую сопоставленную запись
-        record = moved_row.to_dict()
-        record["Договор"] = main_contract
-        # Количество берем из запроса, а не всю доступную сумму
-        record["Количество"] = requested_qty
-        record["Источник"] = "Ручное сопоставление"
-        newly_matched.append(record)
-
-        # --- Логика списания ---
-        remaining_qty = available_qty - requested_qty
-        if remaining_qty > 0:
-            # Частичное списание: обновляем остаток
-            current_moved_df.loc[moved_index, "Перемещено"] = remaining_qty
-        else:
-            # Полное списание: удаляем строку
-            current_moved_df.drop(moved_index, inplace=True)
+        # Используем информацию из первого выбранного примечания (договор)
+        # для всех сопоставляемых перемещений.
+        main_note_row = selected_notes.iloc[0]
+        main_contract = main_note_row["Договор"]
+
+        # Проходим по каждому элементу, который выбрал пользователь
+        for selected_item in match_input.selected_moved_items:
+            moved_index = selected_item.index
+            requested_qty = selected_item.quantity
+
+            # Получаем строку из DataFrame по индексу
+            moved_row = current_moved_df.loc[moved_index]
+            available_qty = moved_row["Перемещено"]
+
+            # Проверка, что запрошенное количество не превышает доступное
+            if requested_qty > available_qty:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Ошибка: Попытка списать {requested_qty} по позиции с индексом {moved_index}, но доступно только {available_qty}.",
+                )
 
-    # Обновляем состояние "примечаний" (удаляем выбранные)
-    try:
-        current_notes_df.drop(match_input.selected_notes_indices, inplace=True)
-    except KeyError:
-        # Эта ошибка может возникнуть, если фронтенд отправит уже удаленные индексы.
-        # Мы можем ее проигнорировать или вернуть предупреждение.
-        logger.info(
-            f"Предупреждение: Попытка удалить уже сопоставленные индексы для сессии {session_id}"
-        )
-        pass
+            # Создаем новую сопоставленную запись
+            record = moved_row.to_dict()
+            record["Договор"] = main_contract
+            # Количество берем из запроса, а не всю доступную сумму
+            record["Количество"] = requested_qty
+            record["Источник"] = "Ручное сопоставление"
+            newly_matched.append(record)
+
+            # --- Логика списания ---
+            remaining_qty = available_qty - requested_qty
+            if remaining_qty > 0:
+                # Частичное списание: обновляем остаток
+                current_moved_df.loc[moved_index, "Перемещено"] = remaining_qty
+            else:
+                # Полное списание: удаляем строку
+                current_moved_df.drop(moved_index, inplace=True)
+
+        # Обновляем состояние "примечаний" (удаляем выбранные)
+        try:
+            current_notes_df.drop(match_input.selected_notes_indices, inplace=True)
+        except KeyError:
+            # Эта ошибка может возникнуть, если фронтенд отправит уже удаленные индексы.
+            # Мы можем ее проигнорировать или вернуть предупреждение.
+            logger.info(
+                f"Предупреждение: Попытка удалить уже сопоставленные индексы для сессии {session_id}"
+            )
+            pass
+
+        # --- КОНЕЦ НОВОГО АЛГОРИТМА ---
 
-    # --- КОНЕЦ НОВОГО АЛГОРИТМА ---
+        session_data["matched_list"].extend(newly_matched)
 
-    session_data["matched_list"].extend(newly_matched)
+        if leftover_data["current_moved"].empty or leftover_data["current_notes"].empty:
+            del session_data["leftovers"][request_id]
 
-    if leftover_data["current_moved"].empty or leftover_data["current_notes"].empty:
-        del session_data["leftovers"][request_id]
+        await session_store.set(session_id, session_data)
 
     return {
         "message": "Ручное сопоставление успешно обработано",
@@ -718,11 +734,10 @@ async def manual_match(session_id: str, match_input: models.ManualMatchInput):
     tags=["Processing"],
 )
 async def get_results(session_id: str):
-    if session_id not in sessions:
+    session_data = await session_store.get(session_id)
+    if session_data is None:
         raise HTTPException(status_code=404, detail="Сессия не найдена.")
 
-    session_data = sessions[session_id]
-
     unmatched_by_request = {}
     response_leftovers = processing.convert_numpy_types(session_data["leftovers"])
     for req_id, data in response_leftovers.items():
@@ -737,6 +752,33 @@ async def get_results(session_id: str):
     }
 
 
+@app.get("/cache/stats", tags=["Cache"])
+async def get_cache_stats(
+    with_bytes: bool = Query(True, description="Оценить объем закэшированных данных в байтах"),
+    current_user=Depends(check_admin),
+):
+    """
+    Статистика in-memory кэша эндпоинтов (только для администраторов):
+    размер, hit ratio, вытеснения, инвалидации, возраст самой старой записи,
+    примерный объем и время выполнения запросов к БД по каждому эндпоинту.
+    """
+    return db_cache.stats(with_bytes=with_bytes)
+
+
+@app.post("/cache/users/invalidate", tags=["Cache"])
+async def invalidate_user_cache(
+    telegram_id: Optional[int] = Query(None, description="ID користувача; без нього — всі"),
+    current_user=Depends(check_admin),
+):
+    """
+    Сбрасывает кэш пользователей авторизации (только для администраторов) —
+    после изменения прав (is_allowed, is_guest, is_admin) прямо в БД, чтобы они
+    применились сразу, а не через USER_CACHE_TTL. Сбрасывается кэш только воркера,
+    принявшего запрос: в остальных права обновятся не позже чем через USER_CACHE_TTL.
+    """
+    return {"dropped": invalidate_user(telegram_id)}
+
+
 @app.post(
     "/upload-data",
     summary="Загрузить и обработать Excel-файлы",
@@ -823,7 +865,7 @@ async def get_regions():
 
 # 2. Поиск населенного пункта в области
 @app.get("/get_all_orders_and_address")
-@cached_endpoint()
+@cached_endpoint(tables=(Submissions, Remains, ClientAddress))
 async def get_all_orders_and_address():
     """
     Возвращает список заказов с вычисленным общим весом и список адресов.
@@ -958,7 +1000,7 @@ async def update_address_for_client(address_data: AddressCreate, id: int, reques
 
         # Сохраняем изменения
         await obj.save()
-        db_cache.clear()
+        db_cache.invalidate(ClientAddress)
         logger.info(f"update_address_for_client id={id}: saved successfully")
         return {"status": "ok"}
     except Exception as exc:
@@ -1020,7 +1062,7 @@ async def create_address_for_client(address_data: AddressCreate, request: Reques
         clean_dict = {k: v for k, v in data_dict.items() if k in valid_columns}
         new_address = ClientAddress(**clean_dict)
         await new_address.save().run()
-        db_cache.clear()
+        db_cache.invalidate(ClientAddress)
         return {"status": "ok", "message": "Адрес успешно создан."}
     except UniqueViolationError:
         raise HTTPException(
@@ -2,12 +2,14 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 import os
 import html
+from functools import partial
 from typing import Dict, Any, Optional
 from urllib.parse import quote
 
 from new_agri_bot_backend.config import bot, LOGISTICS_TELEGRAM_IDS, SEND_NOTIFICATIONS, logger
 from new_agri_bot_backend.tables import Users, Submissions, OrderChatMessage
 from new_agri_bot_backend.telegram_auth import get_current_telegram_user, check_not_guest
+from new_agri_bot_backend.telegram_queue import send_queue
 
 WEBAPP_URL = os.getenv("WEBAPP_URL")
 
@@ -61,41 +63,34 @@ async def send_chat_notification(
         inline_keyboard=[[button]]
     )
 
-    # 6. Відправка через aiogram
-    try:
-        message = await bot.send_message(
-            chat_id=telegram_id,
-            text=notification_text,
-            parse_mode="HTML",
-            reply_markup=keyboard,
-            disable_web_page_preview=False,
-        )
+    # 6. Постановка в чергу відправки: результат доставки лише логується
+    send_queue.send_message(
+        bot,
+        telegram_id,
+        notification_text,
+        parse_mode="HTML",
+        reply_markup=keyboard,
+        disable_web_page_preview=False,
+        on_sent=partial(_on_chat_notification_sent, telegram_id, order_ref),
+        on_error=partial(_on_chat_notification_error, telegram_id, order_ref),
+    )
 
-        return {
-            "telegram_id": telegram_id,
-            "status": "sent",
-            "message_id": message.message_id,
-        }
+    return {"telegram_id": telegram_id, "status": "queued"}
 
-    except TelegramForbiddenError:
-        # Користувач заблокував бота
-        return {
-            "telegram_id": telegram_id,
-            "status": "blocked",
-            "error": "User blocked the bot",
-        }
 
-    except TelegramBadRequest as e:
-        # Невірний chat_id або інші помилки запиту
-        return {
-            "telegram_id": telegram_id,
-            "status": "failed",
-            "error": f"Bad request: {str(e)}",
-        }
+async def _on_chat_notification_sent(telegram_id: int, order_ref: str, message):
+    logger.info(f"💬 Чат-сповіщення по заявці {order_ref} надіслано {telegram_id} (message_id={message.message_id})")
 
-    except Exception as e:
-        # Інші помилки
-        return {"telegram_id": telegram_id, "status": "failed", "error": str(e)}
+
+async def _on_chat_notification_error(telegram_id: int, order_ref: str, error: Exception):
+    if isinstance(error, TelegramForbiddenError):
+        # Користувач заблокував бота
+        logger.warning(f"🚫 Користувач {telegram_id} заблокував бота, чат-сповіщення по заявці {order_ref} не доставлено")
+    elif isinstance(error, TelegramBadRequest):
+        # Невірний chat_id або інші помилки запиту
+        logger.error(f"❌ Bad request при чат-сповіщенні {telegram_id} по заявці {order_ref}: {error}")
+    else:
+        logger.error(f"❌ Помилка чат-сповіщення {telegram_id} по заявці {order_ref}: {error}")
 
 
 # routers/chat.py
@@ -131,17 +126,17 @@ async def notify_chat_message(
     # 2. Визначити отримувачів
     recipients = await determine_recipients(order_ref, current_user)
 
-    # 3. Відправити сповіщення через aiogram
-    notification_results = []
-    for recipient_id in recipients:
-        result = await send_chat_notification(
+    # 3. Поставити сповіщення в чергу відправки; доставку не чекаємо
+    notification_results = [
+        await send_chat_notification(
             telegram_id=recipient_id,
             order_ref=order_ref,
             message_text=message.message_text,
             sender_name=current_user.full_name_for_orders,
             client_name=client_name,
         )
-        notification_results.append(result)
+        for recipient_id in recipients
+    ]
 
     return {
         "status": "success",
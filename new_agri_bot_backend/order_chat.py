@@ -3,7 +3,7 @@ from datetime import datetime
 from typing import Optional
 from uuid import UUID
 
-from new_agri_bot_backend.tables import OrderChatMessage, Users
+from new_agri_bot_backend.tables import OrderChatMessage
 from new_agri_bot_backend.telegram_auth import get_current_telegram_user, check_not_guest
 
 
@@ -68,20 +68,11 @@ async def create_chat_message(
     user_data: dict = Depends(get_current_telegram_user),
 ):
     """Створити нове повідомлення в чаті"""
-    # Отримати дані користувача з БД
-    user = (
-        await Users.select()
-        .where(Users.telegram_id == user_data["telegram_id"])
-        .first()
-    )
-
-    if not user:
-        raise HTTPException(status_code=404, detail="Користувача не знайдено")
-
+    # user_data — рядок users, який уже знайшла залежність get_current_telegram_user
     message = OrderChatMessage(
         order_ref=order_ref,
-        user_id=user["telegram_id"],
-        user_name=user["full_name_for_orders"],
+        user_id=user_data["telegram_id"],
+        user_name=user_data["full_name_for_orders"],
         message_text=request.message_text,
         reply_to_message_id=request.reply_to_message_id,
     )
@@ -161,15 +152,8 @@ async def delete_chat_message(
     if not message:
         raise HTTPException(status_code=404, detail="Повідомлення не знайдено")
 
-    # Отримати дані користувача
-    user = (
-        await Users.select()
-        .where(Users.telegram_id == user_data["telegram_id"])
-        .first()
-    )
-
     # Перевірка прав (автор або адмін)
-    if message["user_id"] != user_data["telegram_id"] and not user["is_admin"]:
+    if message["user_id"] != user_data["telegram_id"] and not user_data["is_admin"]:
         raise HTTPException(status_code=403, detail="Недостатньо прав")
 
     await OrderChatMessage.delete().where(OrderChatMessage.id == message_id)
@@ -0,0 +1,59 @@
+# app/pagination.py
+"""
+Keyset-пагинация для больших списков /data/*.
+
+Пагинация включается параметром `limit`: тогда эндпоинт отдает
+{"items": [...], "limit": limit, "next_cursor": "..."} вместо полного списка.
+Курсор — непрозрачная строка (base64 от JSON со значениями ключа сортировки последней
+строки страницы). Следующая страница запрашивается с `cursor=next_cursor` и читается
+условием "ключ > курсор" по индексу, а не OFFSET, поэтому стоимость страницы
+не зависит от ее номера. next_cursor = null — страниц больше нет.
+"""
+import base64
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException, Query, status
+
+PAGE_SIZE_MAX = 5000
+
+LIMIT_QUERY = Query(
+    None, ge=1, le=PAGE_SIZE_MAX, description="Розмір сторінки; без нього повертається весь список"
+)
+CURSOR_QUERY = Query(None, description="next_cursor з попередньої сторінки")
+
+
+def encode_cursor(values: List[Any]) -> str:
+    raw = json.dumps(values, default=str, ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[List[Any]]:
+    """Значения ключа из курсора; None — первая страница. Битый курсор — 400."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return values
+
+
+def make_page(
+    rows: List[Any], limit: int, key: Callable[[Any], List[Any]], items: Optional[List[Any]] = None
+) -> Dict[str, Any]:
+    """
+    Собирает страницу из rows, прочитанных с LIMIT limit + 1: лишняя строка означает,
+    что есть следующая страница. key(row) — значения ключа сортировки для курсора.
+    items — готовые элементы страницы, если они строятся из rows отдельно.
+    """
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": rows if items is None else items,
+        "limit": limit,
+        "next_cursor": encode_cursor(key(rows[-1])) if has_more and rows else None,
+    }
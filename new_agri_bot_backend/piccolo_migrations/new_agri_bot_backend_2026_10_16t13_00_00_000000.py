@@ -0,0 +1,55 @@
+from piccolo.apps.migrations.auto.migration_manager import MigrationManager
+from piccolo.table import Table
+
+
+ID = "2026-10-16T13:00:00:000000"
+VERSION = "1.26.1"
+DESCRIPTION = "Add product_stock_totals MATERIALIZED VIEW with per-product free-stock aggregates"
+
+
+async def forwards():
+    manager = MigrationManager(
+        migration_id=ID, app_name="new_agri_bot_backend", description=DESCRIPTION
+    )
+
+    async def run_queries(backwards=False):
+        if not backwards:
+            await manager._run_query(Table.raw("DROP MATERIALIZED VIEW IF EXISTS product_stock_totals CASCADE"))
+
+            # orders_q — заявки "затверджено", total_orders — вместе с "продукція затверджена".
+            # is_free — то же условие, что раньше считалось в HAVING на каждый запрос free_only
+            await manager._run_query(Table.raw("""
+                CREATE MATERIALIZED VIEW product_stock_totals AS
+                SELECT pg.id AS product,
+                    SUM(r.buh) AS total_buh,
+                    COALESCE(o.orders_q, 0) AS orders_q,
+                    COALESCE(o.total_orders, 0) AS total_orders,
+                    COALESCE(
+                        SUM(r.buh) > 0 AND ((SUM(r.buh) - COALESCE(o.orders_q, 0) > 0) OR (COALESCE(o.total_orders, 0) = 0)),
+                        false
+                    ) AS is_free
+                FROM remains r
+                JOIN product_guide pg ON r.product = pg.id
+                LEFT JOIN (
+                    SELECT product,
+                           COALESCE(SUM(CASE WHEN document_status = 'затверджено' THEN different ELSE 0 END), 0) AS orders_q,
+                           COALESCE(SUM(CASE WHEN document_status IN ('затверджено', 'продукція затверджена') THEN different ELSE 0 END), 0) AS total_orders
+                    FROM submissions
+                    WHERE different > 0
+                    GROUP BY product
+                ) o ON o.product = pg.id
+                GROUP BY pg.id, o.orders_q, o.total_orders
+                WITH DATA;
+            """))
+
+            # Уникальный индекс обязателен для REFRESH MATERIALIZED VIEW CONCURRENTLY
+            await manager._run_query(Table.raw(
+                "CREATE UNIQUE INDEX product_stock_totals_product_idx ON product_stock_totals (product)"
+            ))
+            await manager._run_query(Table.raw(
+                "CREATE INDEX product_stock_totals_free_idx ON product_stock_totals (product) WHERE is_free"
+            ))
+
+    manager.run = run_queries
+
+    return manager
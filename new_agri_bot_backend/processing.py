@@ -1,6 +1,8 @@
+import math
 import pandas as pd
 import re
-from typing import Dict, Any, Tuple, List
+from collections import Counter
+from typing import Dict, Any, Tuple, List, Optional
 import numpy as np
 from .config import logger
 from .exceptions import ExcelValidationError
@@ -247,129 +249,164 @@ def process_uploaded_files(ordered_file, moved_file) -> Tuple[Dict, List]:
     test_data = test_data[test_data["Партія номенклатури"] != ""].copy()
     test_data["Перемещено"] = test_data["Перемещено"].astype(int)
 
+    leftovers, matched_list = match_requests(test_data)
+
+    leftovers = convert_numpy_types(leftovers)
+    matched_list = convert_numpy_types(matched_list)
+
+    return leftovers, matched_list
+
+
+REQUEST_COL = "Заявка на відвантаження"
+
+
+def _is_na(value: Any) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _note_quantities(qtys: List[Optional[int]]) -> List[Any]:
+    """
+    Количества из примечания с теми же типами, что дала бы колонка DataFrame:
+    int; float с NaN, если часть количеств не указана; None, если не указано ни одно.
+    """
+    if all(qty is None for qty in qtys):
+        return qtys
+    if any(qty is None for qty in qtys):
+        return [float("nan") if qty is None else float(qty) for qty in qtys]
+    return qtys
+
+
+def match_requests(test_data: pd.DataFrame) -> Tuple[Dict, List]:
+    """
+    Автоматически сопоставляет перемещения с договорами из примечаний по каждой заявке.
+
+    Данные один раз стабильно сортируются по заявке (в порядке первого появления),
+    после чего каждая заявка — это непрерывный срез, а итоги по заявкам считаются
+    одним groupby. Так нет повторной фильтрации всего фрейма на каждую заявку.
+    Эвристики (один договор, уникальное количество, сумма примечаний) и порядок
+    результатов те же, что и при обработке заявок по одной.
+    """
     matched_list = []
     leftovers = {}
-    all_requests = test_data["Заявка на відвантаження"].dropna().unique()
 
-    for request_id in all_requests:
+    codes, all_requests = pd.factorize(test_data[REQUEST_COL])
+    valid = codes >= 0
+    order = np.argsort(codes[valid], kind="stable")
+    data = test_data[valid].iloc[order]
+    sorted_codes = codes[valid][order]
+    starts = np.searchsorted(sorted_codes, np.arange(len(all_requests)), side="left")
+    ends = np.searchsorted(sorted_codes, np.arange(len(all_requests)), side="right")
+
+    records = data.to_dict("records")
+    index_labels = data.index.tolist()
+    products = data["Товар"].to_numpy()
+    notes = (
+        data["Примечание_заказано"].to_numpy()
+        if "Примечание_заказано" in data.columns
+        else None
+    )
+    total_moved_by_request = data.groupby(REQUEST_COL, sort=False)["Перемещено"].sum()
+    total_ordered_by_request = (
+        data.groupby([REQUEST_COL, "Товар"])["Заказано"]
+        .first()
+        .groupby(level=0, sort=False)
+        .sum()
+    )
+
+    for code, request_id in enumerate(all_requests):
+        start, end = starts[code], ends[code]
         try:
-            request_df = test_data[
-                test_data["Заявка на відвантаження"] == request_id
-            ].copy()
-            if request_df.empty:
+            if start == end:
                 continue
 
-            total_ordered = request_df.groupby("Товар")["Заказано"].first().sum()
-            total_moved = request_df["Перемещено"].sum()
-            product = request_df["Товар"].iloc[0]
-            current_moved = request_df.copy()
-            current_notes = pd.DataFrame(columns=["Договор", "Количество_в_примечании"])
+            total_ordered = total_ordered_by_request.get(request_id, 0.0)
+            total_moved = total_moved_by_request[request_id]
+            product = products[start]
+            notes_data = []
             note_text = ""
 
-            if "Примечание_заказано" in current_moved.columns and not pd.isna(
-                current_moved["Примечание_заказано"].iloc[0]
-            ):
-                note_text = current_moved["Примечание_заказано"].iloc[0]
+            if notes is not None and not pd.isna(notes[start]):
+                note_text = notes[start]
                 # Регулярка теперь поддерживает латиницу и кириллицу, а количество после тире стало необязательным
                 note_matches = re.findall(r"([a-zA-Z\u0410-\u042f]{2}-\d{8})(?:-(\d+))?", str(note_text))
-                if note_matches:
-                    notes_data = []
-                    for order_id, qty in note_matches:
-                        # Если количество в примечании не указано, временно ставим None
-                        notes_data.append([order_id, int(qty) if qty else None])
-                    
-                    current_notes = pd.DataFrame(
-                        notes_data, columns=["Договор", "Количество_в_примечании"]
-                    )
-
-            if not current_moved.empty and not current_notes.empty:
-                # --- НОВЫЙ СЦЕНАРИЙ (ВЫСШИЙ ПРИОРИТЕТ): Если в примечании только один договор ---
-                if len(current_notes) == 1:
-                    note_row_main = current_notes.iloc[0]
-                    for _, moved_row in current_moved.iterrows():
-                        record = moved_row.to_dict()
-                        record["Договор"] = note_row_main["Договор"]
-                        # Если в примечании не было количества, берем из строки перемещения
-                        qty_val = note_row_main["Количество_в_примечании"]
-                        record["Количество"] = qty_val if qty_val is not None else moved_row["Перемещено"]
-                        record["Источник"] = "Автоматически (один договор)"
-                        matched_list.append(record)
-                    # Так как все сопоставлено, очищаем и переходим к следующей заявке
-                    current_moved = pd.DataFrame(columns=current_moved.columns)
-                    current_notes = pd.DataFrame(columns=current_notes.columns)
-                    continue  # Переходим к следующему request_id
-
-                # --- Сценарий 1: Поиск однозначных совпадений по количеству ---
-                moved_counts = current_moved["Перемещено"].value_counts()
-                notes_counts = current_notes["Количество_в_примечании"].value_counts()
-                unique_qtys = moved_counts[(moved_counts == 1)].index.intersection(
-                    notes_counts[(notes_counts == 1)].index
-                )
-
-                if not unique_qtys.empty:
-                    unique_moved = current_moved[
-                        current_moved["Перемещено"].isin(unique_qtys)
-                    ]
-                    unique_notes = current_notes[
-                        current_notes["Количество_в_примечании"].isin(unique_qtys)
-                    ]
-                    matches_df = pd.merge(
-                        unique_moved,
-                        unique_notes,
-                        left_on="Перемещено",
-                        right_on="Количество_в_примечании",
-                    )
-
-                    for _, match_row in matches_df.iterrows():
-                        record = match_row.to_dict()
-                        record["Количество"] = record["Перемещено"]
+                for order_id, qty in note_matches:
+                    # Если количество в примечании не указано, временно ставим None
+                    notes_data.append([order_id, int(qty) if qty else None])
+
+            if not notes_data:
+                continue
+
+            # --- НОВЫЙ СЦЕНАРИЙ (ВЫСШИЙ ПРИОРИТЕТ): Если в примечании только один договор ---
+            if len(notes_data) == 1:
+                order_id, qty_val = notes_data[0]
+                for moved_record in records[start:end]:
+                    record = dict(moved_record)
+                    record["Договор"] = order_id
+                    # Если в примечании не было количества, берем из строки перемещения
+                    record["Количество"] = qty_val if qty_val is not None else moved_record["Перемещено"]
+                    record["Источник"] = "Автоматически (один договор)"
+                    matched_list.append(record)
+                # Так как все сопоставлено, переходим к следующей заявке
+                continue
+
+            # Несколько договоров: работаем со строками как со словарями, без DataFrame на заявку
+            moved_rows = list(range(start, end))
+            note_qtys = _note_quantities([qty for _, qty in notes_data])
+            note_rows = list(range(len(notes_data)))
+
+            # --- Сценарий 1: Поиск однозначных совпадений по количеству ---
+            moved_counts = Counter(
+                qty for qty in (records[i]["Перемещено"] for i in moved_rows) if not _is_na(qty)
+            )
+            notes_counts = Counter(qty for qty in note_qtys if not _is_na(qty))
+            unique_qtys = {qty for qty, n in moved_counts.items() if n == 1} & {
+                qty for qty, n in notes_counts.items() if n == 1
+            }
+
+            if unique_qtys:
+                note_by_qty = {note_qtys[j]: j for j in note_rows if note_qtys[j] in unique_qtys}
+                for i in moved_rows:
+                    moved_qty = records[i]["Перемещено"]
+                    if moved_qty in unique_qtys:
+                        record = dict(records[i])
+                        record["Договор"] = notes_data[note_by_qty[moved_qty]][0]
+                        record["Количество"] = moved_qty
                         record["Источник"] = "Автоматически"
-                        record.pop("Количество_в_примечании", None)
                         matched_list.append(record)
 
-                    current_moved = current_moved[
-                        ~current_moved["Перемещено"].isin(unique_qtys)
-                    ]
-                    current_notes = current_notes[
-                        ~current_notes["Количество_в_примечании"].isin(unique_qtys)
-                    ]
+                moved_rows = [i for i in moved_rows if records[i]["Перемещено"] not in unique_qtys]
+                note_rows = [j for j in note_rows if note_qtys[j] not in unique_qtys]
 
-            if not current_moved.empty and not current_notes.empty:
+            if moved_rows and note_rows:
                 # --- Сценарий 2: Одно перемещение равно сумме примечаний ---
-                if len(current_moved) == 1:
-                    moved_qty = current_moved["Перемещено"].iloc[0]
-                    notes_sum = current_notes["Количество_в_примечании"].sum()
-                    if moved_qty == notes_sum:
-                        moved_row_main = current_moved.iloc[0]
-                        for _, note_row in current_notes.iterrows():
-                            record = moved_row_main.to_dict()
-                            record["Договор"] = note_row["Договор"]
-                            record["Количество"] = note_row["Количество_в_примечании"]
+                if len(moved_rows) == 1:
+                    moved_record = records[moved_rows[0]]
+                    notes_sum = sum(note_qtys[j] for j in note_rows if not _is_na(note_qtys[j]))
+                    if moved_record["Перемещено"] == notes_sum:
+                        for j in note_rows:
+                            record = dict(moved_record)
+                            record["Договор"] = notes_data[j][0]
+                            record["Количество"] = note_qtys[j]
                             record["Источник"] = "Автоматически"
                             matched_list.append(record)
-                        current_moved = pd.DataFrame(columns=current_moved.columns)
-                        current_notes = pd.DataFrame(columns=current_notes.columns)
+                        continue
 
-            if not current_moved.empty and not current_notes.empty:
+            if moved_rows and note_rows:
                 leftovers[request_id] = {
                     "product": product,
                     "note_text": note_text,
                     "total_ordered": total_ordered,
                     "total_moved": total_moved,
-                    "current_moved": [
-                        dict(row, index=idx) for idx, row in current_moved.iterrows()
-                    ],
+                    "current_moved": [dict(records[i], index=index_labels[i]) for i in moved_rows],
                     "current_notes": [
-                        dict(row, index=idx) for idx, row in current_notes.iterrows()
+                        {"Договор": notes_data[j][0], "Количество_в_примечании": note_qtys[j], "index": j}
+                        for j in note_rows
                     ],
                 }
         except Exception as e:
             logger.info(f"!!! Ошибка при автоматической обработке заявки {request_id}: {e}")
             continue
 
-    leftovers = convert_numpy_types(leftovers)
-    matched_list = convert_numpy_types(matched_list)
-
     return leftovers, matched_list
 
 
@@ -0,0 +1,188 @@
+# app/response_formats.py
+"""
+Сериализация ответов API.
+
+JSON кодируется orjson (FastJSONResponse — класс ответа по умолчанию для приложения,
+dumps_json — готовые байты для кэша). numpy-скаляры и массивы сериализуются напрямую,
+NaN становится null, Decimal — int/float, как в jsonable_encoder FastAPI.
+
+Тяжелые BI-эндпоинты отдают и бинарные форматы (content negotiation по Accept):
+- application/json (по умолчанию) — как раньше;
+- application/msgpack — та же структура, что и JSON, но компактнее и быстрее кодируется;
+- application/vnd.apache.arrow.stream — колоночный Arrow IPC: списки записей из
+  ответа вида {"раздел": [записи]} складываются в одну таблицу с колонкой "section".
+
+msgpack и pyarrow — необязательные зависимости: без них запрос бинарного формата
+получает обычный JSON.
+"""
+import datetime
+import decimal
+import uuid
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from .config import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Допустимые значения Accept -> формат
+MEDIA_TYPE_FORMATS = {
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    "application/x-msgpack": "msgpack",
+    ARROW_MEDIA_TYPE: "arrow",
+}
+FORMAT_MEDIA_TYPES = {"msgpack": MSGPACK_MEDIA_TYPE, "arrow": ARROW_MEDIA_TYPE}
+
+# Описание альтернативных форматов для OpenAPI (responses= в декораторе роута)
+BINARY_FORMAT_RESPONSES = {
+    200: {
+        "content": {
+            MSGPACK_MEDIA_TYPE: {},
+            ARROW_MEDIA_TYPE: {},
+        },
+        "description": "JSON за замовчуванням; msgpack або Arrow IPC за заголовком Accept.",
+    }
+}
+
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def json_default(value: Any) -> Any:
+    """Типы, которых нет в orjson: Decimal как в FastAPI, остальное — через jsonable_encoder."""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    return jsonable_encoder(value)
+
+
+def dumps_json(content: Any) -> bytes:
+    return orjson.dumps(content, default=json_default, option=ORJSON_OPTIONS)
+
+
+def loads_json(body: bytes) -> Any:
+    return orjson.loads(body)
+
+
+class JSONBody:
+    """Уже закодированное JSON-тело (например, сохраненный снимок): кэш эндпоинтов отдает его как есть."""
+
+    __slots__ = ("body",)
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+
+def encode_body(result: Any) -> bytes:
+    """JSON-тело результата эндпоинта; JSONBody не кодируется повторно."""
+    if isinstance(result, JSONBody):
+        return result.body
+    return dumps_json(result)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse с кодированием через orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def available_formats() -> List[str]:
+    formats = []
+    if msgpack is not None:
+        formats.append("msgpack")
+    if pa is not None:
+        formats.append("arrow")
+    return formats
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """
+    Формат ответа по заголовку Accept: первый по q-весу из поддерживаемых и установленных.
+    Все остальное (включая */* и отсутствие заголовка) — "json".
+    """
+    if not accept:
+        return "json"
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, media_type.lower()))
+    for negative_quality, _, media_type in sorted(candidates):
+        if negative_quality == 0:
+            break
+        if media_type == JSON_MEDIA_TYPE:
+            return "json"
+        fmt = MEDIA_TYPE_FORMATS.get(media_type)
+        if fmt is None:
+            continue
+        if fmt in available_formats():
+            return fmt
+        logger.warning(f"Запрошен формат {media_type}, но библиотека не установлена — отдаем JSON.")
+    return "json"
+
+
+def plain_value(value: Any) -> Any:
+    """Скаляр, который msgpack/pyarrow кодируют без подсказок (как jsonable_encoder для JSON)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return plain_value(value)
+
+
+def encode_msgpack(result: Any) -> bytes:
+    return msgpack.packb(result, default=plain_value, use_bin_type=True)
+
+
+def arrow_rows(result: Any) -> List[Dict[str, Any]]:
+    """Плоский список записей для таблицы Arrow: разделы ответа помечаются колонкой section."""
+    if isinstance(result, list):
+        return result
+    if isinstance(result, dict) and all(isinstance(v, list) for v in result.values()):
+        return [{"section": section, **row} for section, rows in result.items() for row in rows]
+    raise ValueError("Arrow: ожидается список записей или словарь списков записей")
+
+
+def encode_arrow(result: Any) -> bytes:
+    table = pa.Table.from_pylist(_plain(arrow_rows(result)))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+ENCODERS = {"msgpack": encode_msgpack, "arrow": encode_arrow}
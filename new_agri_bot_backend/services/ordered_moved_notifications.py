@@ -228,16 +228,13 @@ async def notifications(bot: Bot, frame: pd.DataFrame):
                     logger.info(
                         f"\n--- Відправка зведеного звіту адміністраторам ({', '.join(map(str, ADMINS_ID))}) ---"
                     )
-                    sent_msgs = await send_notification(
+                    await send_notification(
                         bot=bot,
                         chat_ids=ADMINS_ID,  # Передаем список ID напрямую
                         text=chunk,
+                        delete_after=30,  # Запланувати видалення через 30 хвилин
                     )
-                    # Запланувати видалення через 30 хвилин
-                    from ..utils import schedule_message_deletion
-                    for msg in sent_msgs:
-                        await schedule_message_deletion(chat_id=msg.chat.id, message_id=msg.message_id, delay_minutes=30)
-                    logger.info("✅ Частину зведеного звіту успішно відправлено.")
+                    logger.info("✅ Частину зведеного звіту поставлено в чергу відправки.")
                 else:
                     logger.info(
                         f"\n--- [DEV] Зведений звіт для адміністраторів ({', '.join(map(str, admin_chat_ids))}) ---"
@@ -1,33 +1,54 @@
 import logging
-from typing import List
+from functools import partial
+from typing import List, Optional
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramAPIError
 
+from ..telegram_queue import send_queue
+
 # Настраиваем логирование для отслеживания процесса отправки
 logger = logging.getLogger(__name__)
 
 
 async def send_notification(
-    bot: Bot, chat_ids: List[int], text: str, parse_mode: str = "Markdown", reply_markup = None
+    bot: Bot,
+    chat_ids: List[int],
+    text: str,
+    parse_mode: str = "Markdown",
+    reply_markup = None,
+    delete_after: Optional[int] = None,
 ):
     """
-    Асинхронно отправляет текстовое сообщение списку пользователей.
-    Повертає список відправлених об'єктів Message.
+    Ставит текстовое сообщение в очередь отправки для списка пользователей и сразу возвращается.
+    Если задан delete_after, отправленные сообщения удаляются через delete_after минут.
     """
     if not text:
         logger.warning("Попытка отправить пустое сообщение. Отправка отменена.")
-        return []
+        return
 
-    sent_messages = []
+    # Отправляем через общую очередь: чаты обслуживаются параллельно в пределах лимитов Telegram
     for chat_id in chat_ids:
-        try:
-            msg = await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup)
-            sent_messages.append(msg)
-            logger.info(f"Сообщение успешно отправлено в чат {chat_id}")
-        except TelegramAPIError as e:
-            logger.error(f"Ошибка API Telegram при отправке в чат {chat_id}: {e}")
-        except Exception as e:
-            logger.error(f"Непредвиденная ошибка при отправке в чат {chat_id}: {e}")
-    
-    return sent_messages
+        send_queue.send_message(
+            bot,
+            chat_id,
+            text,
+            parse_mode=parse_mode,
+            reply_markup=reply_markup,
+            on_sent=partial(_on_notification_sent, chat_id, delete_after),
+            on_error=partial(_on_notification_error, chat_id),
+        )
+
+
+async def _on_notification_sent(chat_id: int, delete_after: Optional[int], msg):
+    logger.info(f"Сообщение успешно отправлено в чат {chat_id}")
+    if delete_after:
+        from ..utils import schedule_message_deletion
+        await schedule_message_deletion(chat_id=chat_id, message_id=msg.message_id, delay_minutes=delete_after)
+
+
+async def _on_notification_error(chat_id: int, error: Exception):
+    if isinstance(error, TelegramAPIError):
+        logger.error(f"Ошибка API Telegram при отправке в чат {chat_id}: {error}")
+    else:
+        logger.error(f"Непредвиденная ошибка при отправке в чат {chat_id}: {error}")
@@ -0,0 +1,293 @@
+# app/session_store.py
+"""
+Хранилище сессий ручного сопоставления (/upload_ordered_moved -> manual_match -> results).
+
+Сессия — это словарь {"leftovers": ..., "matched_list": ...}, где в leftovers лежат
+DataFrame'ы current_moved/current_notes. Бэкенд выбирается переменной SESSION_STORE:
+- "memory"   — LRU + TTL в памяти процесса (только для одного воркера);
+- "postgres" — таблица upload_sessions, общая для всех воркеров и переживающая рестарт;
+  снимок — DataFrame'ы в Arrow IPC и JSON-манифест (нужен pyarrow), без pickle.
+"""
+import asyncio
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncContextManager, AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .cache import InMemoryCache
+from .config import logger, SESSION_STORE, SESSION_TTL, SESSION_MAX_COUNT
+from .response_formats import dumps_json, loads_json
+from .tables import UploadSessions
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Формат снимка: сигнатура, длина JSON-манифеста, манифест, затем таблицы Arrow IPC
+SESSION_FORMAT = b"AGS1"
+SESSION_HEADER = struct.Struct(">4sI")
+FRAME_MARKER = "__arrow_frame__"
+# Служебные колонки общей таблицы: номер DataFrame и его индекс
+FRAME_ID_COLUMN = "__frame__"
+FRAME_INDEX_COLUMN = "__index__"
+
+
+def _arrow_column(values: np.ndarray) -> "pa.Array":
+    """
+    Колонка Arrow из значений numpy. Object-колонки со значениями разных типов (число и
+    строка из одной колонки Excel) Arrow не типизирует — такие значения сохраняются
+    строками, пропуски остаются пропусками.
+    """
+    try:
+        return pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(
+            [None if pd.isna(value) else str(value) for value in values], type=pa.string()
+        )
+
+
+def _frames_to_arrow(frames: List[pd.DataFrame]) -> Tuple[List[Dict[str, Any]], List[bytes]]:
+    """
+    DataFrame'ы с одинаковыми колонками складываются в одну таблицу Arrow с номером
+    DataFrame и его индексом в служебных колонках: в сессии тысячи маленьких фреймов,
+    и отдельная таблица (или любая операция pandas) на каждый стоила бы секунды.
+    Типы колонок и имя индекса каждого фрейма пишутся в манифест и восстанавливаются при чтении.
+    """
+    groups: Dict[Tuple[str, ...], List[int]] = {}
+    for number, frame in enumerate(frames):
+        groups.setdefault(tuple(frame.columns), []).append(number)
+
+    meta: List[Dict[str, Any]] = [{} for _ in frames]
+    tables = []
+    for group, (columns, numbers) in enumerate(groups.items()):
+        ids, index, values = [], [], [[] for _ in columns]
+        for number in numbers:
+            frame = frames[number]
+            series = [item for _, item in frame.items()]
+            meta[number] = {
+                "group": group,
+                "index": frame.index.name,
+                "dtypes": [str(item.dtype) for item in series],
+            }
+            ids.append(np.full(len(frame), number, dtype=np.int64))
+            index.append(frame.index.to_numpy())
+            for position, item in enumerate(series):
+                values[position].append(item.to_numpy())
+
+        arrays = [pa.array(np.concatenate(ids)), _arrow_column(np.concatenate(index))]
+        arrays += [_arrow_column(np.concatenate(parts)) for parts in values]
+        table = pa.Table.from_arrays(arrays, names=[FRAME_ID_COLUMN, FRAME_INDEX_COLUMN, *map(str, columns)])
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        tables.append(sink.getvalue().to_pybytes())
+    return meta, tables
+
+
+def _frames_from_arrow(meta: List[Dict[str, Any]], tables: List["pa.Table"]) -> List[pd.DataFrame]:
+    groups = []
+    ranges = {}
+    for table in tables:
+        columns = [table.column(i).to_pandas().to_numpy() for i in range(table.num_columns)]
+        # Фреймы лежат в таблице подряд, по возрастанию номера
+        numbers, starts = np.unique(columns[0], return_index=True)
+        stops = np.append(starts[1:], len(columns[0]))
+        ranges.update(zip(numbers.tolist(), zip(starts.tolist(), stops.tolist())))
+        groups.append((table.column_names[2:], columns[1], columns[2:]))
+
+    frames = []
+    for number, info in enumerate(meta):
+        names, index, values = groups[info["group"]]
+        start, stop = ranges.get(number, (0, 0))
+        frame = pd.DataFrame(
+            {
+                name: _restore_values(column[start:stop], dtype)
+                for name, column, dtype in zip(names, values, info["dtypes"])
+            },
+            index=pd.Index(index[start:stop], name=info["index"]),
+        )
+        frames.append(frame)
+    return frames
+
+
+def _restore_values(values: np.ndarray, dtype: str) -> np.ndarray:
+    """Исходный тип колонки фрейма: в общей таблице int мог стать float, а None — NaN."""
+    if str(values.dtype) == dtype:
+        return values
+    if dtype == "object":
+        values = values.astype(object)
+        values[pd.isna(values)] = None
+        return values
+    return values.astype(dtype)
+
+
+def serialize_session(data: Dict[str, Any]) -> bytes:
+    """
+    Сжатый снимок сессии без pickle: DataFrame'ы (с индексом и типами колонок) пишутся
+    в Arrow IPC, остальное — в JSON-манифест, где на месте DataFrame его номер.
+    Даты в matched_list сохраняются строками ISO — в ответ API они так же и уходят.
+    """
+    frames: List[pd.DataFrame] = []
+
+    def extract(value):
+        if isinstance(value, pd.DataFrame):
+            frames.append(value)
+            return {FRAME_MARKER: len(frames) - 1}
+        if isinstance(value, dict):
+            return {key: extract(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [extract(item) for item in value]
+        return value
+
+    document = extract(data)
+    meta, tables = _frames_to_arrow(frames)
+    manifest = dumps_json({"data": document, "frames": meta, "tables": [len(table) for table in tables]})
+    payload = SESSION_HEADER.pack(SESSION_FORMAT, len(manifest)) + manifest + b"".join(tables)
+    return zlib.compress(payload, 1)
+
+
+def deserialize_session(payload: bytes) -> Dict[str, Any]:
+    """Разбирает снимок serialize_session; только JSON и Arrow — код из БД не выполняется."""
+    raw = zlib.decompress(payload)
+    signature, manifest_size = SESSION_HEADER.unpack_from(raw)
+    if signature != SESSION_FORMAT:
+        raise ValueError("Неизвестный формат снимка сессии")
+    offset = SESSION_HEADER.size
+    manifest = loads_json(raw[offset:offset + manifest_size])
+    offset += manifest_size
+    tables = []
+    for size in manifest["tables"]:
+        tables.append(pa.ipc.open_stream(pa.py_buffer(raw[offset:offset + size])).read_all())
+        offset += size
+    frames = _frames_from_arrow(manifest["frames"], tables)
+
+    def restore(value):
+        if isinstance(value, dict):
+            if FRAME_MARKER in value:
+                return frames[value[FRAME_MARKER]]
+            return {key: restore(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [restore(item) for item in value]
+        return value
+
+    return restore(manifest["data"])
+
+
+class SessionStore(ABC):
+    """Общий интерфейс хранилища сессий."""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def lock(self, session_id: str) -> AsyncContextManager[None]:
+        """
+        Исключительный доступ к сессии на время чтения-изменения-записи
+        (async with store.lock(id): get -> изменения -> set).
+        """
+
+
+class InMemorySessionStore(SessionStore):
+    """Сессии в памяти процесса: не более max_size штук, каждая живет ttl секунд с последней записи."""
+
+    def __init__(self, max_size: int, ttl: int):
+        self._cache = InMemoryCache(max_size=max_size, default_ttl=ttl)
+        # session_id -> (блокировка, число держателей и ожидающих)
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        lock, users = self._locks.get(session_id) or (asyncio.Lock(), 0)
+        self._locks[session_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[session_id]
+            if users <= 1:
+                del self._locks[session_id]
+            else:
+                self._locks[session_id] = (lock, users - 1)
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._cache.get(session_id)
+
+    async def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        self._cache.set(session_id, data)
+
+
+class PostgresSessionStore(SessionStore):
+    """Сессии в таблице upload_sessions. Просроченные строки удаляются при каждой записи."""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        # Блокировка строки (SELECT ... FOR UPDATE) держится до конца транзакции;
+        # get/set внутри блока выполняются в этой же транзакции
+        async with UploadSessions._meta.db.transaction():
+            await UploadSessions.select(UploadSessions.id).where(
+                UploadSessions.id == session_id
+            ).lock_rows().run()
+            yield
+
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = (
+            await UploadSessions.select(UploadSessions.payload)
+            .where(
+                (UploadSessions.id == session_id)
+                & (UploadSessions.expires_at > datetime.now(timezone.utc))
+            )
+            .first()
+            .run()
+        )
+        if row is None:
+            return None
+        try:
+            return deserialize_session(row["payload"])
+        except Exception as e:
+            # Снимок прежнего формата или поврежденный: сессию придется начать заново
+            logger.warning(f"Не удалось прочитать сессию {session_id}: {e}")
+            return None
+
+    async def set(self, session_id: str, data: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        await UploadSessions.delete().where(UploadSessions.expires_at <= now).run()
+        await UploadSessions.raw(
+            """
+            INSERT INTO upload_sessions (id, payload, expires_at)
+            VALUES ({}, {}, {})
+            ON CONFLICT (id) DO UPDATE
+            SET payload = EXCLUDED.payload, expires_at = EXCLUDED.expires_at
+            """,
+            session_id,
+            serialize_session(data),
+            now + timedelta(seconds=self.ttl),
+        ).run()
+
+
+def create_session_store() -> SessionStore:
+    if SESSION_STORE == "postgres":
+        if pa is not None:
+            logger.info("🗄️ Сессии сопоставления хранятся в Postgres (upload_sessions).")
+            return PostgresSessionStore(ttl=SESSION_TTL)
+        logger.warning("SESSION_STORE=postgres требует pyarrow (не установлен), используется 'memory'.")
+    elif SESSION_STORE != "memory":
+        logger.warning(f"Неизвестный SESSION_STORE={SESSION_STORE!r}, используется 'memory'.")
+    return InMemorySessionStore(max_size=SESSION_MAX_COUNT, ttl=SESSION_TTL)
+
+
+# Глобальный инстанс хранилища
+session_store = create_session_store()
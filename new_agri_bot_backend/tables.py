@@ -19,6 +19,7 @@ from piccolo.columns import (
     Text,
     Real,
     JSONB,
+    Bytea,
     OnDelete,
 )
 
@@ -197,6 +198,8 @@ class ProductsForOrders(Table):
         managed = False
 
 
+# Материализованное представление: пересчитывается в конце загрузки Excel
+# (data_loader.refresh_materialized_views)
 class DetailsForOrders(Table):
     nomenclature = Varchar(null=True)
     party_sign = Varchar(null=True)
@@ -232,6 +235,20 @@ class ValidFreeStock(Table):
         managed = False
 
 
+# Материализованное представление: остаток и заявки по каждому товару, пересчитывается
+# в конце загрузки Excel (data_loader.refresh_materialized_views)
+class ProductStockTotals(Table):
+    product = UUID(primary_key=True)
+    total_buh = DoublePrecision()
+    orders_q = DoublePrecision()
+    total_orders = DoublePrecision()
+    is_free = Boolean()
+
+    class Meta:
+        tablename = "product_stock_totals"
+        managed = False
+
+
 
 class Events(Table):
     id = UUID(primary_key=True)
@@ -394,3 +411,26 @@ class ValidWarehouseAdmin(Table):
     @classmethod
     def get_readable(cls):
         return Readable(template="%s", columns=[cls.name])
+
+
+class UploadSessions(Table):
+    """Сессии ручного сопоставления Заказано/Перемещено (сжатый снимок leftovers и matched_list)"""
+    id = Varchar(length=36, primary_key=True)
+    payload = Bytea()
+    expires_at = Timestamptz(index=True)
+
+
+class BiSnapshots(Table):
+    """Готовые ответы BI-эндпоинтов (JSON), пересчитываются при загрузке данных"""
+    name = Varchar(length=100, primary_key=True)
+    payload = Bytea()
+    created_at = Timestamptz()
+
+
+class LoginTokens(Table):
+    """Токены входа через Telegram-бота (deep link) для LOGIN_TOKEN_STORE=postgres"""
+    token = Varchar(length=16, primary_key=True)
+    status = Varchar(length=16, default="pending")
+    init_data = Text(null=True)
+    user_id = BigInt(null=True)
+    expires_at = Timestamptz(index=True)
@@ -3,15 +3,21 @@ import hmac, hashlib, json, uuid
 from urllib.parse import parse_qsl
 from datetime import datetime, timezone, timedelta
 
-from fastapi import HTTPException, status, APIRouter, Header, Depends, Body
+from fastapi import HTTPException, status, APIRouter, Header, Depends, Body, Query
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import os
 
 from .tables import Users  # Импорт вашей модели Users
+from .cache import InMemoryCache
+from .login_token_store import login_token_store, LOGIN_TOKEN_TTL, LOGIN_TOKEN_WAIT_MAX
 from .config import (
     TELEGRAM_BOT_TOKEN,
     TELEGRAM_WIDGET_BOT_TOKEN,
+    INIT_DATA_CACHE_SIZE,
+    INIT_DATA_TTL,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
     logger
 )  # TELEGRAM_WIDGET_BOT_TOKEN — токен бота без Mini App для Login Widget
 
@@ -24,6 +30,55 @@ load_dotenv()
 router = APIRouter(tags=["Аутентифікація"])
 
 
+def webapp_secret_key(bot_token: str) -> bytes:
+    """Ключ подписи initData Mini App: HMAC-SHA256("WebAppData", bot_token)."""
+    return hmac.new(
+        key=b"WebAppData",
+        msg=bot_token.encode("utf-8"),
+        digestmod=hashlib.sha256,
+    ).digest()
+
+
+# Ключи считаются один раз при старте, а не на каждый запрос
+WEBAPP_SECRET_KEY = webapp_secret_key(TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
+WIDGET_WEBAPP_SECRET_KEY = (
+    webapp_secret_key(TELEGRAM_WIDGET_BOT_TOKEN)
+    if TELEGRAM_WIDGET_BOT_TOKEN and TELEGRAM_WIDGET_BOT_TOKEN != TELEGRAM_BOT_TOKEN
+    else None
+)
+
+# Успешно проверенные initData: sha256 строки -> разобранные поля.
+# Запись живет до auth_date + INIT_DATA_TTL; неудачные проверки не запоминаются.
+verified_init_data = InMemoryCache(max_size=INIT_DATA_CACHE_SIZE, default_ttl=INIT_DATA_TTL)
+
+# Строки users по telegram_id для get_current_telegram_user. Права (is_allowed, is_guest,
+# is_admin, full_name_for_orders) меняются прямо в БД, поэтому запись живет USER_CACHE_TTL
+# секунд. Кэш свой у каждого воркера, а invalidate_user() сбрасывает его только в текущем:
+# в остальных отозванный доступ действует еще до USER_CACHE_TTL секунд.
+user_cache = InMemoryCache(max_size=USER_CACHE_SIZE, default_ttl=USER_CACHE_TTL)
+
+
+async def get_user(telegram_id: int):
+    """Строка Users по telegram_id (из кэша, если есть); None — пользователь не найден."""
+    key = str(telegram_id)
+    # USER_CACHE_TTL=0 — без кэша: права проверяются по БД на каждый запрос
+    user_in_db = user_cache.get(key) if USER_CACHE_TTL > 0 else None
+    if user_in_db is None:
+        user_in_db = (
+            await Users.objects().where(Users.telegram_id == telegram_id).first().run()
+        )
+        if user_in_db is not None and USER_CACHE_TTL > 0:
+            user_cache.set(key, user_in_db)
+    return user_in_db
+
+
+def invalidate_user(telegram_id: int | None = None) -> int:
+    """Сбрасывает кэш одного пользователя (или всех, если telegram_id не указан)."""
+    if telegram_id is not None:
+        return int(user_cache.delete(str(telegram_id)))
+    return user_cache.clear()
+
+
 class InitDataModel(BaseModel):
     initData: str
 
@@ -104,6 +159,14 @@ def check_telegram_auth(init_data: str) -> dict:
             "TELEGRAM_BOT_TOKEN не установлен. Проверьте config.py или переменные окружения."
         )
 
+    cache_key = None
+    if not dev_mode:
+        # Mini App шлет одну и ту же строку весь сеанс — повторно не разбираем и не считаем HMAC
+        cache_key = hashlib.sha256(init_data.encode("utf-8")).hexdigest()
+        cached = verified_init_data.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+
     parsed = dict(parse_qsl(init_data))
     hash_ = parsed.pop("hash", None)
 
@@ -130,14 +193,8 @@ def check_telegram_auth(init_data: str) -> dict:
     data_check_string = "\n".join(data_check_string_parts)
 
     # Попытка №1: проверка с использованием основного TELEGRAM_BOT_TOKEN
-    secret_key_main = hmac.new(
-        key=b"WebAppData",
-        msg=TELEGRAM_BOT_TOKEN.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).digest()
-
     calculated_hash_main = hmac.new(
-        key=secret_key_main,
+        key=WEBAPP_SECRET_KEY,
         msg=data_check_string.encode("utf-8"),
         digestmod=hashlib.sha256,
     ).hexdigest()
@@ -145,15 +202,9 @@ def check_telegram_auth(init_data: str) -> dict:
     is_valid = (calculated_hash_main == hash_)
 
     # Попытка №2: проверка с использованием TELEGRAM_WIDGET_BOT_TOKEN (если они отличаются)
-    if not is_valid and TELEGRAM_WIDGET_BOT_TOKEN and TELEGRAM_WIDGET_BOT_TOKEN != TELEGRAM_BOT_TOKEN:
-        secret_key_widget = hmac.new(
-            key=b"WebAppData",
-            msg=TELEGRAM_WIDGET_BOT_TOKEN.encode("utf-8"),
-            digestmod=hashlib.sha256,
-        ).digest()
-
+    if not is_valid and WIDGET_WEBAPP_SECRET_KEY:
         calculated_hash_widget = hmac.new(
-            key=secret_key_widget,
+            key=WIDGET_WEBAPP_SECRET_KEY,
             msg=data_check_string.encode("utf-8"),
             digestmod=hashlib.sha256,
         ).hexdigest()
@@ -178,10 +229,22 @@ def check_telegram_auth(init_data: str) -> dict:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный хэш данных инициализации Telegram. Хэши не совпадают.",
         )
-        
+
+    remember_verified_init_data(cache_key, parsed)
     return parsed
 
 
+def remember_verified_init_data(cache_key: str, parsed: dict) -> None:
+    """Запоминает проверенную initData до auth_date + INIT_DATA_TTL (уже устаревшую — не запоминает)."""
+    try:
+        auth_date = int(parsed.get("auth_date", 0))
+    except ValueError:
+        return
+    ttl = int(auth_date + INIT_DATA_TTL - datetime.now(timezone.utc).timestamp())
+    if ttl > 0:
+        verified_init_data.set(cache_key, dict(parsed), ttl=ttl)
+
+
 @router.post("/auth", summary="Аутентификация пользователя Telegram Mini App")
 async def auth(data: InitDataModel):
     """
@@ -300,6 +363,7 @@ async def auth(data: InitDataModel):
     user_in_db.last_name = user_data.get("last_name")
     user_in_db.last_activity_date = current_utc_time
     await user_in_db.save().run()
+    invalidate_user(telegram_id)
     message = "Данные пользователя успешно обновлены."
     logger.info(
         f"[{current_utc_time}] Данные пользователя {user_in_db.username or user_in_db.telegram_id} (ID: {user_in_db.telegram_id}) обновлены."
@@ -377,9 +441,7 @@ async def get_current_telegram_user(
         )
 
     # Перевіряємо, чи користувач існує в нашій базі даних і чи має він доступ
-    user_in_db = (
-        await Users.objects().where(Users.telegram_id == telegram_id).first().run()
-    )
+    user_in_db = await get_user(telegram_id)
 
     if not user_in_db or not user_in_db.is_allowed:
         raise HTTPException(
@@ -387,7 +449,8 @@ async def get_current_telegram_user(
             detail="Доступ заборонено. Користувач не зареєстрований або не має дозволу.",
         )
 
-    return user_in_db  # Повертаємо об'єкт користувача з БД
+    # Повертаємо об'єкт користувача з БД: обробники беруть дані з нього, а не перечитують users
+    return user_in_db
 
 
 async def check_not_guest(
@@ -405,6 +468,20 @@ async def check_not_guest(
     return current_user
 
 
+async def check_admin(
+    current_user=Depends(get_current_telegram_user),
+):
+    """
+    Залежність для службових ендпоінтів, доступних лише адміністраторам (is_admin=True).
+    """
+    if not getattr(current_user, "is_admin", False):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ заборонено. Потрібні права адміністратора.",
+        )
+    return current_user
+
+
 @router.post("/auth/login-widget", summary="Авторизація через Telegram Login Widget")
 async def login_via_widget(data: TelegramWidgetData):
     """
@@ -441,6 +518,7 @@ async def login_via_widget(data: TelegramWidgetData):
     user_in_db.last_name = data.last_name
     user_in_db.last_activity_date = current_utc_time
     await user_in_db.save().run()
+    invalidate_user(data.id)
 
     # 4. Формуємо init_data рядок у форматі Mini App
     #    (сумісний з існуючим check_telegram_auth та X-Telegram-Init-Data заголовком)
@@ -467,14 +545,8 @@ async def login_via_widget(data: TelegramWidgetData):
     )
 
     # Рахуємо хеш за Mini App алгоритмом (щоб /get_user міг верифікувати)
-    secret_key = hmac.new(
-        key=b"WebAppData",
-        msg=TELEGRAM_BOT_TOKEN.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).digest()
-
     new_hash = hmac.new(
-        key=secret_key,
+        key=WEBAPP_SECRET_KEY,
         msg=data_check_string.encode("utf-8"),
         digestmod=hashlib.sha256,
     ).hexdigest()
@@ -496,9 +568,8 @@ async def login_via_widget(data: TelegramWidgetData):
 # Bot Deep Link Auth
 # ---------------------------------------------------------------------------
 
-# In-memory хранилище токенов (dict: token → info)
-# Токены живут 5 минут, затем очищаются при проверке.
-login_tokens: dict[str, dict] = {}
+# Токены хранятся в login_token_store (память процесса или таблица login_tokens, см. LOGIN_TOKEN_STORE).
+# Токены живут LOGIN_TOKEN_TTL секунд (5 минут).
 
 TELEGRAM_BOT_NAME = os.getenv("NEXT_PUBLIC_TELEGRAM_BOT_NAME", "EridonKharkiv_bot")
 
@@ -524,13 +595,8 @@ def _build_init_data_for_user(user_in_db) -> str:
     data_check_string = "\n".join(
         f"{k}={v}" for k, v in sorted(params.items())
     )
-    secret_key = hmac.new(
-        key=b"WebAppData",
-        msg=TELEGRAM_BOT_TOKEN.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).digest()
     new_hash = hmac.new(
-        key=secret_key,
+        key=WEBAPP_SECRET_KEY,
         msg=data_check_string.encode("utf-8"),
         digestmod=hashlib.sha256,
     ).hexdigest()
@@ -548,11 +614,11 @@ async def confirm_login_token(token: str, telegram_id: int) -> bool:
     Проверяет токен, находит пользователя в БД, генерирует init_data.
     Возвращает True если успешно, False если токен невалиден.
     """
-    entry = login_tokens.get(token)
+    entry = await login_token_store.get(token)
     if not entry or entry["status"] != "pending":
         return False
     if datetime.now(timezone.utc) > entry["expires"]:
-        login_tokens.pop(token, None)
+        await login_token_store.delete(token)
         return False
 
     user_in_db = await Users.objects().where(
@@ -560,16 +626,17 @@ async def confirm_login_token(token: str, telegram_id: int) -> bool:
     ).first().run()
 
     if not user_in_db or not user_in_db.is_allowed:
-        login_tokens[token]["status"] = "forbidden"
+        await login_token_store.update(token, status="forbidden")
         return False
 
     # Генерируем init_data
     init_data = _build_init_data_for_user(user_in_db)
-    login_tokens[token].update({
-        "status": "confirmed",
-        "init_data": init_data,
-        "user_id": telegram_id,
-    })
+    await login_token_store.update(
+        token,
+        status="confirmed",
+        init_data=init_data,
+        user_id=telegram_id,
+    )
     return True
 
 
@@ -579,58 +646,60 @@ async def generate_login_token():
     Створює унікальний токен та повертає deep link для входу через Telegram-бота.
     TTL токена — 5 хвилин.
     """
-    # Очищаем просроченные токены
-    now = datetime.now(timezone.utc)
-    expired = [t for t, v in login_tokens.items() if v["expires"] < now]
-    for t in expired:
-        login_tokens.pop(t, None)
-
     import secrets
     import string
-    
+
     # Generate a unique 6-digit numeric code
+    # (просроченные токены удаляет само хранилище, без обхода всех токенов)
     while True:
         token = "".join(secrets.choice(string.digits) for _ in range(6))
-        if token not in login_tokens:
+        if await login_token_store.create(token, LOGIN_TOKEN_TTL):
             break
-            
-    login_tokens[token] = {
-        "status": "pending",
-        "expires": now + timedelta(minutes=5),
-        "init_data": None,
-        "user_id": None,
-    }
 
     bot_name = os.getenv("NEXT_PUBLIC_TELEGRAM_BOT_NAME", "EridonKharkiv_bot")
     tg_link = f"tg://resolve?domain={bot_name}"
     web_link = f"https://t.me/{bot_name}"
 
-    return {"token": token, "deep_link": tg_link, "web_link": web_link, "expires_in": 300}
+    return {"token": token, "deep_link": tg_link, "web_link": web_link, "expires_in": LOGIN_TOKEN_TTL}
 
 
 @router.get("/auth/check-login-token/{token}", summary="Перевірка статусу Deep Link-токену")
-async def check_login_token(token: str):
+async def check_login_token(
+    token: str,
+    wait: int = Query(
+        0, ge=0, le=LOGIN_TOKEN_WAIT_MAX,
+        description="Скільки секунд чекати підтвердження, поки токен у статусі pending (long-poll)",
+    ),
+):
     """
     Проверяет статус токена авторизации. Фронтенд поллингует этот эндпоинт каждые 2 секунды.
+    С wait > 0 ответ pending задерживается до подтверждения (ответ уходит сразу после него)
+    или до истечения wait секунд — тогда достаточно повторять запрос после каждого ответа.
     - status=pending: пользователь ещё не подтвердил
     - status=confirmed: возвращает init_data
     - status=expired / not_found: токен недействителен
     """
-    entry = login_tokens.get(token)
+    entry = await login_token_store.get(token)
+    if entry and entry["status"] == "pending" and wait:
+        remaining = (entry["expires"] - datetime.now(timezone.utc)).total_seconds()
+        if remaining > 0:
+            await login_token_store.wait(token, min(wait, remaining))
+            entry = await login_token_store.get(token)
+
     if not entry:
         return {"status": "not_found"}
 
     if datetime.now(timezone.utc) > entry["expires"]:
-        login_tokens.pop(token, None)
+        await login_token_store.delete(token)
         return {"status": "expired"}
 
     if entry["status"] == "confirmed":
         init_data = entry["init_data"]
-        login_tokens.pop(token, None)  # Одноразовое использование
+        await login_token_store.delete(token)  # Одноразовое использование
         return {"status": "confirmed", "init_data": init_data}
 
     if entry["status"] == "forbidden":
-        login_tokens.pop(token, None)
+        await login_token_store.delete(token)
         return {"status": "forbidden"}
 
     return {"status": "pending"}
@@ -0,0 +1,222 @@
+# app/telegram_queue.py
+"""
+Общая очередь запросов к Telegram Bot API (send_message, delete_message, pin...).
+
+Вызывающий код ставит запрос в очередь (submit/send_message) и сразу продолжает
+работу, а очередь выполняет запросы в фоне с соблюдением лимитов Telegram:
+- запросы в один чат выполняются строго в порядке постановки и не чаще
+  TELEGRAM_CHAT_INTERVAL секунд (у каждого активного чата свой воркер);
+- разные чаты обслуживаются параллельно, но всего не больше TELEGRAM_GLOBAL_RATE
+  запросов в секунду и TELEGRAM_SEND_CONCURRENCY одновременно;
+- ответ 429 (TelegramRetryAfter) приостанавливает всю очередь на retry_after секунд
+  (flood control действует на бота целиком), после чего запрос повторяется;
+  сетевые и 5xx ошибки повторяются с экспоненциальной паузой.
+
+Вызывающий код не ждет доставки: результат обрабатывается в колбэках, которые
+выполняет воркер чата до следующего запроса в этот же чат. on_sent(result) получает
+результат запроса (например, Message) — из него можно поставить в очередь зависимый
+запрос (закрепить отправленное сообщение) или сохранить message_id в БД;
+on_error(exc) вызывается, если запрос так и не выполнился. Ошибки и без on_error
+логируются очередью. submit также возвращает Future, которая завершается после
+колбэков — ее ждут только фоновые задачи, которым нужен итог (не HTTP-обработчики).
+
+Лимиты общие для всех экземпляров Bot с одним токеном, поэтому очередь одна
+на процесс и принимает вызовы любого из них.
+"""
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from .config import (
+    logger,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_INTERVAL,
+    TELEGRAM_SEND_CONCURRENCY,
+    TELEGRAM_SEND_RETRIES,
+)
+
+TelegramCall = Callable[[], Awaitable[Any]]
+OnSent = Callable[[Any], Awaitable[None]]
+OnError = Callable[[Exception], Awaitable[None]]
+
+# Пауза перед повтором после сетевой ошибки растет как 1, 2, 4... но не больше
+TELEGRAM_BACKOFF_MAX = 30
+
+
+class TelegramSendQueue:
+    """Очередь запросов к Bot API с FIFO по каждому чату и общим ограничением скорости."""
+
+    def __init__(
+        self,
+        rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_interval: float = TELEGRAM_CHAT_INTERVAL,
+        concurrency: int = TELEGRAM_SEND_CONCURRENCY,
+        retries: int = TELEGRAM_SEND_RETRIES,
+    ):
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._chats: Dict[
+            int, Deque[Tuple[TelegramCall, asyncio.Future, Optional[OnSent], Optional[OnError]]]
+        ] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # Время (loop.time()) следующего свободного слота и конец паузы после 429
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._stats = {"sent": 0, "failed": 0, "retried": 0}
+
+    def submit(
+        self,
+        chat_id: int,
+        call: TelegramCall,
+        on_sent: Optional[OnSent] = None,
+        on_error: Optional[OnError] = None,
+    ) -> asyncio.Future:
+        """
+        Ставит запрос call() в очередь чата chat_id. call должен создавать новый
+        запрос при каждом вызове (он повторяется при 429 и сетевых ошибках).
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._chats.setdefault(chat_id, deque()).append((call, future, on_sent, on_error))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = loop.create_task(self._run_chat(chat_id))
+        return future
+
+    def send_message(
+        self,
+        bot: Bot,
+        chat_id: int,
+        text: str,
+        on_sent: Optional[OnSent] = None,
+        on_error: Optional[OnError] = None,
+        **kwargs,
+    ) -> asyncio.Future:
+        return self.submit(
+            chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs), on_sent, on_error
+        )
+
+    async def join(self, chat_ids: Optional[Iterable[int]] = None) -> None:
+        """
+        Ждет, пока выполнятся все запросы в очереди (или только в чатах chat_ids).
+        Нельзя вызывать из on_sent — воркер чата будет ждать сам себя.
+        """
+        chat_ids = set(chat_ids) if chat_ids is not None else None
+        while True:
+            workers = [
+                task for chat_id, task in self._workers.items()
+                if chat_ids is None or chat_id in chat_ids
+            ]
+            if not workers:
+                return
+            await asyncio.wait(workers)
+
+    async def close(self, timeout: float) -> None:
+        """Дожидается очереди при остановке приложения; что не успело — отменяется."""
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            dropped = self.pending()
+            for task in list(self._workers.values()):
+                task.cancel()
+            logger.warning(f"📭 Очередь Telegram не успела отправить {dropped} запросов до остановки.")
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self._chats.values())
+
+    def stats(self) -> Dict[str, int]:
+        return {**self._stats, "pending": self.pending(), "active_chats": len(self._workers)}
+
+    async def _acquire(self) -> None:
+        """Ждет общий слот: не чаще rate запросов в секунду и не раньше конца паузы после 429."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # За время ожидания слота мог прийти 429 — тогда ждем конца паузы заново
+            if self._paused_until <= loop.time():
+                return
+
+    async def _call(self, call: TelegramCall) -> Any:
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            await self._acquire()
+            try:
+                async with self._semaphore:
+                    return await call()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                self._stats["retried"] += 1
+                logger.warning(f"⏳ Telegram flood control: пауза очереди на {e.retry_after} с.")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                self._stats["retried"] += 1
+                delay = min(2 ** (attempt - 1), TELEGRAM_BACKOFF_MAX)
+                logger.warning(f"🔁 Помилка Telegram ({e}), повтор через {delay} с.")
+                await asyncio.sleep(delay)
+
+    async def _run_chat(self, chat_id: int) -> None:
+        """Воркер чата: выполняет его запросы по одному, пока очередь чата не опустеет."""
+        loop = asyncio.get_running_loop()
+        queue = self._chats[chat_id]
+        last_call = None
+        try:
+            while queue:
+                call, future, on_sent, on_error = queue.popleft()
+                if last_call is not None:
+                    delay = last_call + self.chat_interval - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                try:
+                    result = await self._call(call)
+                except Exception as e:
+                    self._stats["failed"] += 1
+                    logger.error(f"❌ Помилка запиту до Telegram для чату {chat_id}: {e}")
+                    await self._run_callback(chat_id, on_error, e)
+                    if not future.done():
+                        future.set_exception(e)
+                        # Ошибка уже в логе: не ругаемся на незабранное исключение
+                        future.exception()
+                    continue
+                finally:
+                    last_call = loop.time()
+
+                self._stats["sent"] += 1
+                await self._run_callback(chat_id, on_sent, result)
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # Непустая очередь здесь только у воркера, отмененного при остановке
+            for _, future, _, _ in queue:
+                future.cancel()
+            self._workers.pop(chat_id, None)
+            self._chats.pop(chat_id, None)
+
+    @staticmethod
+    async def _run_callback(chat_id: int, callback: Optional[Callable[[Any], Awaitable[None]]], arg: Any) -> None:
+        if callback is None:
+            return
+        try:
+            await callback(arg)
+        except Exception as e:
+            logger.error(f"❌ Помилка обробки результату запиту до Telegram для чату {chat_id}: {e}")
+
+
+# Глобальный инстанс очереди
+send_queue = TelegramSendQueue()
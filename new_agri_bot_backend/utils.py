@@ -1,11 +1,14 @@
 # app/utils.py
 from datetime import datetime, timedelta
+from functools import partial
 from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from dotenv import load_dotenv
 import os
 
 from .config import MANAGERS_ID, TELEGRAM_BOT_TOKEN, logger, SEND_NOTIFICATIONS  # Импорт из config.py
 from .tables import Users
+from .telegram_queue import send_queue
 
 load_dotenv()
 
@@ -32,33 +35,47 @@ async def send_message_to_managers():
 
         old_status_msg_id = user.get("status_message_id")
 
-        try:
-            if SEND_NOTIFICATIONS:
-                # 1. Спробуємо видалити старе закріплене повідомлення, щоб не засмічувати чат
-                if old_status_msg_id:
-                    try:
-                        await bot.delete_message(chat_id=telegram_id, message_id=old_status_msg_id)
-                    except Exception:
-                        pass
-                
-                # 2. Надсилаємо нове (воно прийде з повідомленням, що приверне увагу)
-                msg = await bot.send_message(chat_id=telegram_id, text=message_text)
-                
-                # 3. Закріплюємо його в шапці
-                try:
-                    await bot.pin_chat_message(chat_id=telegram_id, message_id=msg.message_id, disable_notification=True)
-                except Exception as pin_err:
-                    logger.warning(f"Could not pin message in {telegram_id}: {pin_err}")
-                
-                # 4. Оновлюємо ID в базі, щоб наступного разу його видалити
-                await Users.update({Users.status_message_id: msg.message_id}).where(Users.telegram_id == telegram_id).run()
-                
-                logger.info(f"Successfully updated status message for manager ID: {telegram_id}")
-            else:
-                # В режиме разработки просто выводим в консоль
-                logger.info(f"NOTIFICATIONS DISABLED: Would send to {telegram_id}: '{message_text}'")
-        except Exception as e:
-            logger.error(f"Failed to handle notification for manager ID {telegram_id}: {e}")
+        if SEND_NOTIFICATIONS:
+            # Запити в один чат виконуються чергою по порядку: видалення старого -> нове -> закріплення
+            # 1. Спробуємо видалити старе закріплене повідомлення, щоб не засмічувати чат
+            if old_status_msg_id:
+                send_queue.submit(
+                    telegram_id, partial(_delete_message_quietly, telegram_id, old_status_msg_id)
+                )
+
+            # 2. Надсилаємо нове (воно прийде з повідомленням, що приверне увагу)
+            send_queue.send_message(
+                bot, telegram_id, message_text, on_sent=partial(_pin_status_message, telegram_id)
+            )
+        else:
+            # В режиме разработки просто выводим в консоль
+            logger.info(f"NOTIFICATIONS DISABLED: Would send to {telegram_id}: '{message_text}'")
+
+
+async def _delete_message_quietly(chat_id: int, message_id: int):
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except (TelegramBadRequest, TelegramForbiddenError):
+        # Повідомлення вже видалене або застаре; 429 та мережеві помилки повторює черга
+        pass
+
+
+async def _pin_status_message(telegram_id: int, msg):
+    """Закріплює статусне повідомлення та запам'ятовує його ID (виконується чергою після відправки)."""
+    # 3. Закріплюємо його в шапці
+    send_queue.submit(telegram_id, partial(_pin_quietly, telegram_id, msg.message_id))
+
+    # 4. Оновлюємо ID в базі, щоб наступного разу його видалити
+    await Users.update({Users.status_message_id: msg.message_id}).where(Users.telegram_id == telegram_id).run()
+
+    logger.info(f"Successfully updated status message for manager ID: {telegram_id}")
+
+
+async def _pin_quietly(chat_id: int, message_id: int):
+    try:
+        await bot.pin_chat_message(chat_id=chat_id, message_id=message_id, disable_notification=True)
+    except (TelegramBadRequest, TelegramForbiddenError) as pin_err:
+        logger.warning(f"Could not pin message in {chat_id}: {pin_err}")
 
 
 def create_composite_key_from_dict(item: dict, keys: list) -> str:
@@ -0,0 +1,84 @@
+"""
+Бенчмарк загрузки Remains: Piccolo insert() пачками по 1000 строк против бинарного COPY.
+Пишет в отдельную таблицу remains_bench (копия структуры remains) и удаляет ее после замера.
+Запуск: python -m scratch.bench_bulk_load [кол-во строк]
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from piccolo.engine import engine_finder
+
+from new_agri_bot_backend.data_loader import (
+    copy_dataframe_to_table,
+    insert_dataframe_to_table,
+)
+from new_agri_bot_backend.tables import Remains
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+BENCH_TABLE = "remains_bench"
+
+
+class RemainsBench(Remains, tablename=BENCH_TABLE):
+    pass
+
+
+def make_remains_frame(rows: int) -> pd.DataFrame:
+    """Синтетический DataFrame в том виде, в каком data_loader передает его в Remains."""
+    rng = np.random.default_rng(42)
+    products = [uuid.uuid4() for _ in range(2000)]
+    return pd.DataFrame({
+        "id": [uuid.uuid4() for _ in range(rows)],
+        "line_of_business": rng.choice(["ЗЗР", "Насіння", "Міндобрива (основні)"], rows),
+        "warehouse": rng.choice([f"Склад {i}" for i in range(40)], rows),
+        "parent_element": rng.choice(["Гербіциди", "Фунгіциди", "Кукурудза"], rows),
+        "nomenclature": [f"Товар {i % 2000}" for i in range(rows)],
+        "party_sign": "",
+        "buying_season": "2026",
+        "nomenclature_series": [f"Партія {i}" for i in range(rows)],
+        "mtn": "",
+        "origin_country": "Україна",
+        "germination": "",
+        "crop_year": "2025",
+        "quantity_per_pallet": "",
+        "active_substance": "",
+        "certificate": "",
+        "certificate_start_date": "",
+        "certificate_end_date": "",
+        "buh": rng.random(rows) * 1000,
+        "skl": rng.random(rows) * 1000,
+        "weight": "1,2",
+        "storage": np.zeros(rows),
+        "product": rng.choice(products, rows),
+    })
+
+
+async def timed(label: str, rows: int, coro):
+    await Remains.raw(f'TRUNCATE "{BENCH_TABLE}"')
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {elapsed:8.2f} с  {rows / elapsed:12,.0f} строк/с")
+
+
+async def main(rows: int):
+    engine = engine_finder()
+    await engine.start_connection_pool()
+    try:
+        await Remains.raw(f'DROP TABLE IF EXISTS "{BENCH_TABLE}"')
+        await Remains.raw(f'CREATE UNLOGGED TABLE "{BENCH_TABLE}" (LIKE remains INCLUDING DEFAULTS)')
+        df = make_remains_frame(rows)
+        print(f"Remains, {rows:,} строк")
+        await timed("insert()", rows, insert_dataframe_to_table(RemainsBench, df))
+        await timed("COPY", rows, copy_dataframe_to_table(Remains, df, tablename=BENCH_TABLE))
+    finally:
+        await Remains.raw(f'DROP TABLE IF EXISTS "{BENCH_TABLE}"')
+        await engine.close_connection_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000))
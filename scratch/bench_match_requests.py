@@ -0,0 +1,199 @@
+"""
+Бенчмарк автоматического сопоставления заявок (processing.match_requests)
+против прежнего цикла с фильтрацией всего фрейма на каждую заявку.
+Данные синтетические: 50k строк «Заказано» и 50k строк «Перемещено» после merge.
+Запуск: python -m scratch.bench_match_requests [кол-во строк]
+"""
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from new_agri_bot_backend.processing import convert_numpy_types, match_requests
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+
+def make_test_data(rows: int) -> pd.DataFrame:
+    """Синтетический test_data в том виде, в каком его получает match_requests."""
+    rng = np.random.default_rng(7)
+    requests_count = rows // 4
+    request_ids = np.array([f"ЗВ-{i:08d}" for i in range(requests_count)])
+    request_idx = rng.integers(0, requests_count, rows)
+    qty = rng.integers(1, 50, rows) * 10
+
+    # Примечание: один договор; несколько договоров с количеством, с частью количеств
+    # или вовсе без них; пустое примечание
+    kinds = rng.integers(0, 5, requests_count)
+    notes = []
+    for i, kind in enumerate(kinds):
+        if kind == 0:
+            notes.append(f"ТЕ-{i:08d}")
+        elif kind == 1:
+            notes.append(f"ТЕ-{i:08d}-{(i % 5 + 1) * 10} ТЕ-{i + 1:08d}-{(i % 7 + 1) * 10}")
+        elif kind == 2:
+            notes.append(f"ТЕ-{i:08d}-{(i % 5 + 1) * 10} ТЕ-{i + 1:08d}")
+        elif kind == 3:
+            notes.append(f"ТЕ-{i:08d} ТЕ-{i + 1:08d}")
+        else:
+            notes.append("")
+    return pd.DataFrame({
+        "Заявка на відвантаження": request_ids[request_idx],
+        "Номенклатура": [f"Товар {i % 300}" for i in range(rows)],
+        "Ознака партії": "",
+        "Сезон закупівлі": "2026",
+        "Товар": [f"Товар {i % 300}  2026" for i in range(rows)],
+        "Заказано": qty.astype(float),
+        "Примечание_заказано": np.array(notes, dtype=object)[request_idx],
+        "Партія номенклатури": [f"П-{i}" for i in range(rows)],
+        "Перемещено": qty,
+        "Дата": pd.Timestamp("2026-03-01"),
+    })
+
+
+def legacy_match_requests(test_data: pd.DataFrame):
+    """Прежняя реализация: фильтр всего фрейма и iterrows на каждую заявку."""
+    matched_list = []
+    leftovers = {}
+    all_requests = test_data["Заявка на відвантаження"].dropna().unique()
+
+    for request_id in all_requests:
+        try:
+            request_df = test_data[
+                test_data["Заявка на відвантаження"] == request_id
+            ].copy()
+            if request_df.empty:
+                continue
+
+            total_ordered = request_df.groupby("Товар")["Заказано"].first().sum()
+            total_moved = request_df["Перемещено"].sum()
+            product = request_df["Товар"].iloc[0]
+            current_moved = request_df.copy()
+            current_notes = pd.DataFrame(columns=["Договор", "Количество_в_примечании"])
+            note_text = ""
+
+            if "Примечание_заказано" in current_moved.columns and not pd.isna(
+                current_moved["Примечание_заказано"].iloc[0]
+            ):
+                note_text = current_moved["Примечание_заказано"].iloc[0]
+                # Регулярка теперь поддерживает латиницу и кириллицу, а количество после тире стало необязательным
+                note_matches = re.findall(r"([a-zA-Z\u0410-\u042f]{2}-\d{8})(?:-(\d+))?", str(note_text))
+                if note_matches:
+                    notes_data = []
+                    for order_id, qty in note_matches:
+                        # Если количество в примечании не указано, временно ставим None
+                        notes_data.append([order_id, int(qty) if qty else None])
+                    
+                    current_notes = pd.DataFrame(
+                        notes_data, columns=["Договор", "Количество_в_примечании"]
+                    )
+
+            if not current_moved.empty and not current_notes.empty:
+                # --- НОВЫЙ СЦЕНАРИЙ (ВЫСШИЙ ПРИОРИТЕТ): Если в примечании только один договор ---
+                if len(current_notes) == 1:
+                    note_row_main = current_notes.iloc[0]
+                    for _, moved_row in current_moved.iterrows():
+                        record = moved_row.to_dict()
+                        record["Договор"] = note_row_main["Договор"]
+                        # Если в примечании не было количества, берем из строки перемещения
+                        qty_val = note_row_main["Количество_в_примечании"]
+                        record["Количество"] = qty_val if qty_val is not None else moved_row["Перемещено"]
+                        record["Источник"] = "Автоматически (один договор)"
+                        matched_list.append(record)
+                    # Так как все сопоставлено, очищаем и переходим к следующей заявке
+                    current_moved = pd.DataFrame(columns=current_moved.columns)
+                    current_notes = pd.DataFrame(columns=current_notes.columns)
+                    continue  # Переходим к следующему request_id
+
+                # --- Сценарий 1: Поиск однозначных совпадений по количеству ---
+                moved_counts = current_moved["Перемещено"].value_counts()
+                notes_counts = current_notes["Количество_в_примечании"].value_counts()
+                unique_qtys = moved_counts[(moved_counts == 1)].index.intersection(
+                    notes_counts[(notes_counts == 1)].index
+                )
+
+                if not unique_qtys.empty:
+                    unique_moved = current_moved[
+                        current_moved["Перемещено"].isin(unique_qtys)
+                    ]
+                    unique_notes = current_notes[
+                        current_notes["Количество_в_примечании"].isin(unique_qtys)
+                    ]
+                    matches_df = pd.merge(
+                        unique_moved,
+                        unique_notes,
+                        left_on="Перемещено",
+                        right_on="Количество_в_примечании",
+                    )
+
+                    for _, match_row in matches_df.iterrows():
+                        record = match_row.to_dict()
+                        record["Количество"] = record["Перемещено"]
+                        record["Источник"] = "Автоматически"
+                        record.pop("Количество_в_примечании", None)
+                        matched_list.append(record)
+
+                    current_moved = current_moved[
+                        ~current_moved["Перемещено"].isin(unique_qtys)
+                    ]
+                    current_notes = current_notes[
+                        ~current_notes["Количество_в_примечании"].isin(unique_qtys)
+                    ]
+
+            if not current_moved.empty and not current_notes.empty:
+                # --- Сценарий 2: Одно перемещение равно сумме примечаний ---
+                if len(current_moved) == 1:
+                    moved_qty = current_moved["Перемещено"].iloc[0]
+                    notes_sum = current_notes["Количество_в_примечании"].sum()
+                    if moved_qty == notes_sum:
+                        moved_row_main = current_moved.iloc[0]
+                        for _, note_row in current_notes.iterrows():
+                            record = moved_row_main.to_dict()
+                            record["Договор"] = note_row["Договор"]
+                            record["Количество"] = note_row["Количество_в_примечании"]
+                            record["Источник"] = "Автоматически"
+                            matched_list.append(record)
+                        current_moved = pd.DataFrame(columns=current_moved.columns)
+                        current_notes = pd.DataFrame(columns=current_notes.columns)
+
+            if not current_moved.empty and not current_notes.empty:
+                leftovers[request_id] = {
+                    "product": product,
+                    "note_text": note_text,
+                    "total_ordered": total_ordered,
+                    "total_moved": total_moved,
+                    "current_moved": [
+                        dict(row, index=idx) for idx, row in current_moved.iterrows()
+                    ],
+                    "current_notes": [
+                        dict(row, index=idx) for idx, row in current_notes.iterrows()
+                    ],
+                }
+        except Exception as e:
+            pass
+            continue
+
+    return leftovers, matched_list
+
+
+def timed(label: str, func, data: pd.DataFrame):
+    start = time.perf_counter()
+    leftovers, matched = func(data)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {elapsed:8.2f} с  matched={len(matched)} leftovers={len(leftovers)}")
+    return convert_numpy_types(leftovers), convert_numpy_types(matched)
+
+
+def main(rows: int):
+    data = make_test_data(rows)
+    print(f"test_data: {rows:,} строк, {data['Заявка на відвантаження'].nunique():,} заявок")
+    legacy = timed("по заявкам", legacy_match_requests, data)
+    grouped = timed("match_requests", match_requests, data)
+    assert repr(legacy) == repr(grouped), "Результаты отличаются"
+    print("✅ Результаты совпадают")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
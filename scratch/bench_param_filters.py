@@ -0,0 +1,80 @@
+"""
+Бенчмарк фильтра по складам в /data/product_on_warehouse: список складов, подставленный
+в текст SQL (IN ('...')), против одного параметра-массива (= ANY($1)).
+При подстановке каждая комбинация складов — новый текст запроса: asyncpg заново готовит
+statement, а Postgres заново его планирует. С параметром текст один, и подготовленный
+запрос берется из кэша соединения.
+Запуск: python -m scratch.bench_param_filters [кол-во запросов]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from piccolo.engine import engine_finder
+
+from new_agri_bot_backend.tables import Remains
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+INTERPOLATED = """
+    SELECT DISTINCT r.product
+    FROM remains r
+    WHERE r.warehouse IN ({placeholders}) AND r.buh > 0
+"""
+
+PARAMETERIZED = """
+    SELECT DISTINCT r.product
+    FROM remains r
+    WHERE r.warehouse = ANY({}) AND r.buh > 0
+"""
+
+
+def random_filters(warehouses: list, requests: int) -> list:
+    rng = random.Random(42)
+    return [
+        rng.sample(warehouses, rng.randint(1, min(5, len(warehouses))))
+        for _ in range(requests)
+    ]
+
+
+async def run_interpolated(wh_list: list):
+    placeholders = ", ".join("'" + w.replace("'", "''") + "'" for w in wh_list)
+    return await Remains.raw(INTERPOLATED.format(placeholders=placeholders))
+
+
+async def run_parameterized(wh_list: list):
+    return await Remains.raw(PARAMETERIZED, wh_list)
+
+
+async def timed(label: str, func, filters: list):
+    start = time.perf_counter()
+    for wh_list in filters:
+        await func(wh_list)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {elapsed:8.2f} с  {elapsed / len(filters) * 1000:8.2f} мс/запрос")
+
+
+async def main(requests: int):
+    engine = engine_finder()
+    # Один коннект в пуле, чтобы кэш подготовленных запросов asyncpg был общим для всех вызовов
+    await engine.start_connection_pool(min_size=1, max_size=1)
+    try:
+        rows = await Remains.raw("SELECT DISTINCT warehouse FROM remains WHERE warehouse <> ''")
+        warehouses = [row["warehouse"] for row in rows]
+        if not warehouses:
+            print("В remains нет складов — сначала загрузите данные.")
+            return
+        filters = random_filters(warehouses, requests)
+        print(f"{len(warehouses)} складов, {requests} запросов со случайным набором из 1-5 складов")
+
+        await timed("IN ('...')", run_interpolated, filters)
+        await timed("= ANY($1)", run_parameterized, filters)
+
+        print("Разница на запрос — подготовка и планирование, которые экономит кэш statement'ов.")
+    finally:
+        await engine.close_connection_pool()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
@@ -0,0 +1,90 @@
+"""
+Бенчмарк форматов ответа /api/v2/combined: JSON (jsonable_encoder + json, как FastAPI
+по умолчанию), JSON через orjson (как кэш эндпоинтов), msgpack и Arrow IPC.
+Данные синтетические, в структуре ответа combined_endpoint.
+Запуск: python -m scratch.bench_response_formats [кол-во товаров]
+"""
+import datetime
+import json
+import random
+import sys
+import time
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from new_agri_bot_backend.response_formats import available_formats, dumps_json, ENCODERS
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+DIVISIONS = ["Центральний офіс", "Київський підрозділ", "Полтавський підрозділ", "Лубенський підрозділ"]
+
+
+def make_combined(products: int) -> dict:
+    rng = random.Random(42)
+    sections = {"missing_but_available": [], "missing_and_unavailable": []}
+    for i in range(products):
+        available = [
+            {
+                "division": rng.choice(DIVISIONS),
+                "warehouse": f"Склад {rng.randint(1, 40)}",
+                "available": Decimal(rng.randint(1, 500)) / 4,
+            }
+            for _ in range(rng.randint(0, 6))
+        ]
+        orders = [
+            {
+                "manager": f"Менеджер {rng.randint(1, 30)}",
+                "client": f"ТОВ Клієнт {rng.randint(1, 2000)}",
+                "contract_supplement": f"ДОП-{rng.randint(10000, 99999)}",
+                "period": datetime.date(2026, rng.randint(1, 12), 1),
+                "document_status": "затверджено",
+                "product": f"Товар {i}",
+                "qty": Decimal(rng.randint(1, 300)),
+            }
+            for _ in range(rng.randint(1, 25))
+        ]
+        qty_needed = sum(o["qty"] for o in orders)
+        qty_remain = Decimal(rng.randint(0, int(qty_needed)))
+        item = {
+            "product": f"Товар {i}",
+            "line_of_business": rng.choice(["ЗЗР", "Насіння", "Міндобрива (основні)"]),
+            "qty_needed": qty_needed,
+            "qty_remain": qty_remain,
+            "qty_missing": qty_needed - qty_remain,
+            "available_stock": available,
+            "orders": orders,
+        }
+        sections["missing_but_available" if available else "missing_and_unavailable"].append(item)
+    return sections
+
+
+def encode_json(result) -> bytes:
+    return json.dumps(jsonable_encoder(result), ensure_ascii=False).encode("utf-8")
+
+
+def measure(label: str, encode, result, repeat: int = 5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encode(result)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<8} {min(timings) * 1000:9.1f} мс  {len(body) / 1024:10,.0f} КБ")
+
+
+def main(products: int):
+    result = make_combined(products)
+    orders = sum(len(item["orders"]) for rows in result.values() for item in rows)
+    print(f"{products} товаров, {orders} заявок")
+    print(f"{'формат':<8} {'кодирование':>12} {'размер':>13}")
+    measure("json", encode_json, result)
+    measure("orjson", dumps_json, result)
+    for fmt in ("msgpack", "arrow"):
+        if fmt in available_formats():
+            measure(fmt, ENCODERS[fmt], result)
+        else:
+            print(f"{fmt:<8} библиотека не установлена")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
@@ -0,0 +1,165 @@
+"""
+Проверка паритета движков чтения Excel: process_remains_reg и process_submissions
+должны давать одинаковые DataFrame под openpyxl и calamine, а _resolve_excel_engine —
+откатываться на openpyxl без python-calamine.
+Без аргументов проверяются сгенерированные книги в разметке отчетов 1С (строки, числа,
+даты, пустые ячейки); с аргументами — свои выгрузки.
+Запуск: python -m scratch.check_excel_engines [<остатки.xlsx> <заявки.xlsx>]
+"""
+import io
+import sys
+import time
+from datetime import date, datetime
+from unittest import mock
+
+import pandas as pd
+from openpyxl import Workbook
+
+from new_agri_bot_backend import data_processing
+from new_agri_bot_backend.config import valid_line_of_business
+from new_agri_bot_backend.data_processing import (
+    _resolve_excel_engine,
+    process_remains_reg,
+    process_submissions,
+    read_excel_content,
+)
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+
+def build_workbook(columns: int, skipped: list, head_rows: int, rows: list) -> bytes:
+    """
+    Книга в разметке отчета 1С: строка заголовков (пустые ячейки в колонках skipped
+    pandas назовет "Unnamed: N"), head_rows служебных строк шапки, данные и строка итогов.
+    """
+    wb = Workbook()
+    ws = wb.active
+    ws.append([None if i in skipped else f"Колонка {i}" for i in range(columns)])
+    for i in range(head_rows):
+        ws.append([f"Шапка {i}"] + [None] * (columns - 1))
+    for row in rows:
+        values = iter(row)
+        ws.append([None if i in skipped else next(values) for i in range(columns)])
+    ws.append(["Итого"] + [None] * (columns - 2) + [123.45])
+    for cells in ws.iter_rows():
+        for cell in cells:
+            if isinstance(cell.value, datetime):
+                cell.number_format = "DD.MM.YYYY HH:MM"
+            elif isinstance(cell.value, date):
+                cell.number_format = "DD.MM.YYYY"
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def remains_fixture() -> bytes:
+    # 20 колонок данных process_remains_reg, колонки 1, 2 и 4 отчета пустые
+    rows = []
+    for i in range(12):
+        rows.append([
+            valid_line_of_business[i % len(valid_line_of_business)],
+            f"Склад {i % 3}",
+            "Гербіциди",
+            f"Товар {i}",
+            None if i % 4 else "Партія А",
+            2025 if i % 2 else 2024.0,
+            f"S-{i}" if i % 3 else None,
+            None,
+            "Україна",
+            95 if i % 2 else None,
+            "2024",
+            40,
+            "Гліфосат 480 г/л",
+            f"UA-{i:03d}",
+            date(2024, 1, i + 1),
+            datetime(2026, 12, 31, 12, 30) if i % 2 else None,
+            10.5 * i,
+            -3 if i == 5 else i,
+            None if i % 5 == 0 else 1.25,
+            -2.555 * i,
+        ])
+    return build_workbook(23, [1, 2, 4], 5, rows)
+
+
+def submissions_fixture() -> bytes:
+    # 20 колонок данных process_submissions, колонки 1, 2, 6 и 7 отчета пустые
+    rows = []
+    for i in range(12):
+        rows.append([
+            f"Підрозділ {i % 2}",
+            f"Менеджер {i % 3}",
+            None if i % 3 else "Група",
+            f"Клієнт {i}",
+            f"Договір {i:04d}",
+            "Насіння",
+            "Виробник",
+            None,
+            f"Товар {i}",
+            "Закупівля поточного сезону" if i % 2 else "Партія Б",
+            2025,
+            "Насіння",
+            datetime(2025, 3, i + 1),
+            "Склад 1",
+            "Проведено",
+            None,
+            "Авто" if i % 2 else None,
+            100 + i,
+            None if i % 4 == 0 else 12.345 * i,
+            "н/д" if i == 7 else 1.5,
+        ])
+    return build_workbook(24, [1, 2, 6, 7], 8, rows)
+
+
+def parse_with(engine: str, func, content: bytes, *args):
+    data_processing.excel_engine = engine
+    start = time.perf_counter()
+    result = func(content, *args)
+    elapsed = time.perf_counter() - start
+    print(f"  {engine:<9} {elapsed:6.2f} с")
+    return result
+
+
+def check(name: str, func, content: bytes, *args):
+    print(f"{name}:")
+    expected = parse_with("openpyxl", func, content, *args)
+    actual = parse_with("calamine", func, content, *args)
+    if isinstance(expected, tuple):
+        expected, actual = expected[0], actual[0]
+    assert len(expected), "Парсер не вернул ни одной строки"
+    pd.testing.assert_frame_equal(expected, actual)
+    print(f"  ✅ Совпадает ({len(expected)} строк)")
+
+
+def check_engine_fallback():
+    print("_resolve_excel_engine:")
+    assert _resolve_excel_engine("openpyxl") == "openpyxl"
+    assert _resolve_excel_engine("calamine") == "calamine"
+    # None в sys.modules — import python_calamine падает с ImportError
+    with mock.patch.dict(sys.modules, {"python_calamine": None}):
+        assert _resolve_excel_engine("calamine") == "openpyxl"
+    print("  ✅ Без python-calamine используется openpyxl")
+
+
+def main(remains_content: bytes, submissions_content: bytes):
+    check_engine_fallback()
+    # Сырые DataFrame: типы колонок, даты и пустые ячейки до приведения к строкам
+    check("read_excel_content (остатки)", read_excel_content, remains_content)
+    check("read_excel_content (заявки)", read_excel_content, submissions_content)
+
+    # Список складов берем из самого файла, чтобы фильтр не отбрасывал строки
+    data_processing.excel_engine = "openpyxl"
+    _, all_warehouses = process_remains_reg(remains_content, [])
+
+    check("process_remains_reg", process_remains_reg, remains_content, all_warehouses)
+    check("process_submissions", process_submissions, submissions_content)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        with open(sys.argv[1], "rb") as f:
+            remains = f.read()
+        with open(sys.argv[2], "rb") as f:
+            submissions = f.read()
+    else:
+        remains, submissions = remains_fixture(), submissions_fixture()
+    main(remains, submissions)
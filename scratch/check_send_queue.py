@@ -0,0 +1,162 @@
+"""
+Проверка очереди отправки в Telegram (telegram_queue.TelegramSendQueue) на локальном
+фейковом Bot API: сервер на aiohttp отвечает на sendMessage как Telegram и, как он,
+возвращает 429 с retry_after при превышении лимитов — не чаще раза в
+CHAT_INTERVAL секунд в один чат и не больше GLOBAL_LIMIT запросов за секунду на бота.
+
+Сравниваются последовательная отправка (await на каждое сообщение, как было раньше)
+и очередь — с лимитом ниже серверного и выше него (тогда работает retry_after):
+время постановки, время до последней доставки, число 429 и порядок сообщений
+внутри каждого чата.
+Запуск: python -m scratch.check_send_queue [кол-во чатов] [сообщений в чат]
+"""
+import asyncio
+import sys
+import time
+from collections import defaultdict, deque
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+from new_agri_bot_backend.telegram_queue import TelegramSendQueue
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+PORT = 8765
+TOKEN = "123456:fake-token"
+LATENCY = 0.03
+CHAT_INTERVAL = 1.0
+GLOBAL_LIMIT = 30
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.delivered = defaultdict(list)
+        self.last_by_chat = {}
+        self.recent = deque()
+        self.rejected = 0
+        self.message_id = 0
+
+    def too_many(self, retry_after: int):
+        self.rejected += 1
+        return web.json_response({
+            "ok": False,
+            "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after}",
+            "parameters": {"retry_after": retry_after},
+        })
+
+    async def handle(self, request: web.Request):
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        await asyncio.sleep(LATENCY)
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 1:
+            self.recent.popleft()
+        if len(self.recent) >= GLOBAL_LIMIT:
+            return self.too_many(1)
+        last = self.last_by_chat.get(chat_id)
+        if last is not None and now - last < CHAT_INTERVAL * 0.9:
+            return self.too_many(1)
+        self.recent.append(now)
+        self.last_by_chat[chat_id] = now
+        self.message_id += 1
+        self.delivered[chat_id].append(data["text"])
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data["text"],
+            },
+        })
+
+
+async def start_server(api: FakeBotApi) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/sendMessage", api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+
+def check_order(api: FakeBotApi, chats: int, per_chat: int) -> str:
+    expected = {chat_id: [f"{chat_id}:{i}" for i in range(per_chat)] for chat_id in range(1, chats + 1)}
+    broken = [chat_id for chat_id, texts in expected.items() if api.delivered[chat_id] != texts]
+    return "порядок ок" if not broken else f"порядок нарушен в {len(broken)} чатах"
+
+
+async def run_sequential(bot: Bot, chats: int, per_chat: int):
+    api = FakeBotApi()
+    runner = await start_server(api)
+    start = time.perf_counter()
+    failed = 0
+    for i in range(per_chat):
+        for chat_id in range(1, chats + 1):
+            try:
+                await bot.send_message(chat_id=chat_id, text=f"{chat_id}:{i}")
+            except TelegramRetryAfter:
+                failed += 1
+    elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    print(
+        f"{'последовательно':<16} постановка {elapsed:7.2f} с, доставка {elapsed:6.2f} с, "
+        f"429: {api.rejected:4}, потеряно: {failed}, {check_order(api, chats, per_chat)}"
+    )
+
+
+async def run_queue(bot: Bot, chats: int, per_chat: int, rate: float):
+    api = FakeBotApi()
+    runner = await start_server(api)
+    queue = TelegramSendQueue(rate=rate, chat_interval=CHAT_INTERVAL, concurrency=20, retries=5)
+    callbacks = {"on_sent": 0, "on_error": 0}
+
+    async def on_sent(msg):
+        callbacks["on_sent"] += 1
+
+    async def on_error(error):
+        callbacks["on_error"] += 1
+
+    start = time.perf_counter()
+    futures = [
+        queue.send_message(bot, chat_id, f"{chat_id}:{i}", on_sent=on_sent, on_error=on_error)
+        for chat_id in range(1, chats + 1)
+        for i in range(per_chat)
+    ]
+    enqueued = time.perf_counter() - start
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = sum(isinstance(result, BaseException) for result in results)
+    await runner.cleanup()
+    print(
+        f"{f'очередь {rate:g}/с':<16} постановка {enqueued:7.4f} с, доставка {elapsed:6.2f} с, "
+        f"429: {api.rejected:4}, потеряно: {failed}, {check_order(api, chats, per_chat)}"
+    )
+    print(f"{'':<16} {queue.stats()}, колбэки: {callbacks}")
+    # Future завершается после колбэка: к этому моменту все они уже выполнены
+    assert callbacks["on_sent"] + callbacks["on_error"] == len(futures), "Не все колбэки выполнены"
+
+
+async def main(chats: int, per_chat: int):
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}"))
+    bot = Bot(TOKEN, session=session)
+    print(f"{chats} чатов x {per_chat} сообщений, задержка API {LATENCY * 1000:.0f} мс")
+    try:
+        await run_sequential(bot, chats, per_chat)
+        await run_queue(bot, chats, per_chat, rate=25)
+        # Лимит выше серверного: очередь упирается в 429 и должна дослать все по retry_after
+        await run_queue(bot, chats, per_chat, rate=60)
+    finally:
+        await session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 40,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    ))
@@ -0,0 +1,56 @@
+"""
+Проверка single-flight в cached_endpoint: N одновременных запросов с одинаковыми
+аргументами должны выполнить тело эндпоинта ровно один раз, а ошибка — дойти до всех.
+Запуск: python -m scratch.check_single_flight [кол-во запросов]
+"""
+import asyncio
+import sys
+
+from new_agri_bot_backend.cache import cached_endpoint, db_cache
+
+sys.stdout.reconfigure(encoding='utf-8')
+
+calls = {"ok": 0, "fail": 0}
+
+
+@cached_endpoint(ttl=60)
+async def slow_endpoint(warehouse: str):
+    calls["ok"] += 1
+    await asyncio.sleep(0.2)
+    return {"warehouse": warehouse, "rows": 42}
+
+
+@cached_endpoint(ttl=60)
+async def failing_endpoint(warehouse: str):
+    calls["fail"] += 1
+    await asyncio.sleep(0.2)
+    raise RuntimeError("БД недоступна")
+
+
+async def main(n: int):
+    db_cache.clear()
+
+    results = await asyncio.gather(*(slow_endpoint(warehouse="Склад 1") for _ in range(n)))
+    assert calls["ok"] == 1, calls
+    # Прямой вызов получает декодированный JSON из кэша — каждый раз новый объект
+    assert all(r == {"warehouse": "Склад 1", "rows": 42} for r in results), results[0]
+    print(f"✅ {n} одновременных запросов -> {calls['ok']} выполнение")
+
+    await slow_endpoint(warehouse="Склад 1")
+    assert calls["ok"] == 1, calls
+    print("✅ Повторный запрос взят из кэша")
+
+    errors = await asyncio.gather(
+        *(failing_endpoint(warehouse="Склад 1") for _ in range(n)), return_exceptions=True
+    )
+    assert calls["fail"] == 1, calls
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    print(f"✅ Ошибка одного выполнения получили все {n} запросов")
+
+    await asyncio.gather(*(failing_endpoint(warehouse="Склад 1") for _ in range(2)), return_exceptions=True)
+    assert calls["fail"] == 2, calls
+    print("✅ После ошибки следующий запрос снова идет в БД")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 50))